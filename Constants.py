@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import multiprocessing
+
 
 TEST_TOPICS = [u"פסח", u"תפילה", u"משה", u"אברהם", u"צדקה", u"שבת", u"רות", u"אסתר", u"תשובה", u"חטא", u"חגים",
                u"קהילה", u"ישראל", u"צדק", u"התגלות", u"אהבה", u"מין", u"תפילין", u"סביבה",
@@ -13,4 +15,61 @@ HEBREW_WIKI = False
 DOC2VEC_MODEL = "doc2vec.model" if HEBREW_WIKI else "doc2vec_wo_wiki.model"
 ALL_CLEAN_DOCS_FILENAME = 'cleaned_docs_for_doc2vec.txt'
 DICTA_HEBREW_WIKI_FILENAME = './Hebrew_Wiki_Dicta.txt'
-DICTA_SEFARIA_FILENAME = './sefaria-export_prefix_refs.txt'
\ No newline at end of file
+DICTA_SEFARIA_FILENAME = './sefaria-export_prefix_refs.txt'
+CLEANING_PROCESSES = multiprocessing.cpu_count()
+CLEANING_SHARDS_PER_PROCESS = 4
+CLEANING_SHARD_BYTES = 8 * 1024 * 1024
+FUSED_TOKENIZER = True
+PHRASES_FILENAME = './select_phrases.txt'
+WORD_EXPANDER_FILENAME = './word_expander.bin'
+WORD_EXPANDER_SOURCE_FILENAME = './all_hebrew_inv.json'
+INCREMENTAL_REBUILD = True
+SEGMENT_CACHE_FILENAME = './cleaned_segments.sqlite'
+WRITE_BINARY_CORPUS = True
+BINARY_CORPUS_PREFIX = 'cleaned_docs_for_doc2vec'
+DOC2VEC_EPOCHS = 10
+DOC2VEC_WORKERS = None
+DOC2VEC_CHECKPOINT_DIR = './doc2vec_checkpoints'
+DOC2VEC_CHECKPOINT_EVERY = 1
+DOC2VEC_CHECKPOINTS_TO_KEEP = 2
+LINK_GRAPH_PREFIX = 'link_graph'
+PAGE_RANK_DAMPING = 0.85
+PAGE_RANK_TOLERANCE = 1e-6
+PAGE_RANK_MAX_ITERATIONS = 100
+REF_CACHE_FILENAME = './ref_cache.sqlite'
+REF_CACHE_SIZE = 200000
+IS_REF_MASK_SUFFIX = '.is_ref.npy'
+USE_ANN_INDEX = False
+ANN_INDEX_SUFFIX = '.ivf'
+ANN_INDEX_PREFIX = DOC2VEC_MODEL + ANN_INDEX_SUFFIX
+ANN_NPROBE = 8
+QUERY_SERVER_HOST = '127.0.0.1'
+QUERY_SERVER_PORT = 8080
+QUERY_SERVER_PROCESSES = None
+USE_RESULT_CACHE = True
+RESULT_CACHE_FILENAME = './result_cache.sqlite'
+RESULT_CACHE_SIZE = 10000
+QUANTIZED_VECTORS_SUFFIX = '.quantized'
+QUANTIZED_VECTORS_PREFIX = DOC2VEC_MODEL + QUANTIZED_VECTORS_SUFFIX
+QUANTIZED_DTYPE = 'int8'
+MINED_PHRASES_FILENAME = './mined_phrases.txt'
+PHRASE_MIN_COUNT = 20
+PHRASE_THRESHOLD = 0.5
+PHRASE_MAX_VOCAB = 20000000
+PHRASE_SHARD_MAX_VOCAB = 1000000
+WORD2VEC_MODEL = 'word2vec.model'
+WORD2VEC_EPOCHS = 10
+WORD2VEC_WORKERS = None
+WORD2VEC_PREFETCH_QUEUE_SIZE = 64
+WORD2VEC_PREFETCH_BATCH_SIZE = 256
+INSTRUMENTATION_ENV_VARIABLE = 'TOPIC_INSTRUMENTATION'
+INSTRUMENTATION_REPORT_FILENAME = './instrumentation_{}.json'
+STOPWORDS_FILENAME = './hebrew_stopwords.txt'
+SYNTHETIC_CORPUS_FILENAME = './synthetic_dicta.txt'
+BENCHMARK_BASELINE_FILENAME = './benchmark_baseline.json'
+BENCHMARK_TOLERANCE = 0.2
+USE_LIBRARY_SNAPSHOT = True
+LIBRARY_SNAPSHOT_FILENAME = './library_snapshot.json'
+RANGE_INDEX_PREFIX = 'range_index'
+TANAKH_RANGES_FILENAME = 'level_3_wo_overlaps.json'
+TALMUD_RANGES_DIRECTORY = './sugyot/'
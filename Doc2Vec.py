@@ -2,9 +2,24 @@
 # -*- coding: utf-8 -*-
 
 import gensim as gen
+from gensim.models.callbacks import CallbackAny2Vec
 import codecs
+import glob
+import json
+import os
+import re
+import time
+from optparse import OptionParser
 
-from Constants import ALL_CLEAN_DOCS_FILENAME, DOC2VEC_MODEL
+from Constants import ALL_CLEAN_DOCS_FILENAME, DOC2VEC_MODEL, BINARY_CORPUS_PREFIX, DOC2VEC_EPOCHS, DOC2VEC_WORKERS, \
+    DOC2VEC_CHECKPOINT_DIR, DOC2VEC_CHECKPOINT_EVERY, DOC2VEC_CHECKPOINTS_TO_KEEP
+from cpu_limit import get_cpu_limit
+from binary_corpus import BinaryCorpus, binary_corpus_exists, binary_corpus_stale_reason
+from instrumentation import instrumentation
+
+CHECKPOINT_FILENAME = "doc2vec.epoch{:03d}.model"
+CHECKPOINT_REGEX = re.compile(r"doc2vec\.epoch(\d+)\.model$")
+METRICS_FILENAME = "metrics.jsonl"
 
 
 class SegmentGenerator(object):
@@ -19,14 +34,184 @@ class SegmentGenerator(object):
                 yield gen.models.doc2vec.TaggedDocument(gen.utils.simple_preprocess(data), [ref])
 
 
-print("Creating Segment Generator...")
-segments_generator = SegmentGenerator(ALL_CLEAN_DOCS_FILENAME)
-print("Creating Doc2Vec model...")
-model = gen.models.doc2vec.Doc2Vec(vector_size=100, min_count=2, epochs=40, dm=0, dbow_words=1)
-print("Building Vocab...")
-model.build_vocab(segments_generator)
-print("Training Model...")
-model.train(segments_generator, total_examples=model.corpus_count, epochs=10)
+def load_corpus():
+    """
+    Uses the binary corpus if the cleaning stage wrote one along with the current text corpus, otherwise the text
+    corpus.  Without a text corpus the binary corpus is used as it is
+    :return: Re-iterable corpus of TaggedDocuments
+    """
+    if binary_corpus_exists(BINARY_CORPUS_PREFIX):
+        reason = binary_corpus_stale_reason(BINARY_CORPUS_PREFIX, ALL_CLEAN_DOCS_FILENAME) \
+            if os.path.exists(ALL_CLEAN_DOCS_FILENAME) else None
+        if reason is None:
+            print("Loading Binary Corpus...")
+            return BinaryCorpus(BINARY_CORPUS_PREFIX)
+        print("Not using the binary corpus, {}".format(reason))
+    print("Creating Segment Generator...")
+    return SegmentGenerator(ALL_CLEAN_DOCS_FILENAME)
+
+
+def find_checkpoints(checkpoint_dir):
+    """
+    :param checkpoint_dir: Directory checkpoints are saved in
+    :return: List of (epoch, path) of every checkpoint, sorted by epoch
+    """
+    checkpoints = []
+    for path in glob.glob(os.path.join(checkpoint_dir, "doc2vec.epoch*.model")):
+        match = CHECKPOINT_REGEX.search(path)
+        if match:
+            checkpoints.append((int(match.group(1)), path))
+    return sorted(checkpoints)
+
+
+def save_model(model, path):
+    """
+    Saves a model without the callbacks of the current training run, so that it can be loaded anywhere
+    :param model: Doc2Vec Model
+    :param path: Path to save the model to
+    """
+    callbacks, model.callbacks = getattr(model, 'callbacks', ()), ()
+    try:
+        model.save(path)
+    finally:
+        model.callbacks = callbacks
+
+
+def remove_model(path):
+    """
+    Removes a saved model along with the arrays gensim stored next to it
+    :param path: Path of the saved model
+    """
+    for filename in glob.glob(path) + glob.glob(path + ".*.npy"):
+        os.remove(filename)
+
+
+class TrainingMonitor(CallbackAny2Vec):
+    """
+    Reports throughput and elapsed time after every epoch and saves a checkpoint every n epochs.
+    Metrics are appended to metrics.jsonl in the checkpoint directory.  gensim does not compute a training loss for
+    Doc2Vec, so training_loss is always recorded as null rather than as a number that looks measured.
+    """
+    def __init__(self, checkpoint_dir, checkpoint_every, checkpoints_to_keep, first_epoch=0):
+        """
+        :param checkpoint_dir: Directory checkpoints are saved in
+        :param checkpoint_every: Number of epochs between checkpoints
+        :param checkpoints_to_keep: Number of most recent checkpoints that are kept
+        :param first_epoch: Number of epochs that were trained before this run started
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_every = checkpoint_every
+        self.checkpoints_to_keep = checkpoints_to_keep
+        self.epoch = first_epoch
+        self.training_start = time.time()
+        self.epoch_start = None
+
+    def on_epoch_begin(self, model):
+        self.epoch_start = time.time()
+
+    def on_epoch_end(self, model):
+        self.epoch += 1
+        now = time.time()
+        epoch_seconds = now - self.epoch_start
+        metrics = {
+            "epoch": self.epoch,
+            "epoch_seconds": epoch_seconds,
+            "elapsed_seconds": now - self.training_start,
+            "words_per_second": model.corpus_total_words / max(epoch_seconds, 1e-9),
+            "training_loss": None,
+        }
+        print("Epoch {epoch}: {epoch_seconds:.1f}s, {words_per_second:.0f} words/s, elapsed {elapsed_seconds:.1f}s"
+              .format(**metrics))
+        with open(os.path.join(self.checkpoint_dir, METRICS_FILENAME), 'a') as the_file:
+            the_file.write(json.dumps(metrics) + "\n")
+
+        if self.epoch % self.checkpoint_every == 0:
+            path = os.path.join(self.checkpoint_dir, CHECKPOINT_FILENAME.format(self.epoch))
+            print("Saving checkpoint {}...".format(path))
+            save_model(model, path)
+            for _, old_path in find_checkpoints(self.checkpoint_dir)[:-self.checkpoints_to_keep]:
+                remove_model(old_path)
+
+
+def train_doc2vec(corpus, epochs, workers, checkpoint_dir, checkpoint_every, checkpoints_to_keep, resume=True):
+    """
+    Trains a Doc2Vec Model, resuming from the latest checkpoint if there is one.
+    The learning rate decays linearly over all epochs, across resumes, the same way it would in one uninterrupted run.
+    train() overwrites the alpha and epochs of the model, so the schedule is computed from the training_schedule
+    stored on the model when it was created, which checkpoints carry along.
+    :param corpus: Re-iterable corpus of TaggedDocuments
+    :param epochs: Total number of epochs
+    :param workers: Number of worker threads
+    :param checkpoint_dir: Directory checkpoints are saved in
+    :param checkpoint_every: Number of epochs between checkpoints
+    :param checkpoints_to_keep: Number of most recent checkpoints that are kept
+    :param resume: If False, removes existing checkpoints and starts over
+    :return: Trained Doc2Vec Model
+    """
+    if not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+
+    if not resume:
+        for _, old_path in find_checkpoints(checkpoint_dir):
+            remove_model(old_path)
+        if os.path.exists(os.path.join(checkpoint_dir, METRICS_FILENAME)):
+            os.remove(os.path.join(checkpoint_dir, METRICS_FILENAME))
+
+    checkpoints = find_checkpoints(checkpoint_dir)
+    if checkpoints:
+        first_epoch, path = checkpoints[-1]
+        print("Resuming from {} (epoch {})...".format(path, first_epoch))
+        model = gen.models.doc2vec.Doc2Vec.load(path)
+        model.workers = workers
+    else:
+        first_epoch = 0
+        print("Creating Doc2Vec model with {} workers...".format(workers))
+        model = gen.models.doc2vec.Doc2Vec(vector_size=100, min_count=2, epochs=epochs, dm=0, dbow_words=1,
+                                           workers=workers)
+        model.training_schedule = {"alpha": model.alpha, "min_alpha": model.min_alpha, "epochs": epochs}
+        print("Building Vocab...")
+        with instrumentation.stage("vocabulary") as stage:
+            model.build_vocab(corpus)
+            stage.add(model.corpus_count)
+
+    if first_epoch >= epochs:
+        return model
+
+    schedule = getattr(model, 'training_schedule', None)
+    if schedule is None:
+        print("Checkpoint has no training schedule, using its current learning rate")
+        schedule = model.training_schedule = {"alpha": model.alpha, "min_alpha": model.min_alpha, "epochs": epochs}
+    if schedule["epochs"] != epochs:
+        print("Checkpoint was scheduled for {} epochs, decaying over {} instead".format(schedule["epochs"], epochs))
+        schedule["epochs"] = epochs
+    alpha_decay = (schedule["alpha"] - schedule["min_alpha"]) / epochs
+    start_alpha = schedule["alpha"] - alpha_decay * first_epoch
+    monitor = TrainingMonitor(checkpoint_dir, checkpoint_every, checkpoints_to_keep, first_epoch)
+    print("Training Model from epoch {} to {}, alpha {:.5f}...".format(first_epoch + 1, epochs, start_alpha))
+    with instrumentation.stage("training", model.corpus_count * (epochs - first_epoch)):
+        model.train(corpus, total_examples=model.corpus_count, epochs=epochs - first_epoch,
+                    start_alpha=start_alpha, end_alpha=schedule["min_alpha"], callbacks=[monitor])
+    return model
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-w", "--workers", dest="workers", action="store", type="int", default=DOC2VEC_WORKERS)
+    parser.add_option("-e", "--epochs", dest="epochs", action="store", type="int", default=DOC2VEC_EPOCHS)
+    parser.add_option("-d", "--checkpoint-dir", dest="checkpoint_dir", action="store", type="string",
+                      default=DOC2VEC_CHECKPOINT_DIR)
+    parser.add_option("-c", "--checkpoint-every", dest="checkpoint_every", action="store", type="int",
+                      default=DOC2VEC_CHECKPOINT_EVERY)
+    parser.add_option("-k", "--keep", dest="checkpoints_to_keep", action="store", type="int",
+                      default=DOC2VEC_CHECKPOINTS_TO_KEEP)
+    parser.add_option("--fresh", dest="resume", action="store_false", default=True)
+    (options, args) = parser.parse_args()
+
+    segments_generator = load_corpus()
+    model = train_doc2vec(segments_generator, options.epochs, options.workers or get_cpu_limit(),
+                          options.checkpoint_dir, options.checkpoint_every, options.checkpoints_to_keep,
+                          options.resume)
 
-print("Saving Model...")
-model.save(DOC2VEC_MODEL)
+    print("Saving Model...")
+    save_model(model, DOC2VEC_MODEL)
+    instrumentation.write_report("Doc2Vec")
@@ -5,34 +5,31 @@ import codecs
 import json
 from gensim.models import Doc2Vec
 from collections import Counter
-from scipy import spatial
-
-from Constants import TEST_TOPICS, DOC2VEC_MODEL
-from create_docs_for_doc2vec import get_tanakh_topic_ranges, get_talmud_topic_ranged, segment_range_dicts, \
-    create_list_off_talmud_books, create_list_off_tanakh_books
-
-import local_settings
-import django
-
-django.setup()
-
-from sefaria.model import *
-from sefaria.system.exceptions import InputError, PartialRefInputError
-
-
-def get_ref_score(topic, ref, model):
-    """
-    Calculated the Cosine Similarity between a word vector and a doc vector
-    :param ref: A ref of a particular doc in Doc2Vec
-    :param model: The Doc2Vec Model
-    :return: Cosine Similarity
-    """
-    score = 0
-    try:
-        score = 1-spatial.distance.cosine(model.docvecs[ref], model[topic])
-    except KeyError:
-        pass
-    return score
+import numpy as np
+
+from Constants import TEST_TOPICS, DOC2VEC_MODEL, LINK_GRAPH_PREFIX, PAGE_RANK_DAMPING, PAGE_RANK_TOLERANCE, \
+    PAGE_RANK_MAX_ITERATIONS, USE_ANN_INDEX, ANN_INDEX_SUFFIX, ANN_NPROBE, USE_RESULT_CACHE, RESULT_CACHE_FILENAME, \
+    RESULT_CACHE_SIZE, RANGE_INDEX_PREFIX, IS_REF_MASK_SUFFIX, TANAKH_RANGES_FILENAME, TALMUD_RANGES_DIRECTORY, \
+    LIBRARY_SNAPSHOT_FILENAME, QUANTIZED_VECTORS_SUFFIX
+from doc_vector_index import TAGS_DIGEST_SUFFIX
+from ann_index import IVFIndex, ann_index_is_current, load_doc_vector_index
+from quantized_vectors import QuantizedModel
+from link_graph import LinkGraph, link_graph_exists
+from page_rank import build_link_matrix, personalized_page_rank
+from ref_cache import ref_cache
+from result_cache import ResultCache, files_fingerprint
+from instrumentation import instrumentation
+from range_index import RangeIndex
+from ref_engine import setup_sefaria, get_ref_engine
+from create_docs_for_doc2vec import get_tanakh_topic_ranges, get_talmud_topic_ranged, build_title_resolver
+
+link_graph = None
+range_index = None
+use_ann_index = USE_ANN_INDEX
+model_filenames = {}
+missing_links_reported = set()
+title_resolver = None
+result_cache = None
 
 
 def convert_to_range(tref):
@@ -41,7 +38,10 @@ def convert_to_range(tref):
     :param tref: Ref
     :return: Ranged Ref
     """
-    return segment_to_ranged[tref]
+    ranged_ref = range_index.lookup(tref)
+    if ranged_ref is None:
+        raise KeyError(tref)
+    return ranged_ref
 
 
 def convert_select_segs_to_ranged_refs(references):
@@ -53,7 +53,7 @@ def convert_select_segs_to_ranged_refs(references):
     """
     updated_set = set()
     for tref in references:
-        if is_from_category(tref, tanakh_and_talmud):
+        if title_resolver.category(tref) is not None:
             updated_set.add(convert_to_range(tref))
         else:
             updated_set.add(tref)
@@ -68,9 +68,8 @@ def expand_all_ranged_refs(sources_to_add):
     """
     new_list = []
     for tref in sources_to_add:
-        oref = Ref(tref)
-        if oref.is_range():
-            new_list += [x.normal() for x in oref.range_list()]
+        if ref_cache.is_range(tref):
+            new_list += ref_cache.segments(tref)
         else:
             new_list.append(tref)
     return new_list
@@ -94,10 +93,7 @@ def ref_is_not_ranged(tref):
     :param tref: Ref
     :return: Boolean Value indicating if the Ref is segment level
     """
-    try:
-        return not Ref(tref).is_range()
-    except InputError:
-        return False
+    return ref_cache.is_range(tref) is False
 
 
 def ref_is_segment_level(tref):
@@ -106,26 +102,184 @@ def ref_is_segment_level(tref):
     :param tref: Ref
     :return: Boolean Value indicating if the Ref is segment level
     """
+    if link_graph is not None:
+        is_segment_level = link_graph.is_segment_level(tref)
+        if is_segment_level is not None:
+            return is_segment_level
+    return bool(ref_cache.is_segment_level(tref))
+
+
+def prepare_evaluation():
+    """
+    Loads everything evaluating a model needs besides the model itself:
+    the ranged Refs of Tanakh and Talmud, the title resolver and the link graph
+    """
+    global range_index, title_resolver
+    tanakh_topic_ranged_refs = get_tanakh_topic_ranges()
+    talmud_topic_ranged_refs = get_talmud_topic_ranged()
+
+    range_index = RangeIndex.load_or_build(tanakh_topic_ranged_refs + talmud_topic_ranged_refs, RANGE_INDEX_PREFIX)
+
+    title_resolver = build_title_resolver()
+    load_link_graph()
+
+
+def load_model(model_filename=DOC2VEC_MODEL, mmap=None, quantized_dtype=None):
+    """
+    Loads a Doc2Vec Model and remembers its filename, since the Ref mask and the ANN index of a model are saved next
+    to it
+    :param model_filename: Name of the Doc2Vec Model
+    :param mmap: Passed on to Doc2Vec.load, 'r' memory-maps the arrays of the model
+    :param quantized_dtype: "float16" or "int8" to serve from the quantized vectors exported next to the model
+        instead, None for the model itself
+    :return: Doc2Vec Model, or QuantizedModel
+    """
+    if quantized_dtype:
+        model = QuantizedModel(model_filename + QUANTIZED_VECTORS_SUFFIX, quantized_dtype)
+    else:
+        model = Doc2Vec.load(model_filename, mmap=mmap)
+    model_filenames[id(model)] = model_filename
+    return model
+
+
+def get_model_filename(model):
+    """
+    :param model: Doc2Vec Model
+    :return: Name of the file the model was loaded from with load_model, DOC2VEC_MODEL otherwise
+    """
+    return model_filenames.get(id(model), DOC2VEC_MODEL)
+
+
+def load_result_cache(model_filename=DOC2VEC_MODEL):
+    """
+    Opens the result cache of a model if USE_RESULT_CACHE is set.
+    Cached results are dropped whenever the model, the ANN index, the link graph, the topic ranges or the library
+    snapshot changed since they were computed.  The Ref mask is left out, it is derived from the model and written
+    after the cache is opened.
+    :param model_filename: Name of the Doc2Vec Model results are computed with
+    """
+    global result_cache
+    if USE_RESULT_CACHE:
+        version = files_fingerprint([model_filename, model_filename + ANN_INDEX_SUFFIX, LINK_GRAPH_PREFIX,
+                                     TANAKH_RANGES_FILENAME, TALMUD_RANGES_DIRECTORY + '*', LIBRARY_SNAPSHOT_FILENAME],
+                                    [IS_REF_MASK_SUFFIX, IS_REF_MASK_SUFFIX + TAGS_DIGEST_SUFFIX])
+        result_cache = ResultCache(RESULT_CACHE_FILENAME, version, RESULT_CACHE_SIZE)
+
+
+def related_sources_key(model, topic, threshold, n, topn):
+    """
+    :return: Result cache key of the related sources of a topic, including every parameter that changes them
+    """
+    return ResultCache.make_key(u"related_sources", topic, threshold, n, topn, PAGE_RANK_DAMPING, PAGE_RANK_TOLERANCE,
+                                PAGE_RANK_MAX_ITERATIONS, use_ann_index, ANN_NPROBE, getattr(model, 'dtype', None))
+
+
+def load_link_graph(prefix=LINK_GRAPH_PREFIX):
+    """
+    Loads the exported link graph, if there is one, so that links are looked up without the database
+    :param prefix: Path prefix of the link graph files
+    """
+    global link_graph
+    if link_graph_exists(prefix):
+        link_graph = LinkGraph(prefix)
+    elif get_ref_engine() is not None:
+        report_missing_links(None)
+
+
+def report_missing_links(tref):
+    """
+    Prints, once per cause, why Refs have no links while the library snapshot stands in for Sefaria
+    :param tref: Ref whose links were looked up, None when no link graph was found at startup
+    """
+    cause = u"no link graph" if link_graph is None else u"not in link graph"
+    if cause in missing_links_reported:
+        return
+    missing_links_reported.add(cause)
+    if link_graph is None:
+        print(u"WARNING: the library snapshot stands in for Sefaria and no link graph was loaded from {}, so link "
+              u"expansion and PageRank run without links.  Run export_link_graph.py".format(LINK_GRAPH_PREFIX))
+    else:
+        print(u"WARNING: {} is not in the link graph and the library snapshot stands in for Sefaria, so it has no "
+              u"links.  Further Refs missing from the link graph are not reported".format(tref).encode('utf8'))
+
+
+def linkset_refs(tref):
+    """
+    Finds every Ref linked to a particular Ref using the Sefaria link store.
+    When the library snapshot stands in for Sefaria, only the exported link graph knows links, and Refs that are not
+    in it have none, which is reported once.
+    :param tref: Selected Ref
+    :return: List of all Refs linked to selected Ref, empty for partial Refs or without Sefaria
+    """
+    if not setup_sefaria():
+        report_missing_links(tref)
+        return []
+    from sefaria.model import Ref
+    from sefaria.system.exceptions import PartialRefInputError
     try:
-        return Ref(tref).is_segment_level()
-    except InputError:
-        return False
+        oref = Ref(tref)
+        return [x for l in oref.linkset() for x in l.refs if x != tref]
+    except PartialRefInputError:
+        return []
 
 
 def all_refs_linked_to_this_ref(tref, segment_level=False):
     """
-    Finds every Ref linked to a particular Ref
+    Finds every Ref linked to a particular Ref.
+    Uses the exported link graph when it is loaded and contains the Ref, otherwise the Sefaria link store
     :param tref: Selected Ref
     :param segment_level: If True, will only include segment level Refs
     :return: List of all Refs linked to selected Ref
     """
-    oref = Ref(tref)
-    all_refs = [x for l in oref.linkset() for x in l.refs if x != tref]
+    if link_graph is not None:
+        all_refs = link_graph.linked_refs(tref, segment_level)
+        if all_refs is not None:
+            return all_refs
+    all_refs = linkset_refs(tref)
     if segment_level:
         all_refs = [x for x in all_refs if ref_is_segment_level(x)]
     return all_refs
 
 
+doc_vector_indexes = {}
+
+
+def get_doc_vector_index(model):
+    """
+    Builds the DocVectorIndex of a model once and reuses it afterwards.
+    Which doc tags are Refs is computed once and cached next to the file the model was loaded from.
+    A QuantizedModel only holds the doc vectors of Refs, which are used as they are.
+    :param model: Doc2Vec Model or QuantizedModel
+    :return: DocVectorIndex whose valid mask marks the doc tags that are Refs, or QuantizedVectors
+    """
+    if isinstance(model, QuantizedModel):
+        return model.docs
+    if id(model) not in doc_vector_indexes:
+        doc_vector_indexes[id(model)] = load_doc_vector_index(model, get_model_filename(model))
+    return doc_vector_indexes[id(model)]
+
+
+ann_indexes = {}
+
+
+def get_query_index(model):
+    """
+    Picks the index threshold queries are answered with.  This is the approximate IVFIndex saved next to the model,
+    if use_ann_index is set and the index was built after the model was last trained, otherwise the exact index.
+    :param model: Doc2Vec Model
+    :return: IVFIndex or DocVectorIndex
+    """
+    model_filename = get_model_filename(model)
+    prefix = model_filename + ANN_INDEX_SUFFIX
+    if not use_ann_index or isinstance(model, QuantizedModel) or not ann_index_is_current(prefix, model_filename):
+        return get_doc_vector_index(model)
+    if id(model) not in ann_indexes:
+        print("Answering threshold queries approximately with the ANN index {}".format(prefix))
+        ann_indexes[id(model)] = IVFIndex.load(prefix)
+    return ann_indexes[id(model)]
+
+
+@instrumentation.timed("retrieval")
 def get_closest_related_sources(model, topic, threshold):
     """
     Returns a list of closest DocIDs to a particularly word or doc based on the Cosine Similarity.
@@ -137,98 +291,155 @@ def get_closest_related_sources(model, topic, threshold):
     :return: A list of sources that are above the Cosine Similarity Threshold
     """
     print topic
-    topn = 1000
-    x = 1
-    while x > threshold:
-        topic_sources = model.docvecs.most_similar([model[topic]], topn=topn)
-        x = topic_sources[-1][1]
-        topn *= 2
-    sources_above_threshold = [x[0] for x in topic_sources if x[1] > threshold]
-    sources_above_threshold = [x for x in sources_above_threshold if Ref.is_ref(x)]
-    return sources_above_threshold
+    return [tref for tref, _ in get_query_index(model).query(model[topic], threshold)]
 
 
-def add_popular_links(related_sources):
+@instrumentation.timed("retrieval", count_items=len)
+def get_closest_related_sources_batch(model, topics, threshold):
+    """
+    Same as get_closest_related_sources for many topics at once, scored with matrix-matrix products
+    :param model: Doc2Vec Model
+    :param topics: List of Docs or Words you want to Query
+    :param threshold: Cosine Similarity Threshold
+    :return: Dict mapping each topic to a list of sources that are above the Cosine Similarity Threshold
+    """
+    all_topic_sources = get_query_index(model).query_batch([model[topic] for topic in topics], threshold)
+    return dict((topic, [tref for tref, _ in topic_sources]) for topic, topic_sources in zip(topics, all_topic_sources))
+
+
+@instrumentation.timed("link expansion")
+def add_popular_links(related_sources, n=5):
     """
     Expands a list of Refs to include all Refs that are one degree of separation from any of the Refs in the original list.
     In other words, this expanded list of Refs will include the original set of Refs along with any Ref that is linked to those original Refs
     :param related_sources: List of Refs
+    :param n: Minimum number of links from the original Refs for a linked Ref to be added
     :return: Expanded list of Refs
     """
     set_of_related = set(related_sources)
     sources_to_add = []
     for tref in related_sources:
-        try:
-            sources_to_add += all_refs_linked_to_this_ref(tref, segment_level=True)
-        except PartialRefInputError:
-            continue
+        sources_to_add += all_refs_linked_to_this_ref(tref, segment_level=True)
     sources_to_add = expand_all_ranged_refs(sources_to_add)
-    popular_links = more_than_n_occurrence(sources_to_add, n=5)
+    popular_links = more_than_n_occurrence(sources_to_add, n=n)
     popular_links = convert_select_segs_to_ranged_refs(popular_links)
     set_of_related.update(popular_links)
     return set_of_related
 
 
-def page_rank_score(topic, set_of_related, model):
+@instrumentation.timed("reranking", count_items=len)
+def page_rank_scores_batch(model, topics_and_related, damping=PAGE_RANK_DAMPING, tolerance=PAGE_RANK_TOLERANCE,
+                           max_iterations=PAGE_RANK_MAX_ITERATIONS):
     """
     Gensim's most_similar returns a list of most similar order by Cosine Similarity.  This Methods aims to use a
     pagerank style approach to re-order selected sources in a more fitting way for Sefaria.
-    The sources that have more incoming links will be have more Value
+    Runs personalized PageRank over the links between the segment level sources of each topic, teleporting to each
+    source in proportion to its Cosine Similarity to the topic.  All topics are ranked together, as one matrix.
+    :param model: Doc2Vec Model
+    :param topics_and_related: Dict mapping each topic to the set of sources to be re-ordered
+    :param damping: Probability of following a link instead of teleporting
+    :param tolerance: Convergence tolerance of the power iteration
+    :param max_iterations: Upper bound on the number of power iterations
+    :return: Dict mapping each topic to a dict of its segment level sources and their PageRank scores
+    """
+    topics = list(topics_and_related)
+    nodes = sorted(set(tref for topic in topics for tref in topics_and_related[topic] if ref_is_segment_level(tref)))
+    if not topics or not nodes:
+        return dict((topic, {}) for topic in topics)
+    link_matrix = build_link_matrix(nodes, lambda tref: all_refs_linked_to_this_ref(tref, segment_level=True))
+    teleport = get_doc_vector_index(model).scores_batch(nodes, [model[topic] for topic in topics])
+    candidates = np.array([[tref in topics_and_related[topic] for topic in topics] for tref in nodes], dtype=bool)
+    ranks = personalized_page_rank(link_matrix, teleport, candidates, damping, tolerance, max_iterations)
+    results = {}
+    for column, topic in enumerate(topics):
+        rows = np.flatnonzero(candidates[:, column])
+        results[topic] = dict((nodes[row], float(ranks[row, column])) for row in rows)
+    return results
+
+
+def page_rank_score(topic, set_of_related, model):
+    """
+    Re-orders the sources of a single topic, see page_rank_scores_batch
     :param set_of_related: List of sources to be re-ordered
     :param model: Doc2Vec Model
     :return: Sources with updated scores
     """
-    scores_of_related_sources = {}
-    for tref in set_of_related:
-        if not ref_is_segment_level(tref):
-            continue
-        scores_of_related_sources[tref] = get_ref_score(topic, tref, model)
-        all_refs = all_refs_linked_to_this_ref(tref, segment_level=True)
-        scores_of_related_sources[tref] += sum([get_ref_score(topic, x, model) for x in all_refs if x in set_of_related])
-    return scores_of_related_sources
+    return page_rank_scores_batch(model, {topic: set(set_of_related)})[topic]
 
 
-def evaluate_model_topics(model, test_topics):
+def evaluate_model_topics(model, test_topics, threshold=0.6, n=5, topn=100):
     """
-    Evaluates a Doc2Vec Model's ability to predict related sources given a variety of different topics
+    Evaluates a Doc2Vec Model's ability to predict related sources given a variety of different topics.
+    Topics found in the result cache are not computed again, and the ones that are computed are added to it.
     :param model: Doc2Vec Model
     :param test_topics: List of Topics to test the model
+    :param threshold: Cosine Similarity Threshold
+    :param n: Minimum number of links for add_popular_links to add a linked Ref
+    :param topn: Number of predicted sources per topic
     :return: Dict with a list of predicted sources for each test topic
     """
     topics_and_related_sources = {}
     for topic in test_topics:
-        related_sources = get_closest_related_sources(model, topic, threshold=0.6)
-        related_sources = add_popular_links(related_sources)
-        final_scores = page_rank_score(topic, related_sources, model)
-        final_scores = sorted(final_scores.items(), key=lambda x: x[1], reverse=True)
-        topics_and_related_sources[topic] = final_scores[:100]
+        if result_cache is not None:
+            cached = result_cache.get(related_sources_key(model, topic, threshold, n, topn))
+            if cached is not None:
+                topics_and_related_sources[topic] = cached
+    missing_topics = [topic for topic in test_topics if topic not in topics_and_related_sources]
+    if not missing_topics:
+        return topics_and_related_sources
+
+    all_related_sources = get_closest_related_sources_batch(model, missing_topics, threshold=threshold)
+    topics_and_related = {}
+    for topic in missing_topics:
+        print topic
+        topics_and_related[topic] = add_popular_links(all_related_sources[topic], n=n)
+    all_final_scores = page_rank_scores_batch(model, topics_and_related)
+    for topic in missing_topics:
+        final_scores = sorted(all_final_scores[topic].items(), key=lambda x: x[1], reverse=True)
+        topics_and_related_sources[topic] = final_scores[:topn]
+        if result_cache is not None:
+            result_cache.put(related_sources_key(model, topic, threshold, n, topn), final_scores[:topn])
     return topics_and_related_sources
 
 
-def is_from_category(ref, books_in_category):
+def evaluate_topic(model, topic, threshold=0.6, n=5, topn=100):
+    """
+    Predicts the related sources of a single topic, the same way evaluate_model_topics does
+    :param model: Doc2Vec Model
+    :param topic: Topic to test the model
+    :param threshold: Cosine Similarity Threshold
+    :param n: Minimum number of links for add_popular_links to add a linked Ref
+    :param topn: Number of predicted sources
+    :return: List of the top (source, score) pairs
     """
-    Checks to see if a tref belongs to a list of book within a particular category
-    For Example:  Is Genesis 12:3 within Tanakh
-    :param ref: tref to be examined
-    :param books_in_category: List of books in category
-    :return: Boolean Value determining if Tref is within category
+    key = related_sources_key(model, topic, threshold, n, topn)
+    if result_cache is not None:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+    related_sources = add_popular_links(get_closest_related_sources(model, topic, threshold=threshold), n=n)
+    final_scores = page_rank_score(topic, related_sources, model)
+    final_scores = sorted(final_scores.items(), key=lambda x: x[1], reverse=True)[:topn]
+    if result_cache is not None:
+        result_cache.put(key, final_scores)
+    return final_scores
+
+
+def evaluate_words(model, topic):
     """
-    try:
-        if Ref(ref).index.title in books_in_category:
-            return True
-        else:
-            return False
-    except InputError:
-        return False
+    :param model: Doc2Vec Model
+    :param topic: Topic to test the model
+    :return: List of the 20 (word, score) pairs most similar to the topic
+    """
+    similar_words = model.most_similar([model[topic]], topn=20)
+    return sorted(similar_words, key=lambda tup: tup[1], reverse=True)
 
 
 def evaluate_model_words(model, test_topics):
     results = {}
     for topic in test_topics:
         print topic
-        similar_words = model.most_similar([model[topic]], topn=20)
-        similar_words = sorted(similar_words, key=lambda tup: tup[1], reverse=True)
-        results[topic] = similar_words
+        results[topic] = evaluate_words(model, topic)
     return results
 
 
@@ -238,17 +449,19 @@ def save_dict_in_json(obj, filename):
 
 
 if __name__ == "__main__":
-    tanakh_topic_ranged_refs = get_tanakh_topic_ranges()
-    talmud_topic_ranged_refs = get_talmud_topic_ranged()
-
-    _, segment_to_ranged = segment_range_dicts(tanakh_topic_ranged_refs + talmud_topic_ranged_refs)
+    prepare_evaluation()
+    load_result_cache(DOC2VEC_MODEL)
 
-    tanakh_and_talmud = create_list_off_tanakh_books() | create_list_off_talmud_books()
-
-    model = Doc2Vec.load(DOC2VEC_MODEL)
+    model = load_model(DOC2VEC_MODEL)
 
     topics_with_related_words = evaluate_model_words(model, TEST_TOPICS)
     topics_with_related_sources = evaluate_model_topics(model, TEST_TOPICS)
 
     save_dict_in_json(topics_with_related_words, 'test_words.json')
     save_dict_in_json(topics_with_related_sources, 'test_topics.json')
+
+    ref_cache.commit()
+    print ref_cache.report()
+    if result_cache is not None:
+        print result_cache.report()
+    instrumentation.write_report("Doc2Vec_test_model")
@@ -1,195 +1,207 @@
-
-# coding: utf-8
-
-# In[1]:
-
-
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-
-# In[236]:
-
-
 import warnings; warnings.simplefilter('ignore')
 import gensim as gen
-import json
 import codecs
-import bleach
-import re
+import os
+import threading
+import time
 from optparse import OptionParser
 
-parser = OptionParser()
-parser.add_option("-f", "--file", dest="file", action="store", type="string")
-(options, args) = parser.parse_args()
-
-dicta_prefixes = options.file
-
-
-import local_settings
-import django
-django.setup()
-
-from sefaria.model import *
-
-
-# In[39]:
-
-
-def get_rid_of_stopwords(data):
-    data = remove_dicta_prefix(data)
-    data = data.split()
-    return ' '.join([word for word in data if word not in stopwords])
-
-def remove_dicta_prefix(data):
-    data = re.sub(ur'[\u05d0-\u05ea]+┉', u'', data)
-    return data
-
-def remove_punctuation(data):
-    data = re.sub(ur'־', u' ', data)
-    data = re.sub(ur'\([^)]+\)', u'', data)
-    data = re.sub(ur'\[[^\]]+\]', u'', data)
-    data = re.sub(ur'[^ \u05d0-\u05ea"\'״׳]', u'', data)
-    data = re.sub(ur'\s["״]', u' ', data)
-    data = re.sub(ur'["״]\s', u' ', data)
-    return data
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
 
-def clean_data(data):
-    data = data.split('~~')[1]
-    data = bleach.clean(data, tags=[], strip=True)
-    data = remove_punctuation(data)
-    return data
+from Constants import ALL_CLEAN_DOCS_FILENAME, WORD2VEC_MODEL, WORD2VEC_EPOCHS, WORD2VEC_WORKERS, \
+    WORD2VEC_PREFETCH_QUEUE_SIZE, WORD2VEC_PREFETCH_BATCH_SIZE
+from cpu_limit import get_cpu_limit
 
-def read_in_chunks(file_object):
-    """Lazy function (generator) to read a file line by line"""
-    while True:
-        data = file_object.readline().strip()
-        if not data:
-            break
-        if '~~' not in data:
-            continue
-        data = get_rid_of_stopwords(data)
-        data = clean_data(data)
-        yield data
+MODES = ["plain", "prefetch", "corpus_file"]
+END_OF_CORPUS = object()
 
 
-# In[40]:
-
-
-f = open('./sefaria-export_prefix_refs.txt')
-g = read_in_chunks(f)
-
-
-# In[41]:
-
-
-print(g.next())
-
-
-# In[243]:
-
-
-class SegmentGenerator(object):
-    def __init__(self, filename, stopwords_filename, tokenizer=None):
-        self.file = open(filename)
-        self.stopwords = open(stopwords_filename).read().split('\n')
-#         self.tokenizer = tokenize
-        
-    def get_rid_of_stopwords(self, data):
-        data = self.remove_dicta_prefix(data)
-        data = data.split()
-        return ' '.join([word for word in data if word not in self.stopwords])
-
-    def remove_dicta_prefix(self, data):
-        data = re.sub(ur'[\u05d0-\u05ea]+┉', u'', data)
-        return data
-
-    def remove_punctuation(self, data):
-        data = re.sub(ur'־', u' ', data)
-        data = re.sub(ur'\([^)]+\)', u'', data)
-        data = re.sub(ur'\[[^\]]+\]', u'', data)
-        data = re.sub(ur'[^ \u05d0-\u05ea"\'״׳]', u'', data)
-        data = re.sub(ur'\s["״]', u' ', data)
-        data = re.sub(ur'["״]\s', u' ', data)
-        return data
-
-    def clean_data(self, data):
-        data = data.split('~~')[1]
-        data = bleach.clean(data, tags=[], strip=True)
-        data = self.remove_punctuation(data)
-        return data
+class CleanCorpusReader(object):
+    """
+    Re-iterable reader of the cleaned corpus written by create_docs_for_doc2vec.
+    Every iteration opens the file again, so the same reader can be passed to build_vocab and to train.
+    The corpus is already cleaned, so each line is only split into words.
+    """
+    def __init__(self, filename):
+        """
+        :param filename: Name of the cleaned corpus, in the ref||||text format
+        """
+        self.filename = filename
 
     def __iter__(self):
-#         yield 5
-        for data in self.file:
-#             data = open(self.filename).readline().strip()
-            if not data:
-                raise StopIteration
-            if '~~' not in data:
-                continue
-            data = self.get_rid_of_stopwords(data)
-            data = self.clean_data(data)
-            yield data.split()
-        
-
-
-# Initiate a SegmentGenerator object to pass to the model
-
-# In[244]:
-
-
-dicta_prefix_file = './sefaria-export_prefix_refs.txt'  
-stopwords_file = './hebrew_stopwords.txt'
-
-segments = SegmentGenerator(dicta_prefixes, stopwords_file)
-
-
-# In[235]:
-
-
-print(next(segments.__iter__()))
-
-
-# ### Model intiation
-
-# In[245]:
-
-
-model = gen.models.Word2Vec(size=100, window=5)
-
-
-# Now we have initiated the Word2Vec model. The next step is to call the **build_vocab** method for the preliminary scan of the text. Call the method and print how many words are in the vocabulary of our text
-
-# In[246]:
-
-
-model.build_vocab(segments)
-print("Number of words in vocabulary: {}".format(len(model.wv.vocab)))
-
-
-# In the previous step we created the vocabulary for our model, it is now time to train! Don't forget to add the following parameters:
-# 1. total_examples=model.corpus_count 
-# 2. epochs=model.epochs
-
-# In[248]:
-
-
-segments = SegmentGenerator(dicta_prefix_file, stopwords_file)
-
-
-# In[ ]:
-
-
-model.train(segments, total_examples=model.corpus_count, epochs=10)
-
-
-# Test a few words
-
-# In[ ]:
-
-
-WORD = ________
-
-
-
+        with codecs.open(self.filename, 'rb', encoding='utf8') as the_file:
+            for line in the_file:
+                words = line.split(u"||||", 1)[-1].split()
+                if words:
+                    yield words
+
+
+class PrefetchingCorpus(object):
+    """
+    Wraps a re-iterable corpus so that it is read and decoded on a background thread, ahead of the consumer.
+    Sentences are handed over in batches through a bounded queue, which caps the memory used by the read-ahead.
+    """
+    def __init__(self, corpus, queue_size=WORD2VEC_PREFETCH_QUEUE_SIZE, batch_size=WORD2VEC_PREFETCH_BATCH_SIZE):
+        """
+        :param corpus: Re-iterable corpus of sentences
+        :param queue_size: Maximum number of batches read ahead
+        :param batch_size: Number of sentences per batch
+        """
+        self.corpus = corpus
+        self.queue_size = queue_size
+        self.batch_size = batch_size
 
+    def __iter__(self):
+        queue = Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                batch = []
+                for sentence in self.corpus:
+                    batch.append(sentence)
+                    if len(batch) >= self.batch_size:
+                        if not put(batch):
+                            return
+                        batch = []
+                if batch:
+                    put(batch)
+            except Exception as e:
+                put(e)
+            finally:
+                put(END_OF_CORPUS)
+
+        producer = threading.Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                batch = queue.get()
+                if batch is END_OF_CORPUS:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                for sentence in batch:
+                    yield sentence
+        finally:
+            stop.set()
+            try:
+                while True:
+                    queue.get_nowait()
+            except Empty:
+                pass
+
+
+def write_line_sentence_file(corpus, filename):
+    """
+    Writes a corpus in the one sentence per line format gensim's corpus_file mode reads
+    :param corpus: Iterable of sentences
+    :param filename: Name of the file
+    """
+    with codecs.open(filename + '.tmp', 'wb', encoding='utf8') as the_file:
+        for words in corpus:
+            the_file.write(u" ".join(words) + u"\n")
+    os.rename(filename + '.tmp', filename)
+
+
+def get_line_sentence_file(corpus_filename):
+    """
+    :param corpus_filename: Name of the cleaned corpus
+    :return: Name of the corpus in the corpus_file format, written if it is missing or older than the cleaned corpus
+    """
+    filename = corpus_filename + '.line_sentence.txt'
+    if not os.path.exists(filename) or os.path.getmtime(filename) < os.path.getmtime(corpus_filename):
+        print("Writing {}...".format(filename))
+        write_line_sentence_file(CleanCorpusReader(corpus_filename), filename)
+    return filename
+
+
+def create_model(workers, epochs):
+    """
+    :return: Untrained Word2Vec Model, with the vector size argument named for the installed gensim version
+    """
+    try:
+        return gen.models.Word2Vec(vector_size=100, window=5, workers=workers, epochs=epochs)
+    except TypeError:
+        return gen.models.Word2Vec(size=100, window=5, workers=workers, iter=epochs)
+
+
+def train_word2vec(corpus_filename, mode, workers, epochs):
+    """
+    Trains a Word2Vec Model on the cleaned corpus and reports the training throughput
+    :param corpus_filename: Name of the cleaned corpus
+    :param mode: "plain" reads the corpus on the calling thread, "prefetch" reads it on a background thread,
+        "corpus_file" lets every gensim worker read its own part of the file
+    :param workers: Number of worker threads
+    :param epochs: Number of epochs
+    :return: Trained Word2Vec Model
+    """
+    model = create_model(workers, epochs)
+    if mode == "corpus_file":
+        corpus_file = get_line_sentence_file(corpus_filename)
+        model.build_vocab(corpus_file=corpus_file)
+        corpus = None
+        train_args = dict(corpus_file=corpus_file, total_words=model.corpus_total_words)
+    else:
+        corpus = CleanCorpusReader(corpus_filename)
+        if mode == "prefetch":
+            corpus = PrefetchingCorpus(corpus)
+        model.build_vocab(corpus)
+        train_args = dict(total_examples=model.corpus_count)
+    print("Number of words in vocabulary: {}".format(len(model.wv.index_to_key if hasattr(model.wv, 'index_to_key')
+                                                         else model.wv.vocab)))
+
+    start = time.time()
+    _, raw_words = model.train(corpus, epochs=epochs, **train_args)
+    seconds = time.time() - start
+    print("Trained {} epochs in {} mode in {:.1f}s, {:.0f} words/s".format(epochs, mode, seconds,
+                                                                          raw_words / max(seconds, 1e-9)))
+    return model
+
+
+def benchmark_readers(corpus_filename):
+    """
+    Reads the corpus once in every mode, without training, and reports the words/s each reader can supply
+    :param corpus_filename: Name of the cleaned corpus
+    """
+    readers = [("plain", CleanCorpusReader(corpus_filename)),
+               ("prefetch", PrefetchingCorpus(CleanCorpusReader(corpus_filename))),
+               ("corpus_file", gen.models.word2vec.LineSentence(get_line_sentence_file(corpus_filename)))]
+    for mode, corpus in readers:
+        start = time.time()
+        num_words = sum(len(words) for words in corpus)
+        seconds = time.time() - start
+        print("{:12s} {:.1f}s, {:.0f} words/s".format(mode, seconds, num_words / max(seconds, 1e-9)))
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-f", "--file", dest="file", action="store", type="string", default=ALL_CLEAN_DOCS_FILENAME)
+    parser.add_option("-m", "--mode", dest="mode", action="store", type="choice", choices=MODES, default="prefetch")
+    parser.add_option("-w", "--workers", dest="workers", action="store", type="int", default=WORD2VEC_WORKERS)
+    parser.add_option("-e", "--epochs", dest="epochs", action="store", type="int", default=WORD2VEC_EPOCHS)
+    parser.add_option("-o", "--output", dest="output", action="store", type="string", default=WORD2VEC_MODEL)
+    parser.add_option("--benchmark", dest="benchmark", action="store_true", default=False)
+    (options, args) = parser.parse_args()
+
+    if options.benchmark:
+        benchmark_readers(options.file)
+    else:
+        model = train_word2vec(options.file, options.mode, options.workers or get_cpu_limit(), options.epochs)
+        print("Saving Model...")
+        model.save(options.output)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import os
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+from Constants import TEST_TOPICS, DOC2VEC_MODEL, ANN_INDEX_SUFFIX, ANN_NPROBE, IS_REF_MASK_SUFFIX
+from doc_vector_index import DocVectorIndex, get_doc_vectors, normalize_rows
+from ref_engine import is_ref
+
+TAGS_SUFFIX = '.tags'
+CENTROIDS_SUFFIX = '.centroids.npy'
+OFFSETS_SUFFIX = '.offsets.npy'
+VECTORS_SUFFIX = '.vectors.npy'
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLES_PER_LIST = 256
+ASSIGN_CHUNK_SIZE = 65536
+
+
+def ann_index_exists(prefix):
+    """
+    :param prefix: Path prefix of the ANN index files
+    :return: Boolean Value determining if every file of the ANN index exists
+    """
+    return all(os.path.exists(prefix + suffix) for suffix in [TAGS_SUFFIX, CENTROIDS_SUFFIX, OFFSETS_SUFFIX,
+                                                              VECTORS_SUFFIX])
+
+
+def ann_index_is_current(prefix, model_filename):
+    """
+    :param prefix: Path prefix of the ANN index files
+    :param model_filename: Name of the Doc2Vec Model the index was built from
+    :return: Boolean Value determining if the index exists and was built after the model was last saved
+    """
+    return ann_index_exists(prefix) and (not os.path.exists(model_filename) or
+                                         os.path.getmtime(prefix + VECTORS_SUFFIX) >= os.path.getmtime(model_filename))
+
+
+def assign_to_centroids(vectors, centroids):
+    """
+    :param vectors: Matrix of unit length vectors
+    :param centroids: Matrix of unit length centroids
+    :return: Array with the index of the most similar centroid of every vector
+    """
+    assignments = np.zeros(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+        chunk = vectors[start:start + ASSIGN_CHUNK_SIZE]
+        assignments[start:start + len(chunk)] = chunk.dot(centroids.T).argmax(axis=1)
+    return assignments
+
+
+def train_centroids(vectors, num_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """
+    Spherical k-means on a sample of the vectors
+    :param vectors: Matrix of unit length vectors
+    :param num_lists: Number of centroids
+    :param iterations: Number of k-means iterations
+    :param seed: Seed of the random sample and of the initial centroids
+    :return: Matrix of unit length centroids
+    """
+    random = np.random.RandomState(seed)
+    num_samples = min(len(vectors), num_lists * KMEANS_SAMPLES_PER_LIST)
+    sample = vectors[np.sort(random.choice(len(vectors), num_samples, replace=False))]
+    centroids = sample[random.choice(num_samples, num_lists, replace=False)]
+    for _ in range(iterations):
+        assignments = assign_to_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = np.flatnonzero(np.bincount(assignments, minlength=num_lists) == 0)
+        sums[empty] = sample[random.choice(num_samples, len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex(object):
+    """
+    Inverted file index over unit length doc vectors.  The docs are split into lists by their most similar centroid,
+    and a query only scores the docs of the nprobe lists whose centroids are most similar to the topic.
+    The vectors are stored ordered by list, so the docs of a list are one contiguous slice.
+    Results are approximate: a doc in a list that was not probed is never returned.
+    """
+    def __init__(self, tags, centroids, offsets, vectors, nprobe=ANN_NPROBE):
+        """
+        :param tags: List of doc tags, ordered by list
+        :param centroids: Matrix of unit length centroids, one row per list
+        :param offsets: Array with the position of every list in tags and vectors, plus the total length
+        :param vectors: Matrix of unit length doc vectors, ordered by list
+        :param nprobe: Default number of lists probed per query
+        """
+        self.tags = tags
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, doc_vector_index, num_lists=None, nprobe=ANN_NPROBE):
+        """
+        Builds the index of the valid docs of a DocVectorIndex
+        :param doc_vector_index: DocVectorIndex
+        :param num_lists: Number of lists, defaults to 4 * sqrt(number of docs)
+        :param nprobe: Default number of lists probed per query
+        :return: IVFIndex
+        """
+        doc_indices = np.flatnonzero(doc_vector_index.valid)
+        vectors = doc_vector_index.vectors[doc_indices]
+        num_lists = min(num_lists or max(1, int(4 * np.sqrt(len(vectors)))), len(vectors))
+        centroids = train_centroids(vectors, num_lists)
+        assignments = assign_to_centroids(vectors, centroids)
+        order = np.argsort(assignments, kind='mergesort')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=num_lists))]).astype(np.int64)
+        tags = [doc_vector_index.tags[doc_indices[index]] for index in order]
+        return cls(tags, centroids, offsets, vectors[order], nprobe)
+
+    def save(self, prefix):
+        """
+        :param prefix: Path prefix of the ANN index files
+        """
+        np.save(prefix + CENTROIDS_SUFFIX, self.centroids)
+        np.save(prefix + OFFSETS_SUFFIX, self.offsets)
+        np.save(prefix + VECTORS_SUFFIX, self.vectors)
+        with codecs.open(prefix + TAGS_SUFFIX, 'wb', encoding='utf8') as the_file:
+            for tag in self.tags:
+                the_file.write(tag + u"\n")
+
+    @classmethod
+    def load(cls, prefix, nprobe=ANN_NPROBE):
+        """
+        Loads an index with its doc vectors memory-mapped
+        :param prefix: Path prefix of the ANN index files
+        :param nprobe: Default number of lists probed per query
+        :return: IVFIndex
+        """
+        with codecs.open(prefix + TAGS_SUFFIX, encoding='utf8') as the_file:
+            tags = the_file.read().split(u"\n")[:-1]
+        return cls(tags, np.load(prefix + CENTROIDS_SUFFIX), np.load(prefix + OFFSETS_SUFFIX),
+                   np.load(prefix + VECTORS_SUFFIX, mmap_mode='r'), nprobe)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def candidates(self, topic_vector, nprobe=None):
+        """
+        Scores the docs of the lists most similar to a topic
+        :param topic_vector: Unit length vector of the topic
+        :param nprobe: Number of lists probed, defaults to the nprobe of the index
+        :return: Tuple of (array of doc positions, array of cosine similarities)
+        """
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        lists = np.argpartition(-self.centroids.dot(topic_vector), nprobe - 1)[:nprobe]
+        positions = np.concatenate([np.arange(self.offsets[index], self.offsets[index + 1]) for index in lists])
+        positions.sort()
+        return positions, np.asarray(self.vectors[positions]).dot(topic_vector)
+
+    def query(self, topic_vector, threshold, nprobe=None):
+        """
+        Finds the docs whose cosine similarity to a topic is above a threshold, among the probed lists
+        :param topic_vector: Vector of the topic
+        :param threshold: Cosine Similarity Threshold
+        :param nprobe: Number of lists probed, defaults to the nprobe of the index
+        :return: List of (tag, score) sorted by score
+        """
+        positions, similarities = self.candidates(normalize_rows(topic_vector), nprobe)
+        above = np.flatnonzero(similarities > threshold)
+        above = above[np.argsort(-similarities[above], kind='mergesort')]
+        return [(self.tags[positions[index]], float(similarities[index])) for index in above]
+
+    def query_batch(self, topic_vectors, threshold, nprobe=None):
+        """
+        :param topic_vectors: Matrix with one topic vector per row
+        :param threshold: Cosine Similarity Threshold
+        :param nprobe: Number of lists probed, defaults to the nprobe of the index
+        :return: List with one list of (tag, score) per topic
+        """
+        return [self.query(topic_vector, threshold, nprobe) for topic_vector in topic_vectors]
+
+    def most_similar(self, topic_vector, topn, nprobe=None):
+        """
+        :param topic_vector: Vector of the topic
+        :param topn: Number of docs to return
+        :param nprobe: Number of lists probed, defaults to the nprobe of the index
+        :return: List of (tag, score) of the topn most similar docs among the probed lists, sorted by score
+        """
+        positions, similarities = self.candidates(normalize_rows(topic_vector), nprobe)
+        topn = min(topn, len(similarities))
+        if topn <= 0:
+            return []
+        best = np.argpartition(-similarities, topn - 1)[:topn]
+        best = best[np.argsort(-similarities[best], kind='mergesort')]
+        return [(self.tags[positions[index]], float(similarities[index])) for index in best]
+
+
+def recall(exact, approximate):
+    """
+    :param exact: List of (tag, score) returned by an exact search
+    :param approximate: List of (tag, score) returned by an approximate search
+    :return: Fraction of the exact results that the approximate search found
+    """
+    if not exact:
+        return 1.0
+    return len(set(tag for tag, _ in exact) & set(tag for tag, _ in approximate)) / float(len(exact))
+
+
+def evaluate_recall(exact_index, ann_index, topic_vectors, k_values, threshold, nprobe_values):
+    """
+    Compares an ANN index with exact search, printing recall@k, threshold recall and query latency
+    :param exact_index: DocVectorIndex
+    :param ann_index: IVFIndex
+    :param topic_vectors: Matrix with one topic vector per row
+    :param k_values: List of k to measure recall@k for
+    :param threshold: Cosine Similarity Threshold to measure threshold recall for
+    :param nprobe_values: List of nprobe to measure
+    """
+    def timed(function):
+        start = time.time()
+        results = [function(topic_vector) for topic_vector in topic_vectors]
+        return results, 1000 * (time.time() - start) / max(len(topic_vectors), 1)
+
+    max_k = max(k_values)
+    exact_top, exact_ms = timed(lambda x: exact_index.most_similar(x, max_k))
+    exact_above, _ = timed(lambda x: exact_index.query(x, threshold))
+    print("exact:      {:.2f}ms per top-{} query".format(exact_ms, max_k))
+    for nprobe in nprobe_values:
+        ann_top, ann_ms = timed(lambda x: ann_index.most_similar(x, max_k, nprobe))
+        ann_above, _ = timed(lambda x: ann_index.query(x, threshold, nprobe))
+        recalls = ["recall@{} {:.3f}".format(k, np.mean([recall(exact[:k], approximate[:k])
+                                                        for exact, approximate in zip(exact_top, ann_top)]))
+                   for k in k_values]
+        threshold_recall = np.mean([recall(exact, approximate) for exact, approximate in zip(exact_above, ann_above)])
+        print("nprobe {:3d}: {:.2f}ms per top-{} query, {}, recall above {} {:.3f}".format(
+            nprobe, ann_ms, max_k, ", ".join(recalls), threshold, threshold_recall))
+
+
+def load_doc_vector_index(model, model_filename):
+    """
+    Builds the DocVectorIndex of a model, restricted to Refs.
+    Which tags are Refs is cached next to the model file, and computed if it was not cached for this model yet.
+    :param model: Doc2Vec Model
+    :param model_filename: Name of the Doc2Vec Model
+    :return: DocVectorIndex whose valid mask marks the doc tags that are Refs
+    """
+    return DocVectorIndex.from_model(model, is_ref, model_filename + IS_REF_MASK_SUFFIX)
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog build|evaluate [options]")
+    parser.add_option("-m", "--model", dest="model", action="store", type="string", default=DOC2VEC_MODEL)
+    parser.add_option("-p", "--prefix", dest="prefix", action="store", type="string", default=None,
+                      help="Path prefix of the index, defaults to the model filename followed by " + ANN_INDEX_SUFFIX)
+    parser.add_option("-l", "--lists", dest="num_lists", action="store", type="int", default=None)
+    parser.add_option("-k", dest="k_values", action="store", type="string", default="10,100")
+    parser.add_option("-t", "--threshold", dest="threshold", action="store", type="float", default=0.6)
+    parser.add_option("-n", "--nprobe", dest="nprobe_values", action="store", type="string",
+                      default="1,4,{},32".format(ANN_NPROBE))
+    (options, args) = parser.parse_args()
+    command = args[0] if args else "build"
+    options.prefix = options.prefix or options.model + ANN_INDEX_SUFFIX
+
+    from gensim.models import Doc2Vec
+    model = Doc2Vec.load(options.model)
+    exact_index = load_doc_vector_index(model, options.model)
+
+    if command == "build":
+        start = time.time()
+        ann_index = IVFIndex.build(exact_index, options.num_lists)
+        ann_index.save(options.prefix)
+        print("Indexed {} docs in {} lists in {:.1f}s".format(len(ann_index), len(ann_index.centroids),
+                                                              time.time() - start))
+    elif command != "evaluate":
+        parser.error("unknown command {}".format(command))
+
+    ann_index = IVFIndex.load(options.prefix)
+    topic_vectors = np.array([model[topic] for topic in TEST_TOPICS if topic in model.wv])
+    evaluate_recall(exact_index, ann_index, topic_vectors, [int(k) for k in options.k_values.split(",")],
+                    options.threshold, sorted(set(int(n) for n in options.nprobe_values.split(","))))
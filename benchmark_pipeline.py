@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from optparse import OptionParser
+
+from Constants import BENCHMARK_BASELINE_FILENAME, BENCHMARK_TOLERANCE
+from doc_vector_index import DocVectorIndex
+from hebrew_spellcheck import compile_word_expander
+from range_index import RangeIndex
+from ranged_segments import segment_range_dicts
+from ref_cache import RefCache
+from synthetic_corpus import load_synthetic_corpus, synthetic_ref_info
+from text_cleaning import word_expander, strip_stopwords_and_remove_punctuation, create_multiple_word_phrases, \
+    pull_out_suffix, remove_dicta_prefix, remove_punctuation, this_is_a_bad_line, extract_reference
+
+
+def digest(outputs):
+    """
+    :param outputs: Iterable of strings
+    :return: Hex digest of the outputs, in order
+    """
+    the_digest = hashlib.sha1()
+    for output in outputs:
+        the_digest.update(output.encode('utf8'))
+        the_digest.update(b"\n")
+    return the_digest.hexdigest()
+
+
+def result(items, seconds, output_digest=None):
+    """
+    :param items: Number of items processed
+    :param seconds: Wall time
+    :param output_digest: Digest of a deterministic output, None if the output is not deterministic
+    :return: Result of one benchmark
+    """
+    return OrderedDict([("items", items), ("seconds", round(seconds, 4)),
+                        ("items_per_second", round(items / max(seconds, 1e-9), 1)), ("digest", output_digest)])
+
+
+def best_time(function, repeat):
+    """
+    Runs a function repeat times, which keeps timing noise out of the comparison with the baseline
+    :param function: Function without arguments
+    :param repeat: Number of runs
+    :return: Tuple of (output of the last run, shortest wall time)
+    """
+    seconds = []
+    for _ in range(max(repeat, 1)):
+        start = time.time()
+        output = function()
+        seconds.append(time.time() - start)
+    return output, min(seconds)
+
+
+def use_synthetic_word_expander(corpus, filename):
+    """
+    Compiles the synthetic word expander of a corpus and loads it in place of word_expander.bin,
+    so that suffix expansion does not depend on the hspell export
+    :param corpus: SyntheticCorpus
+    :param filename: Name of the compiled word expander
+    """
+    compile_word_expander(corpus.word_expander(), filename)
+    word_expander.filename = filename
+    word_expander.expander = None
+
+
+def benchmark_cleaning(lines, repeat):
+    """
+    Benchmarks the regex chain, one stage at a time, on lines in the Dicta Prefix format
+    :param lines: List of valid lines
+    :param repeat: Number of runs of every benchmark
+    :return: Tuple of (dict of benchmark results, list of cleaned docs)
+    """
+    results = OrderedDict()
+    stripped, seconds = best_time(lambda: [strip_stopwords_and_remove_punctuation(line) for line in lines], repeat)
+    results["strip_stopwords_and_remove_punctuation"] = result(len(lines), seconds, digest(stripped))
+
+    joined, seconds = best_time(lambda: [create_multiple_word_phrases(data) for data in stripped], repeat)
+    results["create_multiple_word_phrases"] = result(len(lines), seconds, digest(joined))
+
+    without_punctuation = [remove_punctuation(remove_dicta_prefix(line.strip().split(u'~~')[1], u"┉"))
+                           for line in lines]
+    expanded, seconds = best_time(lambda: [pull_out_suffix(data) for data in without_punctuation], repeat)
+    results["pull_out_suffix"] = result(len(lines), seconds, digest(expanded))
+    return results, joined
+
+
+def benchmark_ranges(ranged_refs, seg_refs, repeat):
+    """
+    Benchmarks mapping every segment to its ranged ref, by expanding every range with segment_range_dicts,
+    parsing the ranges with the synthetic ref resolver, and by building a RangeIndex and looking every segment up.
+    Both give the same mapping, so segment_range_dicts and range_index_lookup have the same output digest.
+    :param ranged_refs: List of ranged trefs
+    :param seg_refs: List of the segment trefs covered by the ranges
+    :param repeat: Number of runs
+    :return: Dict of benchmark results
+    """
+    def expand_ranges():
+        return segment_range_dicts(ranged_refs, RefCache(synthetic_ref_info, max_size=len(ranged_refs)))[1]
+    segment_to_ranged, seconds = best_time(expand_ranges, repeat)
+    output = (u"{}\t{}".format(seg_ref, ranged_ref) for seg_ref, ranged_ref in sorted(segment_to_ranged.items()))
+    results = OrderedDict([("segment_range_dicts", result(len(ranged_refs), seconds, digest(output)))])
+
+    range_index, seconds = best_time(lambda: RangeIndex.build(ranged_refs), repeat)
+    results["range_index"] = result(len(ranged_refs), seconds, digest(range_index.ranged_refs))
+
+    segment_to_ranged, seconds = best_time(lambda: [(seg_ref, range_index.lookup(seg_ref)) for seg_ref in seg_refs],
+                                           repeat)
+    output = (u"{}\t{}".format(seg_ref, ranged_ref) for seg_ref, ranged_ref in sorted(segment_to_ranged))
+    results["range_index_lookup"] = result(len(seg_refs), seconds, digest(output))
+    return results
+
+
+def benchmark_training_and_retrieval(refs, docs, epochs, workers, num_topics=100, threshold=0.3):
+    """
+    Trains a Doc2Vec Model the way Doc2Vec.py does and queries it the way Doc2Vec_test_model does.
+    Training is multithreaded and so not deterministic, so neither benchmark has an output digest.
+    :param refs: List of doc tags
+    :param docs: List of cleaned docs
+    :param epochs: Number of epochs
+    :param workers: Number of worker threads
+    :param num_topics: Number of frequent words queried as topics
+    :param threshold: Cosine Similarity Threshold
+    :return: Dict of benchmark results
+    """
+    import gensim as gen
+    corpus = [gen.models.doc2vec.TaggedDocument(data.split(), [ref]) for ref, data in zip(refs, docs)]
+    num_words = sum(len(doc.words) for doc in corpus)
+    results = OrderedDict()
+
+    start = time.time()
+    model = gen.models.doc2vec.Doc2Vec(vector_size=100, min_count=2, epochs=epochs, dm=0, dbow_words=1,
+                                       workers=workers)
+    model.build_vocab(corpus)
+    model.train(corpus, total_examples=model.corpus_count, epochs=epochs)
+    results["training"] = result(num_words * epochs, time.time() - start)
+
+    words = model.wv.index_to_key if hasattr(model.wv, 'index_to_key') else model.wv.index2word
+    topic_vectors = [model.wv[word] for word in words[:num_topics]]
+    index = DocVectorIndex.from_model(model)
+    start = time.time()
+    for topic_vector in topic_vectors:
+        index.query(topic_vector, threshold)
+    results["retrieval"] = result(len(topic_vectors), time.time() - start)
+    return results
+
+
+def run_benchmarks(num_lines, seed, repeat, epochs, workers, skip_training=False):
+    """
+    Runs every benchmark on a synthetic corpus
+    :param num_lines: Number of synthetic lines
+    :param seed: Seed of the synthetic corpus
+    :param repeat: Number of runs of every benchmark but training, the fastest of which is reported
+    :param epochs: Number of training epochs
+    :param workers: Number of training threads
+    :param skip_training: Whether to skip the training and retrieval benchmarks
+    :return: Dict of benchmark results
+    """
+    corpus = load_synthetic_corpus(seed)
+    lines = [line for line in corpus.lines(num_lines) if not this_is_a_bad_line(line)]
+    expander_file, expander_filename = tempfile.mkstemp(suffix='.bin')
+    os.close(expander_file)
+    try:
+        use_synthetic_word_expander(corpus, expander_filename)
+        results, docs = benchmark_cleaning(lines, repeat)
+    finally:
+        os.remove(expander_filename)
+    results.update(benchmark_ranges(corpus.ranged_refs(), list(corpus.refs()), repeat))
+    if not skip_training:
+        refs = [extract_reference(line) for line in lines]
+        results.update(benchmark_training_and_retrieval(refs, docs, epochs, workers))
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    :param results: Dict of benchmark results
+    :param baseline: Dict of baseline benchmark results
+    :param tolerance: Fraction of the baseline throughput a benchmark may lose before it counts as a regression
+    :return: List of regressions
+    """
+    regressions = []
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        previous = baseline[name]
+        if previous["digest"] and current["digest"] != previous["digest"]:
+            regressions.append(u"{}: output changed".format(name))
+        if current["items_per_second"] < previous["items_per_second"] * (1 - tolerance):
+            regressions.append(u"{}: {:.1f} items/s, baseline {:.1f} items/s".format(
+                name, current["items_per_second"], previous["items_per_second"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-n", "--lines", dest="lines", action="store", type="int", default=50000)
+    parser.add_option("-s", "--seed", dest="seed", action="store", type="int", default=0)
+    parser.add_option("-r", "--repeat", dest="repeat", action="store", type="int", default=3)
+    parser.add_option("-e", "--epochs", dest="epochs", action="store", type="int", default=2)
+    parser.add_option("-w", "--workers", dest="workers", action="store", type="int", default=1)
+    parser.add_option("-b", "--baseline", dest="baseline", action="store", type="string",
+                      default=BENCHMARK_BASELINE_FILENAME)
+    parser.add_option("-t", "--tolerance", dest="tolerance", action="store", type="float", default=BENCHMARK_TOLERANCE)
+    parser.add_option("--save-baseline", dest="save_baseline", action="store_true", default=False)
+    parser.add_option("--skip-training", dest="skip_training", action="store_true", default=False)
+    (options, args) = parser.parse_args()
+
+    config = OrderedDict([("lines", options.lines), ("seed", options.seed), ("repeat", options.repeat),
+                          ("epochs", options.epochs),
+                          ("workers", options.workers), ("python", platform.python_version())])
+    results = run_benchmarks(options.lines, options.seed, options.repeat, options.epochs, options.workers,
+                             options.skip_training)
+
+    print("{:40s} {:>10s} {:>10s} {:>14s}".format("benchmark", "items", "seconds", "items/s"))
+    for name, current in results.items():
+        print("{:40s} {:>10d} {:>10.3f} {:>14.1f}".format(name, current["items"], current["seconds"],
+                                                          current["items_per_second"]))
+
+    if options.save_baseline:
+        with open(options.baseline, 'w') as the_file:
+            json.dump(OrderedDict([("config", config), ("results", results)]), the_file, indent=2)
+        print("Saved baseline to {}".format(options.baseline))
+    elif os.path.exists(options.baseline):
+        with open(options.baseline) as the_file:
+            baseline = json.load(the_file, object_pairs_hook=OrderedDict)
+        if baseline["config"] != config:
+            print("Baseline was recorded with {}, not comparing".format(json.dumps(baseline["config"])))
+            sys.exit(1)
+        regressions = compare_to_baseline(results, baseline["results"], options.tolerance)
+        for regression in regressions:
+            print(u"REGRESSION {}".format(regression).encode('utf8'))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against {}".format(options.baseline))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import time
+from optparse import OptionParser
+
+from Constants import DICTA_SEFARIA_FILENAME
+from ref_engine import setup_sefaria
+
+setup_sefaria(force=True)
+
+from sefaria.model import Ref
+from sefaria.system.exceptions import InputError
+from create_docs_for_doc2vec import build_title_resolver, create_list_off_tanakh_books, \
+    create_list_off_talmud_books, this_is_a_bad_line, extract_reference
+
+
+def read_refs(filename, num_lines):
+    """
+    Reads the refs of the first lines of the Dicta Prefix file
+    :param filename: Dicta Prefix Filename
+    :param num_lines: Maximum number of lines to read
+    :return: List of trefs
+    """
+    refs = []
+    for index, data in enumerate(codecs.open(filename, encoding='utf8')):
+        if index >= num_lines:
+            break
+        if not this_is_a_bad_line(data):
+            refs.append(extract_reference(data))
+    return refs
+
+
+def ref_index_title(ref):
+    """
+    Parses a Ref the way get_segments used to, without the ref cache or the library snapshot
+    :param ref: tref
+    :return: Title of the index of the tref, or None if the tref is not a valid Ref
+    """
+    try:
+        return Ref(ref).index.title
+    except InputError:
+        return None
+
+
+def classify_with_ref(refs, all_tanakh_books, all_talmud_books):
+    """
+    Classifies trefs the way get_segments used to, by parsing a Ref for every tref, once per category
+    :param refs: List of trefs
+    :return: List of categories
+    """
+    categories = []
+    for ref in refs:
+        if ref_index_title(ref) in all_tanakh_books:
+            categories.append(u"tanakh")
+        elif ref_index_title(ref) in all_talmud_books:
+            categories.append(u"talmud")
+        else:
+            categories.append(None)
+    return categories
+
+
+def classify_with_resolver(refs, title_resolver):
+    """
+    Classifies trefs with the TitleResolver
+    :param refs: List of trefs
+    :return: List of categories
+    """
+    return [title_resolver.category(ref) for ref in refs]
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-f", "--file", dest="file", action="store", type="string", default=DICTA_SEFARIA_FILENAME)
+    parser.add_option("-n", "--lines", dest="lines", action="store", type="int", default=200000)
+    (options, args) = parser.parse_args()
+
+    refs = read_refs(options.file, options.lines)
+
+    start = time.time()
+    title_resolver = build_title_resolver()
+    build_time = time.time() - start
+
+    start = time.time()
+    ref_categories = classify_with_ref(refs, create_list_off_tanakh_books(), create_list_off_talmud_books())
+    ref_time = time.time() - start
+
+    start = time.time()
+    resolver_categories = classify_with_resolver(refs, title_resolver)
+    resolver_time = time.time() - start
+
+    mismatches = [(ref, a, b) for ref, a, b in zip(refs, ref_categories, resolver_categories) if a != b]
+
+    print("{} refs".format(len(refs)))
+    print("Resolver build:  {:.3f}s".format(build_time))
+    print("Ref() path:      {:.3f}s ({:.0f} refs/s)".format(ref_time, len(refs) / max(ref_time, 1e-9)))
+    print("TitleResolver:   {:.3f}s ({:.0f} refs/s)".format(resolver_time, len(refs) / max(resolver_time, 1e-9)))
+    print("Speedup:         {:.1f}x".format(ref_time / max(resolver_time, 1e-9)))
+    print("Mismatches:      {}".format(len(mismatches)))
+    for ref, a, b in mismatches[:20]:
+        print(u"  {}: Ref() {} / TitleResolver {}".format(ref, a, b))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import sys
+import time
+from optparse import OptionParser
+
+from text_cleaning import strip_stopwords_and_remove_punctuation, create_multiple_word_phrases, \
+    sefaria_tokenizer, this_is_a_bad_line
+
+GOLDEN_CORPUS_FILENAME = './tokenizer_golden.txt'
+
+
+def clean_with_chain(line):
+    """
+    Cleans a line from the Dicta Prefix file with the chain of regex passes
+    :param line: A line from the dicta file
+    :return: String ready for Doc2Vec
+    """
+    return create_multiple_word_phrases(strip_stopwords_and_remove_punctuation(line))
+
+
+def clean_with_tokenizer(line):
+    """
+    Cleans a line from the Dicta Prefix file with the fused HebrewTokenizer
+    :param line: A line from the dicta file
+    :return: String ready for Doc2Vec
+    """
+    return sefaria_tokenizer.clean(line.strip().split(u'~~')[1])
+
+
+def read_lines(filename, num_lines):
+    """
+    Reads the valid lines at the head of a file in the Dicta Prefix format
+    :param filename: Name of the file
+    :param num_lines: Maximum number of lines to read
+    :return: List of lines
+    """
+    lines = []
+    for index, line in enumerate(codecs.open(filename, encoding='utf8')):
+        if index >= num_lines:
+            break
+        if not this_is_a_bad_line(line):
+            lines.append(line)
+    return lines
+
+
+def throughput(clean, lines, repeat):
+    """
+    Measures how fast a cleaning function runs over a list of lines
+    :param clean: Cleaning function
+    :param lines: List of lines
+    :param repeat: Number of times to run over the lines
+    :return: Throughput in MB/s of UTF-8 input
+    """
+    size_mb = sum(len(line.encode('utf8')) for line in lines) * repeat / 1e6
+    start = time.time()
+    for _ in range(repeat):
+        for line in lines:
+            clean(line)
+    return size_mb / max(time.time() - start, 1e-9)
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-f", "--file", dest="file", action="store", type="string", default=GOLDEN_CORPUS_FILENAME)
+    parser.add_option("-n", "--lines", dest="lines", action="store", type="int", default=100000)
+    parser.add_option("-r", "--repeat", dest="repeat", action="store", type="int", default=1)
+    (options, args) = parser.parse_args()
+
+    lines = read_lines(options.file, options.lines)
+
+    mismatches = [line for line in lines if clean_with_chain(line) != clean_with_tokenizer(line)]
+    print("{} lines, {} mismatches".format(len(lines), len(mismatches)))
+    for line in mismatches[:10]:
+        print(u"  {}".format(line.strip()))
+        print(u"    chain:     {}".format(clean_with_chain(line)))
+        print(u"    tokenizer: {}".format(clean_with_tokenizer(line)))
+
+    chain_mb_s = throughput(clean_with_chain, lines, options.repeat)
+    tokenizer_mb_s = throughput(clean_with_tokenizer, lines, options.repeat)
+    print("Regex chain:      {:.2f} MB/s".format(chain_mb_s))
+    print("HebrewTokenizer:  {:.2f} MB/s".format(tokenizer_mb_s))
+    print("Speedup:          {:.1f}x".format(tokenizer_mb_s / max(chain_mb_s, 1e-9)))
+
+    if mismatches:
+        sys.exit(1)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import os
+import time
+from array import array
+from optparse import OptionParser
+
+import gensim as gen
+import numpy as np
+
+from Constants import ALL_CLEAN_DOCS_FILENAME, BINARY_CORPUS_PREFIX
+from segment_cache import file_fingerprint
+
+IDS_SUFFIX = '.ids'
+OFFSETS_SUFFIX = '.offsets.npy'
+VOCAB_SUFFIX = '.vocab'
+TAGS_SUFFIX = '.tags'
+SOURCE_SUFFIX = '.source'
+
+
+def binary_corpus_exists(prefix):
+    """
+    :param prefix: Path prefix of the binary corpus files
+    :return: Boolean Value determining if every file of the binary corpus exists
+    """
+    return all(os.path.exists(prefix + suffix) for suffix in [IDS_SUFFIX, OFFSETS_SUFFIX, VOCAB_SUFFIX, TAGS_SUFFIX])
+
+
+def text_corpus_signature(text_filename):
+    """
+    :param text_filename: Name of the text corpus
+    :return: Size and content digest of the text corpus, as one line
+    """
+    return u"{} {}".format(os.path.getsize(text_filename), file_fingerprint(text_filename))
+
+
+def binary_corpus_stale_reason(prefix, text_filename):
+    """
+    Checks the binary corpus against the text corpus it is supposed to have been written with.  The size is
+    compared first so that a changed corpus is usually caught without reading it
+    :param prefix: Path prefix of the binary corpus files
+    :param text_filename: Name of the text corpus
+    :return: Why the binary corpus can not stand in for the text corpus, or None if it can
+    """
+    if not os.path.exists(prefix + SOURCE_SUFFIX):
+        return "it does not record the text corpus it was written with"
+    with codecs.open(prefix + SOURCE_SUFFIX, encoding='utf8') as the_file:
+        recorded = the_file.read().strip()
+    if recorded.split(u" ")[0] != u"{}".format(os.path.getsize(text_filename)) or \
+            recorded != text_corpus_signature(text_filename):
+        return "it was not written with the current {}".format(text_filename)
+    return None
+
+
+class BinaryCorpusWriter(object):
+    """
+    Writes docs in the binary corpus format:
+        <prefix>.ids          int32 token ids of every doc, one after the other
+        <prefix>.offsets.npy  int64 array with the position of every doc in the ids file, plus the total length
+        <prefix>.vocab        one token per line, the line number is the token id
+        <prefix>.tags         one doc tag per line, in the same order as the offsets
+        <prefix>.source       size and digest of the text corpus written along with it
+    Docs are tokenized with gensim's simple_preprocess once, here, so that readers never tokenize again.
+    The source file is removed when writing starts and written last, so an interrupted write is never trusted.
+    """
+    def __init__(self, prefix, text_filename=None):
+        """
+        :param prefix: Path prefix of the binary corpus files
+        :param text_filename: Optional name of the text corpus holding the same docs.  It has to be complete
+            when the writer is closed
+        """
+        self.prefix = prefix
+        self.text_filename = text_filename
+        if os.path.exists(prefix + SOURCE_SUFFIX):
+            os.remove(prefix + SOURCE_SUFFIX)
+        self.ids_file = open(prefix + IDS_SUFFIX, 'wb')
+        self.tags_file = codecs.open(prefix + TAGS_SUFFIX, 'wb', encoding='utf8')
+        self.vocab = {}
+        self.offsets = [0]
+
+    def add(self, tag, data):
+        """
+        Appends one doc to the corpus
+        :param tag: Tag of the doc
+        :param data: Cleaned text of the doc
+        """
+        vocab = self.vocab
+        ids = array('i', [vocab.setdefault(token, len(vocab)) for token in gen.utils.simple_preprocess(data)])
+        ids.tofile(self.ids_file)
+        self.offsets.append(self.offsets[-1] + len(ids))
+        self.tags_file.write(tag + u"\n")
+
+    def close(self):
+        """
+        Writes the vocab and the offsets and closes the corpus
+        """
+        self.ids_file.close()
+        self.tags_file.close()
+        np.save(self.prefix + OFFSETS_SUFFIX, np.array(self.offsets, dtype=np.int64))
+        vocab = sorted(self.vocab.items(), key=lambda x: x[1])
+        with codecs.open(self.prefix + VOCAB_SUFFIX, 'wb', encoding='utf8') as the_file:
+            for token, _ in vocab:
+                the_file.write(token + u"\n")
+        if self.text_filename:
+            with codecs.open(self.prefix + SOURCE_SUFFIX, 'wb', encoding='utf8') as the_file:
+                the_file.write(text_corpus_signature(self.text_filename) + u"\n")
+
+
+class BinaryCorpus(object):
+    """
+    Re-iterable reader of the binary corpus format.  The token ids are memory-mapped, so iterating over the corpus
+    is a scan over an array followed by a vocab lookup.  Yields the same TaggedDocuments as
+    Doc2Vec.SegmentGenerator does for the text corpus the binary corpus was made from.
+    """
+    def __init__(self, prefix):
+        """
+        :param prefix: Path prefix of the binary corpus files
+        """
+        with codecs.open(prefix + VOCAB_SUFFIX, encoding='utf8') as the_file:
+            self.vocab = np.array(the_file.read().split(u"\n")[:-1], dtype=object)
+        with codecs.open(prefix + TAGS_SUFFIX, encoding='utf8') as the_file:
+            self.tags = the_file.read().split(u"\n")[:-1]
+        self.offsets = np.load(prefix + OFFSETS_SUFFIX)
+        if self.offsets[-1]:
+            self.ids = np.memmap(prefix + IDS_SUFFIX, dtype=np.int32, mode='r')
+        else:
+            self.ids = np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __iter__(self):
+        vocab = self.vocab
+        ids = self.ids
+        offsets = self.offsets.tolist()
+        for index, tag in enumerate(self.tags):
+            words = vocab[ids[offsets[index]:offsets[index + 1]]].tolist()
+            yield gen.models.doc2vec.TaggedDocument(words, [tag])
+
+
+def convert_text_corpus(text_filename, prefix):
+    """
+    Converts a corpus in the ref||||text format into the binary corpus format
+    :param text_filename: Name of the text corpus
+    :param prefix: Path prefix of the binary corpus files
+    :return: Number of docs converted
+    """
+    writer = BinaryCorpusWriter(prefix, text_filename)
+    num_docs = 0
+    with codecs.open(text_filename, 'rb', encoding='utf8') as the_file:
+        for line in the_file:
+            ref, data = line.split(u"||||")[:2]
+            writer.add(ref, data)
+            num_docs += 1
+    writer.close()
+    return num_docs
+
+
+def time_epoch(corpus):
+    """
+    Iterates once over a corpus the way gensim does during an epoch
+    :param corpus: Iterable of TaggedDocuments
+    :return: Tuple of (seconds, number of docs, number of words)
+    """
+    start = time.time()
+    num_docs = 0
+    num_words = 0
+    for doc in corpus:
+        num_docs += 1
+        num_words += len(doc.words)
+    return time.time() - start, num_docs, num_words
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog convert|benchmark [options]")
+    parser.add_option("-t", "--text", dest="text", action="store", type="string", default=ALL_CLEAN_DOCS_FILENAME)
+    parser.add_option("-p", "--prefix", dest="prefix", action="store", type="string", default=BINARY_CORPUS_PREFIX)
+    parser.add_option("-e", "--epochs", dest="epochs", action="store", type="int", default=3)
+    (options, args) = parser.parse_args()
+    command = args[0] if args else "convert"
+
+    if command == "convert":
+        start = time.time()
+        num_docs = convert_text_corpus(options.text, options.prefix)
+        print("Converted {} docs in {:.1f}s".format(num_docs, time.time() - start))
+    elif command == "benchmark":
+        from Doc2Vec import SegmentGenerator
+        for name, corpus in [("text", SegmentGenerator(options.text)), ("binary", BinaryCorpus(options.prefix))]:
+            for epoch in range(options.epochs):
+                seconds, num_docs, num_words = time_epoch(corpus)
+                print("{:6s} epoch {}: {:.2f}s, {:.0f} docs/s, {:.0f} words/s".format(
+                    name, epoch + 1, seconds, num_docs / max(seconds, 1e-9), num_words / max(seconds, 1e-9)))
+    else:
+        parser.error("unknown command {}".format(command))
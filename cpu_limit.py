@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+
+
+def get_cpu_limit():
+    """
+    Finds how many CPUs this process may use.  Inside a container this is the CPU limit of its cgroup,
+    for example 3 for a pod limited to 3500m.  Otherwise it is the number of CPUs of the machine.
+    :return: Number of CPUs
+    """
+    quota_files = [("/sys/fs/cgroup/cpu.max", None),
+                   ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us")]
+    for quota_file, period_file in quota_files:
+        try:
+            with open(quota_file) as the_file:
+                values = the_file.read().split()
+            if period_file:
+                with open(period_file) as the_file:
+                    values.append(the_file.read().strip())
+            quota, period = values[0], values[1]
+            if quota not in ("max", "-1"):
+                return max(1, int(float(quota) / float(period)))
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+    return multiprocessing.cpu_count()
@@ -1,33 +1,37 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import hashlib
 import json
 import codecs
-import regex as re
 import os.path
 import csv
+import multiprocessing
+import resource
 
-import local_settings
+from Constants import ALL_CLEAN_DOCS_FILENAME, DICTA_HEBREW_WIKI_FILENAME, DICTA_SEFARIA_FILENAME, HEBREW_WIKI, \
+    CLEANING_PROCESSES, CLEANING_SHARDS_PER_PROCESS, CLEANING_SHARD_BYTES, FUSED_TOKENIZER, PHRASES_FILENAME, \
+    WORD_EXPANDER_FILENAME, WORD_EXPANDER_SOURCE_FILENAME, INCREMENTAL_REBUILD, SEGMENT_CACHE_FILENAME, \
+    WRITE_BINARY_CORPUS, BINARY_CORPUS_PREFIX, TANAKH_RANGES_FILENAME, TALMUD_RANGES_DIRECTORY
 
-import django
+from ref_engine import setup_sefaria
 
-from Constants import ALL_CLEAN_DOCS_FILENAME, DICTA_HEBREW_WIKI_FILENAME, DICTA_SEFARIA_FILENAME, HEBREW_WIKI
+setup_sefaria()
 
-django.setup()
+from title_resolver import TitleResolver, title_from_tref
+from hebrew_spellcheck import WORD_EXPANDER_VERSION
+from text_cleaning import STOPWORDS_FILENAME, word_expander, sefaria_tokenizer, wiki_tokenizer, pull_out_suffix, \
+    remove_stopwords, remove_dicta_prefix, remove_punctuation, strip_stopwords_and_remove_punctuation, \
+    create_multiple_word_phrases, this_is_a_bad_line, extract_reference
+from ranged_segments import segment_range_dicts, concatenate_sematically_linked_segments, RangedSegmentBuffer
+from segment_cache import SegmentCache, file_fingerprint, content_hash
+from binary_corpus import BinaryCorpusWriter
+from file_shards import get_file_shards, read_shard_lines, iter_shard_results
+from ref_cache import ref_cache
+from instrumentation import instrumentation
 
-from sefaria.model import *
-from sefaria.system.exceptions import InputError, PartialRefInputError
-
-import hebrew_spellcheck
-word_expander = hebrew_spellcheck.word_expander
-
-stopwords = codecs.open('./hebrew_stopwords.txt', encoding='utf8').read().strip().split('\n')
-stopwords_regex = u"(?:\s|^)({})(?=\s|$)".format(u"|".join(stopwords))
-stopwords_regex = re.compile(stopwords_regex)
-
-phrases = codecs.open('./select_phrases.txt', encoding='utf8').read().strip().split('\n')
-phrases_regex = u"(\s|^)({})(?=\s|$)".format(u"|".join(phrases))
-phrases_regex = re.compile(phrases_regex)
+CLEANING_VERSION = 1
+WIKI_TAG_HASH_LENGTH = 16
 
 
 def get_talmud_topic_ranged():
@@ -37,8 +41,8 @@ def get_talmud_topic_ranged():
     :return: List of all Talmudic Ranged Refs
     """
     all_gemara_topic_ranges = []
-    for filename in os.listdir('./sugyot/'):
-        with codecs.open('./sugyot/' + filename, 'rb', encoding='utf8') as csvfile:
+    for filename in os.listdir(TALMUD_RANGES_DIRECTORY):
+        with codecs.open(TALMUD_RANGES_DIRECTORY + filename, 'rb', encoding='utf8') as csvfile:
             reader = csv.reader(csvfile)
             reader.next()
             all_gemara_topic_ranges += [row[0] for row in reader]
@@ -47,11 +51,9 @@ def get_talmud_topic_ranged():
 
 def create_list_off_talmud_books():
     """
-    Uses Sefaria Project to create a list of titles of every Talmud Tractate
+    Lists the titles of every Talmud Tractate the pipeline treats as Talmud
     :return: Set of all Talmud book titles
     """
-    indexes = library.all_index_records()
-    talmud_books = set(library.get_indexes_in_category("Bavli"))
     talmud_books_modified = {u'Avodah Zarah', u'Bava Batra', u'Bava Kamma',
                              u'Bava Metzia', u'Beitzah', u'Berakhot', u'Chagigah', u'Eruvin', u'Gittin', u'Horayot',
                              u'Ketubot', u'Kiddushin', u'Makkot', u'Megillah', u'Menachot', u'Moed Katan',
@@ -62,11 +64,9 @@ def create_list_off_talmud_books():
 
 def create_list_off_tanakh_books():
     """
-    Uses Sefaria Project to create a list of titles of every book in Tanakh
+    Lists the titles of every book the pipeline treats as Tanakh
     :return: Set of all Tanakh book titles
     """
-    indexes = library.all_index_records()
-    tanakh_books = set(library.get_indexes_in_category("Tanakh"))
     tanakh_books_modified = set([u'Judges', u'Deuteronomy', u'Genesis', u'Exodus',
                                  u'Leviticus', u'II Kings', u'Joshua',
                                  u'I Samuel', u'Numbers', u'I Kings', u'II Samuel'])
@@ -78,7 +78,7 @@ def get_tanakh_topic_ranges():
     Creates semantically meaningful ranged refs for Tanakh using Herzog's breakdown
     :return: List of all Tanakh Ranged Refs
     """
-    with codecs.open('level_3_wo_overlaps.json', 'r', encoding='utf8') as the_file:
+    with codecs.open(TANAKH_RANGES_FILENAME, 'r', encoding='utf8') as the_file:
         segs = json.load(the_file, encoding='utf8')
     tanakh_topic_ranged_refs = []
 
@@ -98,24 +98,18 @@ def get_tanakh_topic_ranges():
     return tanakh_topic_ranged_refs
 
 
-def segment_range_dicts(topic_ranged_refs):
+def build_title_resolver():
     """
-    Creates two dictionaries.  These are mappings between ranged refs and segments refs.
-    This receives a list of ranged refs.  It iterates over every ranged ref and creates a mapping between the ranged refs and the segment refs.
-    :param topic_ranged_refs: list of ranged refs
-    :return: tuple of dicts. The first is dict mapping ranged refs to all segment refs.  The second is a dict mapping each segment ref to its corresponding ranged ref.
+    Creates a TitleResolver which classifies trefs as Tanakh or Talmud without parsing a Ref.
+    Built from the Tanakh and Talmud book lists along with the books covered by the Herzog and sugya range files.
+    :return: TitleResolver
     """
-    ranged_to_segment = {}
-    segment_to_ranged = {}
-
-    for topic_ranged_ref in topic_ranged_refs:
-        ranged_to_segment[topic_ranged_ref] = {}
-        topic_seg_refs = Ref(topic_ranged_ref).range_list()
-        for seg_ref in topic_seg_refs:
-            ranged_to_segment[topic_ranged_ref][seg_ref.normal()] = ""
-            segment_to_ranged[seg_ref.normal()] = topic_ranged_ref
-
-    return ranged_to_segment, segment_to_ranged
+    title_resolver = TitleResolver()
+    title_resolver.add_titles(create_list_off_tanakh_books(), u"tanakh")
+    title_resolver.add_titles(create_list_off_talmud_books(), u"talmud")
+    title_resolver.add_titles(set(title_from_tref(tref) for tref in get_tanakh_topic_ranges()), u"tanakh")
+    title_resolver.add_titles(set(title_from_tref(tref) for tref in get_talmud_topic_ranged()), u"talmud")
+    return title_resolver
 
 
 def is_from_category(ref, books_in_category):
@@ -126,204 +120,298 @@ def is_from_category(ref, books_in_category):
     :param books_in_category: List of books in category
     :return: Boolean Value determining if Tref is within category
     """
-    try:
-        if Ref(ref).index.title in books_in_category:
-            return True
-        else:
-            return False
-    except InputError:
-        return False
-
-
-def pull_out_suffix(string):
-    """
-    Receives a string of Hebrew Text.  Iterates over every hebrew word and splits each
-    word into its root and suffix.
-    :param string: String of Hebrew Text
-    :return: String with Hebrew compound words split into Root and Suffix
-    """
-    string = string.split()
-    string = ' '.join([word_expander.get(word, word) for word in string])
-    return string
-
-
-def remove_stopwords(string):
-    """
-    Replaces Stopwords with a space character
-    :param string: String of Hebrew Text
-    :return: String without stopwords
-    """
-    return re.sub(stopwords_regex, u' ', string)
+    return ref_cache.index_title(ref) in books_in_category
 
 
-def remove_dicta_prefix(string, marker):
+def cleaning_fingerprint():
     """
-    Removes prefixes that were detected by Dicta
-    :param string: String of Hebrew Text
-    :return: String without prefixes
+    Fingerprints everything that determines how a segment is cleaned.
+    Changing any of these invalidates the segments cleaned by a previous incremental build.
+    :return: Dict mapping each component of the cleaning configuration to its fingerprint
     """
-    return re.sub(ur'[\u05d0-\u05ea]+{}'.format(marker), u'', string)
-    # return re.sub(ur'[\u05d0-\u05ea]+┉', u'', string)
+    word_expander.load()
+    return {
+        u"cleaning_version": str(CLEANING_VERSION),
+        u"stopwords": file_fingerprint(STOPWORDS_FILENAME),
+        u"phrases": file_fingerprint(PHRASES_FILENAME),
+        u"word_expander": file_fingerprint(WORD_EXPANDER_FILENAME),
+        u"word_expander_source": file_fingerprint(WORD_EXPANDER_SOURCE_FILENAME),
+        u"word_expander_version": str(WORD_EXPANDER_VERSION),
+    }
 
 
-def remove_punctuation(data):
-    """
-    Removes various punctation from Hebrew text.
-    :param data: String of Hebrew Text
-    :return: String without punctuation
+def clean_line(data, title_resolver, segment_cache=None):
     """
-    data = re.sub(ur'־', u' ', data)
-    data = re.sub(ur'\([^)]+\)', u' ', data)
-    data = re.sub(ur'<[^>]+>', u' ', data)
-    data = re.sub(ur'\[[^\]]+\]', u' ', data)
-    data = re.sub(ur'[^ \u05d0-\u05ea"\'״׳]', u' ', data)
-    data = re.sub(ur'(^|\s)["\'״׳]+', u' ', data)
-    data = re.sub(ur'["\'״׳]+(\s|$)', u' ', data)
-    return data
-
+    Cleans a single line from the Dicta Prefix file and determines which category its ref belongs to
+    :param data: A line from the dicta file
+    :param title_resolver: TitleResolver used to classify the ref
+    :param segment_cache: SegmentCache of a previous build.  Unchanged segments are taken from it instead of being cleaned
+    :return: Tuple of (ref, category, cleaned text, content hash, cache status) where category is "tanakh", "talmud"
+    or None.  The content hash and cache status are None without a segment cache.  None for a bad line
+    """
+    if this_is_a_bad_line(data):
+        return None
+
+    ref = extract_reference(data)
+    segment_hash, status, cleaned = None, None, None
+    if segment_cache:
+        segment_hash = content_hash(data.strip().split(u'~~')[1])
+        status, cleaned = segment_cache.lookup(ref, segment_hash)
+
+    if cleaned is not None:
+        data = cleaned
+    elif FUSED_TOKENIZER:
+        with instrumentation.stage("fused tokenizer", 1):
+            data = sefaria_tokenizer.clean(data.strip().split(u'~~')[1])
+    else:
+        data = strip_stopwords_and_remove_punctuation(data)
+        data = create_multiple_word_phrases(data)
 
-def strip_stopwords_and_remove_punctuation(data):
-    """
-    This method takes a string of hebrew text and does all necessary cleaning for Word2Vec.
-    :param data: String of Hebrew Text
-    :return: String ready for Word2Vec model
-    """
-    data = data.strip().split(u'~~')[1]
-    data = remove_dicta_prefix(data, u"┉")
-    data = remove_punctuation(data)
-    data = pull_out_suffix(data)
-    data = remove_stopwords(data)
-    data = u' '.join(data.split())
-    return data
+    with instrumentation.stage("category classification", 1):
+        category = title_resolver.category(ref)
+    return ref, category, data, segment_hash, status
 
 
-def create_multiple_word_phrases(data):
+def clean_shard(args):
     """
-    Combines selected multiple word phrases with underscore.
-    For example:  New York ----> New_York
-    This allows Word2Vec to handle multiple word phrases
-    :param data: String of Hebrew Text
-    :return: String with connected multiple word phrases
+    Worker for the parallel cleaning mode.  Cleans every line within one byte range of the Dicta Prefix file.
+    :param args: Tuple of (filename, start, end, title_resolver, segment_cache)
+    :return: Tuple of (list of cleaned lines, as returned by clean_line, in file order, instrumentation stats)
     """
-
-    def connect_with_underscore(matchobj):
-        return matchobj.group(1) + matchobj.group(2).replace(u" ", u"_")
-
-    return re.sub(phrases_regex, connect_with_underscore, data)
+    filename, start, end, title_resolver, segment_cache = args
+    cleaned_lines = []
+    for data in read_shard_lines(filename, start, end):
+        cleaned = clean_line(data, title_resolver, segment_cache)
+        if cleaned:
+            cleaned_lines.append(cleaned)
+    return cleaned_lines, instrumentation.take_stats()
 
 
-def this_is_a_bad_line(data):
+def iter_cleaned_lines(filename, title_resolver, processes=1, segment_cache=None):
     """
-    Checks to see if a line from the file should be included in the Word2Vec model.
-    There are some lines within the Dicta Prefix file that we cannot or do not want to include.
-    :param data: line of hebrew text from Dicta File
-    :return: Boolean Value determining if this line valid
-    """
-    if u'~~' not in data:
-        return True
-    if data.strip().split(u'~~')[1].strip().startswith(u"<br><br><big><strong>הדרן עלך"):
-        return True
-
-    return False
+    Yields every cleaned line of the Dicta Prefix file in file order.
+    With more than one process the file is split into byte shards which are cleaned by a process pool.
+    Shards are consumed in order, so the output is identical to the serial path.
+    :param filename: Dicta Prefix Filename
+    :param title_resolver: TitleResolver used to classify the refs
+    :param processes: Number of worker processes
+    :param segment_cache: Optional SegmentCache.  Every cleaned segment is recorded in it for the next build
+    :return: Generator of (ref, category, cleaned text) tuples
+    """
+    if processes <= 1:
+        all_cleaned_lines = (clean_line(data, title_resolver, segment_cache)
+                             for data in codecs.open(filename, encoding='utf8'))
+    else:
+        all_cleaned_lines = iter_cleaned_shards(filename, title_resolver, processes, segment_cache)
+
+    for index, cleaned in enumerate(all_cleaned_lines):
+        if processes <= 1 and index % 100000 == 0:
+            print index
+        if not cleaned:
+            continue
+        ref, category, data, segment_hash, status = cleaned
+        if segment_cache:
+            segment_cache.record(ref, segment_hash, data, status)
+        yield ref, category, data
 
 
-def extract_reference(data):
-    """
-    Extract Sefaria Ref from a line in the Dicta Prefix file
-    :param data: A line from the dicta file
-    :return: The Corresponding tref
+def iter_cleaned_shards(filename, title_resolver, processes, segment_cache=None):
     """
-    return data.split(u'~')[0]
+    Cleans the Dicta Prefix file with a process pool, one byte shard per task.
+    Shards are at most CLEANING_SHARD_BYTES and only CLEANING_SHARDS_PER_PROCESS of them per process are in flight,
+    so the cleaned lines held by this process do not grow with the size of the file
+    :param filename: Dicta Prefix Filename
+    :param title_resolver: TitleResolver used to classify the refs
+    :param processes: Number of worker processes
+    :param segment_cache: Optional SegmentCache of a previous build
+    :return: Generator of cleaned lines, as returned by clean_line, in file order
+    """
+    shards = get_file_shards(filename, processes * CLEANING_SHARDS_PER_PROCESS, CLEANING_SHARD_BYTES)
+    # compiled before forking so the workers map the same file instead of each compiling it
+    word_expander.load()
+    pool = multiprocessing.Pool(processes)
+    try:
+        jobs = ((filename, start, end, title_resolver, segment_cache) for start, end in shards)
+        all_cleaned_shards = iter_shard_results(pool, clean_shard, jobs, processes * CLEANING_SHARDS_PER_PROCESS)
+        for shard_index, (cleaned_lines, stats) in enumerate(all_cleaned_shards):
+            print "shard {}/{}".format(shard_index + 1, len(shards))
+            instrumentation.merge(stats)
+            for cleaned in cleaned_lines:
+                yield cleaned
+    finally:
+        pool.terminate()
 
 
-def concatenate_sematically_linked_segments(topic_ranged_refs, ranged_to_segment):
+def get_peak_memory_mb():
     """
-    Combines multiple Sefaria Segments into one larger segment based on sematical meaning
-    :param topic_ranged_refs: List of ranged trefs that define the semantic separation
-    :param ranged_to_segment: Nested dict.  First layer points from Ranged Refs to all sub-seg-refs.  The nested dict points from the sub_seg_ref to the text of said sub_seg_ref
-    :return: Dict containing semantically define ranged refs corresponding to their concatenated text
+    Peak resident set size of this process and of its finished child processes
+    :return: Tuple of (own peak RSS, largest child peak RSS) in MB
     """
-    semantic_linked_segments = {}
-    for text_ranged_ref in topic_ranged_refs:
-        object_ref = Ref(text_ranged_ref)
-        all_text_subrefs = [seg_ref.normal() for seg_ref in object_ref.range_list()]
-        all_verses = [ranged_to_segment[text_ranged_ref][seg_ref] for seg_ref in all_text_subrefs]
-        semantic_linked_segments[text_ranged_ref] = u' '.join(all_verses)
-    return semantic_linked_segments
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+    return own, children
 
 
-def get_segments(filename):
+def get_segments(filename, processes=CLEANING_PROCESSES, segment_cache=None):
     """
     Combs through the entire Sefarias Hebrew Library and cleans the text for Doc2Vec.
-    Creates a dict:
-        Key:  Ref
-        Value:  The text of that ref cleaned and ready for Doc2Vec
+    Docs are yielded as soon as they are ready.  Segments outside of Tanakh and Talmud are yielded right away,
+    Tanakh and Talmud segments are buffered until their semantically defined ranged ref is complete.
     :param filename: Dicta Prefix Filename
-    :return: Dict for Doc2Vec
+    :param processes: Number of worker processes used to clean the file
+    :param segment_cache: Optional SegmentCache.  Only segments that are new or changed since the build
+    recorded in it are cleaned
+    :return: Generator of (ref, text cleaned and ready for Doc2Vec) tuples
     """
 
-    all_tanakh_books = create_list_off_tanakh_books()
-    all_talmud_books = create_list_off_talmud_books()
-
-    tanakh_topic_ranged_refs = get_tanakh_topic_ranges()
-    talmud_topic_ranged_refs = get_talmud_topic_ranged()
-
-    tanakh_ranged_to_segment, tanakh_segment_to_ranged = segment_range_dicts(tanakh_topic_ranged_refs)
-    talmud_ranged_to_segment, talmud_segment_to_ranged = segment_range_dicts(talmud_topic_ranged_refs)
+    title_resolver = build_title_resolver()
 
-    all_data = {}
+    tanakh_buffer = RangedSegmentBuffer(get_tanakh_topic_ranges())
+    talmud_buffer = RangedSegmentBuffer(get_talmud_topic_ranged())
 
-    for index, data in enumerate(codecs.open(filename, encoding='utf8')):
-
-        if this_is_a_bad_line(data):
-            continue
-
-        ref = extract_reference(data)
-        data = strip_stopwords_and_remove_punctuation(data)
-        data = create_multiple_word_phrases(data)
-
-        if index % 100000 == 0:
-            print index
-
-        if is_from_category(ref, all_tanakh_books):
-            this_ref_ranged_reg = tanakh_segment_to_ranged[ref]
-            tanakh_ranged_to_segment[this_ref_ranged_reg][ref] = data
-        elif is_from_category(ref, all_talmud_books):
-            this_ref_ranged_reg = talmud_segment_to_ranged[ref]
-            talmud_ranged_to_segment[this_ref_ranged_reg][ref] = data
+    for ref, category, data in iter_cleaned_lines(filename, title_resolver, processes, segment_cache):
+        if category == u"tanakh":
+            completed = tanakh_buffer.add(ref, data)
+        elif category == u"talmud":
+            completed = talmud_buffer.add(ref, data)
         else:
-            all_data[ref] = data
-
-    all_data.update(concatenate_sematically_linked_segments(tanakh_topic_ranged_refs, tanakh_ranged_to_segment))
-    all_data.update(concatenate_sematically_linked_segments(talmud_topic_ranged_refs, talmud_ranged_to_segment))
-
-    return all_data
-
-
-def get_wiki_segs(filename):
-    all_data = {}
-    for index, data in enumerate(codecs.open(filename, encoding='utf8')):
-        ref = u"Random {}".format(index)
+            completed = [(ref, data)]
+        for doc in completed:
+            yield doc
+
+    for completed in tanakh_buffer.flush():
+        yield completed
+    for completed in talmud_buffer.flush():
+        yield completed
+
+
+def clean_wiki_line(data, segment_cache=None):
+    """
+    Cleans a single paragraph from the Dicta Hebrew Wikipedia file.
+    The paragraph is tagged by the hash of its text, so the same paragraph gets the same tag in every build
+    :param data: A line from the Dicta Hebrew Wikipedia file
+    :param segment_cache: SegmentCache of a previous build.  Unchanged paragraphs are taken from it instead of being cleaned
+    :return: Tuple of (tag, cleaned text, content hash, cache status).  The cache status is None without a segment
+    cache.  None for an empty line
+    """
+    data = data.strip()
+    if not data:
+        return None
+    segment_hash = content_hash(data)
+    ref = u"Wiki {}".format(segment_hash[:WIKI_TAG_HASH_LENGTH])
+    status, cleaned = segment_cache.lookup(ref, segment_hash) if segment_cache else (None, None)
+
+    if cleaned is not None:
+        data = cleaned
+    elif FUSED_TOKENIZER:
+        with instrumentation.stage("fused tokenizer", 1):
+            data = wiki_tokenizer.clean(data)
+    else:
         data = remove_dicta_prefix(data, u"\|")
         data = remove_punctuation(data)
         data = pull_out_suffix(data)
         data = remove_stopwords(data)
         data = u' '.join(data.split())
         data = create_multiple_word_phrases(data)
-        if index % 100000 == 0:
-            print index
-        all_data[ref] = data
-    return all_data
+    return ref, data, segment_hash, status
+
+
+def clean_wiki_shard(args):
+    """
+    Worker for the parallel wiki cleaning mode.  Cleans every paragraph within one byte range of the wiki file.
+    :param args: Tuple of (filename, start, end, segment_cache)
+    :return: Tuple of (list of cleaned paragraphs, as returned by clean_wiki_line, in file order,
+    instrumentation stats)
+    """
+    filename, start, end, segment_cache = args
+    lines = read_shard_lines(filename, start, end)
+    cleaned_paragraphs = [cleaned for cleaned in (clean_wiki_line(data, segment_cache) for data in lines) if cleaned]
+    return cleaned_paragraphs, instrumentation.take_stats()
+
+
+def get_wiki_segs(filename, processes=CLEANING_PROCESSES, segment_cache=None):
+    """
+    Cleans every paragraph of the Dicta Hebrew Wikipedia file, in parallel byte shards, and drops duplicates.
+    Shards are sized and scheduled like in iter_cleaned_shards, so memory does not grow with the size of the file.
+    Two paragraphs are duplicates if their cleaned text is identical, which also catches paragraphs that only differ
+    in punctuation, prefixes or stopwords.  Only the first occurrence is kept.
+    :param filename: Dicta Hebrew Wikipedia Filename
+    :param processes: Number of worker processes
+    :param segment_cache: Optional SegmentCache.  Only paragraphs that are new or changed since the build
+    recorded in it are cleaned
+    :return: Generator of (tag, text cleaned and ready for Doc2Vec) tuples, in file order
+    """
+    shards = get_file_shards(filename, max(processes, 1) * CLEANING_SHARDS_PER_PROCESS, CLEANING_SHARD_BYTES)
+    jobs = ((filename, start, end, segment_cache) for start, end in shards)
+    word_expander.load()
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    seen = set()
+    num_duplicates = 0
+    try:
+        all_cleaned_shards = iter_shard_results(pool, clean_wiki_shard, jobs, processes * CLEANING_SHARDS_PER_PROCESS)
+        for shard_index, (cleaned_paragraphs, stats) in enumerate(all_cleaned_shards):
+            print "wiki shard {}/{}".format(shard_index + 1, len(shards))
+            instrumentation.merge(stats)
+            for ref, data, segment_hash, status in cleaned_paragraphs:
+                digest = hashlib.sha1(data.encode('utf8')).digest()[:8]
+                if not data or digest in seen:
+                    num_duplicates += 1
+                    continue
+                seen.add(digest)
+                if segment_cache:
+                    segment_cache.record(ref, segment_hash, data, status)
+                yield ref, data
+    finally:
+        if pool:
+            pool.terminate()
+    print "Dropped {} empty or duplicate wiki paragraphs".format(num_duplicates)
+
+
+def write_docs(docs, the_file, binary_writer=None):
+    """
+    Writes docs to the corpus file one line at a time and reports the peak memory usage along the way
+    :param docs: Iterable of (ref, text) tuples
+    :param the_file: Open corpus file
+    :param binary_writer: Optional BinaryCorpusWriter the docs are written to as well
+    :return: Number of docs written
+    """
+    num_docs = 0
+    for k, v in docs:
+        the_file.write(u""+k+u"||||"+v+u"\n")
+        if binary_writer:
+            binary_writer.add(k, v)
+        num_docs += 1
+        if num_docs % 100000 == 0:
+            print "{} docs written, peak RSS {:.1f}MB (workers {:.1f}MB)".format(num_docs, *get_peak_memory_mb())
+    return num_docs
 
 
 if __name__ == "__main__":
-    segments = get_segments(DICTA_SEFARIA_FILENAME)
-    if HEBREW_WIKI:
-        wiki_segs = get_wiki_segs(DICTA_HEBREW_WIKI_FILENAME)
+    segment_cache = None
+    if INCREMENTAL_REBUILD:
+        segment_cache = SegmentCache(SEGMENT_CACHE_FILENAME, cleaning_fingerprint())
+        changed_components = segment_cache.changed_components()
+        if changed_components:
+            print "Cleaning configuration changed: {}".format(u", ".join(changed_components))
+
+    binary_writer = BinaryCorpusWriter(BINARY_CORPUS_PREFIX, ALL_CLEAN_DOCS_FILENAME) if WRITE_BINARY_CORPUS else None
 
     with codecs.open(ALL_CLEAN_DOCS_FILENAME, 'wb', encoding='utf8') as the_file:
-        for k, v in segments.items():
-            the_file.write(u""+k+u"||||"+v+u"\n")
+        num_docs = write_docs(get_segments(DICTA_SEFARIA_FILENAME, segment_cache=segment_cache), the_file,
+                              binary_writer)
         if HEBREW_WIKI:
-            for k, v in wiki_segs.items():
-                the_file.write(u""+k+u"||||"+v+u"\n")
\ No newline at end of file
+            num_docs += write_docs(get_wiki_segs(DICTA_HEBREW_WIKI_FILENAME, segment_cache=segment_cache), the_file,
+                                   binary_writer)
+
+    if binary_writer:
+        binary_writer.close()
+    print "Wrote {} docs, peak RSS {:.1f}MB (workers {:.1f}MB)".format(num_docs, *get_peak_memory_mb())
+
+    ref_cache.commit()
+    print ref_cache.report()
+    instrumentation.write_report("create_docs_for_doc2vec")
+
+    if segment_cache:
+        stats = segment_cache.commit()
+        print "Segments unchanged: {unchanged}, changed: {changed}, new: {new}, deleted: {deleted}".format(
+            unchanged=stats[u"unchanged"], changed=stats[u"changed"], new=stats[u"new"], deleted=stats[u"deleted"])
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+
+import numpy as np
+
+QUERY_BATCH_SIZE = 16
+TAGS_DIGEST_SUFFIX = '.tags_digest'
+
+
+def tags_digest(tags):
+    """
+    :param tags: List of doc tags
+    :return: Hex digest of the tags, in order
+    """
+    digest = hashlib.sha1()
+    for tag in tags:
+        digest.update(tag.encode('utf8'))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def load_valid_mask(valid_mask_filename, tags):
+    """
+    :param valid_mask_filename: .npy file a valid mask was cached in
+    :param tags: List of doc tags of the model
+    :return: The cached mask, or None if there is none or it was computed for other tags, or for the same tags
+        in another order
+    """
+    digest_filename = valid_mask_filename + TAGS_DIGEST_SUFFIX
+    if not os.path.exists(valid_mask_filename) or not os.path.exists(digest_filename):
+        return None
+    with open(digest_filename) as the_file:
+        if the_file.read().strip() != tags_digest(tags):
+            return None
+    valid = np.load(valid_mask_filename)
+    return valid if len(valid) == len(tags) else None
+
+
+def save_valid_mask(valid_mask_filename, tags, valid):
+    """
+    Caches a valid mask along with the digest of the tags it was computed for
+    :param valid_mask_filename: .npy file the valid mask is cached in
+    :param tags: List of doc tags of the model
+    :param valid: Boolean array with one entry per tag
+    """
+    np.save(valid_mask_filename, valid)
+    with open(valid_mask_filename + TAGS_DIGEST_SUFFIX, 'w') as the_file:
+        the_file.write(tags_digest(tags))
+
+
+def get_doc_vectors(model):
+    """
+    Reads the doc tags and doc vectors out of a Doc2Vec Model
+    :param model: Doc2Vec Model
+    :return: Tuple of (list of tags, matrix of doc vectors with one row per tag)
+    """
+    docvecs = model.docvecs
+    if hasattr(docvecs, 'index_to_key'):
+        return list(docvecs.index_to_key), docvecs.vectors
+    vectors = docvecs.vectors_docs if hasattr(docvecs, 'vectors_docs') else docvecs.doctag_syn0
+    return [docvecs.index_to_doctag(index) for index in range(len(vectors))], vectors
+
+
+def normalize_rows(vectors):
+    """
+    :param vectors: Matrix (or single vector)
+    :return: float32 copy of the matrix with every row scaled to unit length.  Rows of zeros stay zero
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class DocVectorIndex(object):
+    """
+    Cosine similarity search over every doc vector of a Doc2Vec Model.
+    Doc vectors are normalized once, so scoring a topic is a single matrix-vector product.
+    A boolean mask aligned with the docs marks which tags are valid results (for example, which tags are Refs).
+    """
+    def __init__(self, tags, vectors, valid=None):
+        """
+        :param tags: List of doc tags
+        :param vectors: Matrix of doc vectors with one row per tag
+        :param valid: Optional boolean array with one entry per tag.  Invalid tags are never returned
+        """
+        self.tags = tags
+        self.tag_to_index = dict((tag, index) for index, tag in enumerate(tags))
+        self.vectors = normalize_rows(vectors)
+        self.valid = np.ones(len(tags), dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+
+    @classmethod
+    def from_model(cls, model, is_valid_tag=None, valid_mask_filename=None):
+        """
+        Builds the index of a Doc2Vec Model
+        :param model: Doc2Vec Model
+        :param is_valid_tag: Optional function that decides if a tag is a valid result
+        :param valid_mask_filename: Optional .npy file the valid mask is cached in, since computing it can be slow.
+            The mask is only reused for the exact tags, in the order, it was computed for
+        :return: DocVectorIndex
+        """
+        tags, vectors = get_doc_vectors(model)
+        valid = None
+        if is_valid_tag is not None:
+            if valid_mask_filename:
+                valid = load_valid_mask(valid_mask_filename, tags)
+            if valid is None:
+                valid = np.array([bool(is_valid_tag(tag)) for tag in tags], dtype=bool)
+                if valid_mask_filename:
+                    save_valid_mask(valid_mask_filename, tags, valid)
+        return cls(tags, vectors, valid)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def scores(self, tags, topic_vector):
+        """
+        Cosine similarity between a topic and particular docs
+        :param tags: List of doc tags.  Tags that are not in the index score 0
+        :param topic_vector: Vector of the topic
+        :return: Array of cosine similarities aligned with tags
+        """
+        indices = np.array([self.tag_to_index.get(tag, -1) for tag in tags], dtype=np.int64)
+        scores = np.zeros(len(tags), dtype=np.float32)
+        found = indices >= 0
+        scores[found] = self.vectors[indices[found]].dot(normalize_rows(topic_vector))
+        return scores
+
+    def scores_batch(self, tags, topic_vectors):
+        """
+        Cosine similarity between many topics and particular docs, in one matrix-matrix product
+        :param tags: List of doc tags.  Tags that are not in the index score 0
+        :param topic_vectors: Matrix with one topic vector per row
+        :return: Matrix of cosine similarities with one row per tag and one column per topic
+        """
+        indices = np.array([self.tag_to_index.get(tag, -1) for tag in tags], dtype=np.int64)
+        scores = np.zeros((len(tags), len(topic_vectors)), dtype=np.float32)
+        found = indices >= 0
+        scores[found] = self.vectors[indices[found]].dot(normalize_rows(topic_vectors).T)
+        return scores
+
+    def select_above_threshold(self, similarities, threshold):
+        """
+        :param similarities: Cosine similarity of every doc
+        :param threshold: Cosine Similarity Threshold
+        :return: List of (tag, score) of every valid doc above the threshold, sorted by score
+        """
+        indices = np.flatnonzero((similarities > threshold) & self.valid)
+        indices = indices[np.argsort(-similarities[indices], kind='mergesort')]
+        return [(self.tags[index], float(similarities[index])) for index in indices]
+
+    def query(self, topic_vector, threshold):
+        """
+        Finds every doc whose cosine similarity to a topic is above a threshold
+        :param topic_vector: Vector of the topic
+        :param threshold: Cosine Similarity Threshold
+        :return: List of (tag, score) sorted by score
+        """
+        return self.select_above_threshold(self.vectors.dot(normalize_rows(topic_vector)), threshold)
+
+    def query_batch(self, topic_vectors, threshold, batch_size=QUERY_BATCH_SIZE):
+        """
+        Finds every doc above a threshold for many topics, scoring batch_size topics per matrix-matrix product
+        :param topic_vectors: Matrix with one topic vector per row
+        :param threshold: Cosine Similarity Threshold
+        :param batch_size: Number of topics scored at once, which bounds the memory used by the similarity matrix
+        :return: List with one list of (tag, score) per topic
+        """
+        topic_vectors = normalize_rows(topic_vectors)
+        results = []
+        for start in range(0, len(topic_vectors), batch_size):
+            similarities = self.vectors.dot(topic_vectors[start:start + batch_size].T)
+            for column in range(similarities.shape[1]):
+                results.append(self.select_above_threshold(similarities[:, column], threshold))
+        return results
+
+    def most_similar(self, topic_vector, topn):
+        """
+        :param topic_vector: Vector of the topic
+        :param topn: Number of docs to return
+        :return: List of (tag, score) of the topn most similar valid docs, sorted by score
+        """
+        similarities = self.vectors.dot(normalize_rows(topic_vector))
+        similarities = np.where(self.valid, similarities, -np.inf)
+        topn = min(topn, len(similarities))
+        if topn <= 0:
+            return []
+        indices = np.argpartition(-similarities, topn - 1)[:topn]
+        indices = indices[np.argsort(-similarities[indices], kind='mergesort')]
+        return [(self.tags[index], float(similarities[index])) for index in indices if self.valid[index]]
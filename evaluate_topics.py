@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import json
+import multiprocessing
+import time
+from optparse import OptionParser
+
+from Constants import TEST_TOPICS, DOC2VEC_MODEL
+import Doc2Vec_test_model as test_model
+from quantized_vectors import DTYPES
+from instrumentation import instrumentation
+
+model = None
+
+
+class JsonDictStreamWriter(object):
+    """
+    Writes a JSON object one key at a time, so that results are on disk as soon as they are ready.
+    The finished file has the same layout as Doc2Vec_test_model.save_dict_in_json.
+    """
+    def __init__(self, filename):
+        """
+        :param filename: Name of the JSON file
+        """
+        self.the_file = codecs.open(filename, 'w', encoding='utf8')
+        self.the_file.write(u"{")
+        self.num_items = 0
+
+    def write(self, key, value):
+        """
+        :param key: Key of the item
+        :param value: JSON serializable value of the item
+        """
+        value = json.dumps(value, indent=2, ensure_ascii=False).replace(u"\n", u"\n  ")
+        self.the_file.write(u", " if self.num_items else u"")
+        self.the_file.write(u"\n  {}: {}".format(json.dumps(key, ensure_ascii=False), value))
+        self.the_file.flush()
+        self.num_items += 1
+
+    def close(self):
+        self.the_file.write(u"\n}" if self.num_items else u"}")
+        self.the_file.close()
+
+
+def read_topics(filename):
+    """
+    :param filename: Name of a UTF-8 file with one topic per line
+    :return: List of topics
+    """
+    with codecs.open(filename, encoding='utf8') as the_file:
+        return [line.strip() for line in the_file if line.strip()]
+
+
+def load_shared_model(model_filename, quantized_dtype=None):
+    """
+    Loads the model with its arrays memory-mapped and computes everything the workers read from it.
+    The workers are forked afterwards, so the model, the DocVectorIndex and the link graph are shared between them
+    instead of being loaded once per process.
+    :param model_filename: Name of the Doc2Vec Model
+    :param quantized_dtype: "float16" or "int8" to score with the quantized vectors of the model, None for the model
+    """
+    global model
+    model = test_model.load_model(model_filename, mmap='r', quantized_dtype=quantized_dtype)
+    test_model.load_result_cache(model_filename)
+    if hasattr(model.wv, 'fill_norms'):
+        model.wv.fill_norms()
+    elif hasattr(model.wv, 'init_sims'):
+        model.wv.init_sims()
+    test_model.get_doc_vector_index(model)
+    test_model.ref_cache.commit()
+
+
+def evaluate_topic(topic):
+    """
+    Evaluates the model on one topic
+    :param topic: Topic to test the model
+    :return: Tuple of (topic, related words, related sources, instrumentation stats), with None results if the topic
+    is not in the model
+    """
+    if topic not in model.wv:
+        return topic, None, None, instrumentation.take_stats()
+    try:
+        related_words = test_model.evaluate_words(model, topic)
+        related_sources = test_model.evaluate_topic(model, topic)
+    finally:
+        test_model.ref_cache.commit()
+    return topic, related_words, related_sources, instrumentation.take_stats()
+
+
+def evaluate_topics(topics, processes, words_filename, topics_filename):
+    """
+    Evaluates the model on many topics in parallel.  Each topic is written to the output files as soon as it finishes.
+    :param topics: List of topics to test the model
+    :param processes: Number of worker processes
+    :param words_filename: JSON file the related words of each topic are written to
+    :param topics_filename: JSON file the related sources of each topic are written to
+    :return: Number of topics evaluated
+    """
+    words_writer = JsonDictStreamWriter(words_filename)
+    topics_writer = JsonDictStreamWriter(topics_filename)
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    results = pool.imap_unordered(evaluate_topic, topics) if pool else (evaluate_topic(topic) for topic in topics)
+    num_evaluated = 0
+    start = time.time()
+    try:
+        for topic, related_words, related_sources, stats in results:
+            instrumentation.merge(stats)
+            if related_words is None:
+                print(u"{} is not in the model, skipping".format(topic).encode('utf8'))
+                continue
+            words_writer.write(topic, related_words)
+            topics_writer.write(topic, related_sources)
+            num_evaluated += 1
+            print(u"{}/{} {} ({:.1f}s)".format(num_evaluated, len(topics), topic, time.time() - start).encode('utf8'))
+    finally:
+        if pool:
+            pool.terminate()
+        words_writer.close()
+        topics_writer.close()
+    return num_evaluated
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-m", "--model", dest="model", action="store", type="string", default=DOC2VEC_MODEL)
+    parser.add_option("-t", "--topics", dest="topics", action="store", type="string", default=None,
+                      help="UTF-8 file with one topic per line, defaults to Constants.TEST_TOPICS")
+    parser.add_option("-p", "--processes", dest="processes", action="store", type="int",
+                      default=multiprocessing.cpu_count())
+    parser.add_option("-q", "--quantized", dest="quantized", action="store", type="choice", choices=DTYPES,
+                      default=None, help="Score with the quantized vectors exported by quantized_vectors.py")
+    parser.add_option("--words-output", dest="words_output", action="store", type="string", default='test_words.json')
+    parser.add_option("--topics-output", dest="topics_output", action="store", type="string",
+                      default='test_topics.json')
+    (options, args) = parser.parse_args()
+
+    topics = read_topics(options.topics) if options.topics else TEST_TOPICS
+    test_model.prepare_evaluation()
+    load_shared_model(options.model, options.quantized)
+    evaluate_topics(topics, options.processes, options.words_output, options.topics_output)
+    instrumentation.write_report("evaluate_topics")
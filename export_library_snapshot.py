@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+from optparse import OptionParser
+
+import local_settings
+import django
+
+from Constants import LIBRARY_SNAPSHOT_FILENAME
+from ref_engine import SNAPSHOT_VERSION
+
+django.setup()
+
+from sefaria.model import library
+from sefaria.system.exceptions import InputError
+
+
+def segment_counts(segment_sections, depth):
+    """
+    Builds the nested segment counts of a text node from the sections of its segments
+    For Example: a depth 2 node with segments 1:1, 1:2 and 3:1 ----> [2, 0, 1]
+    :param segment_sections: List of the sections of every segment of the node
+    :param depth: Depth of the node
+    :return: Number of segments for a depth 1 node, otherwise a list with the counts of every section
+    """
+    if depth == 1:
+        return max([sections[0] for sections in segment_sections] or [0])
+    children = {}
+    for sections in segment_sections:
+        children.setdefault(sections[0], []).append(sections[1:])
+    return [segment_counts(children.get(section, []), depth - 1)
+            for section in range(1, max(children or [0]) + 1)]
+
+
+def node_snapshot(index, node):
+    """
+    :param index: Sefaria Index
+    :param node: JaggedArrayNode of the index
+    :return: Dict with what the RefEngine needs to know about the node
+    """
+    segment_sections = [seg_ref.sections for seg_ref in node.ref().all_segment_refs()]
+    return {
+        u"index": index.title,
+        u"categories": index.categories,
+        u"depth": node.depth,
+        u"address_types": node.addressTypes,
+        u"counts": segment_counts(segment_sections, node.depth),
+    }
+
+
+def export_library_snapshot(filename):
+    """
+    Exports every text node of the library, keyed by its full title, for the RefEngine
+    :param filename: Name of the library snapshot
+    :return: Number of text nodes exported
+    """
+    nodes = {}
+    for index_number, index in enumerate(library.all_index_records()):
+        try:
+            for node in index.nodes.get_leaf_nodes():
+                nodes[node.full_title(u"en")] = node_snapshot(index, node)
+        except (InputError, AttributeError) as e:
+            print(u"Skipping {}: {}".format(index.title, e).encode('utf8'))
+        if index_number % 500 == 0:
+            print("{} indexes, {} text nodes exported".format(index_number, len(nodes)))
+    with open(filename + '.tmp', 'w') as the_file:
+        json.dump({u"version": SNAPSHOT_VERSION, u"nodes": nodes}, the_file, separators=(',', ':'))
+    os.rename(filename + '.tmp', filename)
+    return len(nodes)
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-o", "--output", dest="output", action="store", type="string",
+                      default=LIBRARY_SNAPSHOT_FILENAME)
+    (options, args) = parser.parse_args()
+
+    start = time.time()
+    num_nodes = export_library_snapshot(options.output)
+    print("Exported {} text nodes to {} in {:.1f}s".format(num_nodes, options.output, time.time() - start))
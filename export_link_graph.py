@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+from Constants import DOC2VEC_MODEL, LINK_GRAPH_PREFIX
+from ref_engine import setup_sefaria
+
+setup_sefaria(force=True)
+
+from link_graph import LinkGraphBuilder
+from Doc2Vec_test_model import linkset_refs, ref_is_segment_level, get_doc_vector_index, load_model
+
+from sefaria.system.exceptions import InputError
+
+
+def export_link_graph(query_refs, prefix):
+    """
+    Exports the links of every Ref that add_popular_links and page_rank_score can look up.
+    These are the Refs that are docs of the model, and every segment level Ref linked to one of them.
+    :param query_refs: List of Refs that are docs of the model
+    :param prefix: Path prefix of the link graph files
+    :return: Number of Refs whose links were exported
+    """
+    builder = LinkGraphBuilder()
+    exported = set()
+    segment_level_neighbours = set()
+
+    def export(tref):
+        try:
+            linked_refs = linkset_refs(tref)
+        except InputError:
+            return []
+        builder.add(tref, linked_refs)
+        exported.add(tref)
+        if len(exported) % 10000 == 0:
+            print("{} refs exported".format(len(exported)))
+        return linked_refs
+
+    for tref in query_refs:
+        segment_level_neighbours.update(x for x in export(tref) if ref_is_segment_level(x))
+    for tref in segment_level_neighbours - exported:
+        export(tref)
+
+    builder.save(prefix, ref_is_segment_level)
+    return len(exported)
+
+
+if __name__ == "__main__":
+    start = time.time()
+    model = load_model(DOC2VEC_MODEL)
+    doc_vector_index = get_doc_vector_index(model)
+    query_refs = [tag for tag, valid in zip(doc_vector_index.tags, doc_vector_index.valid) if valid]
+    num_exported = export_link_graph(query_refs, LINK_GRAPH_PREFIX)
+    print("Exported the links of {} refs in {:.1f}s".format(num_exported, time.time() - start))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import os
+
+
+def get_file_shards(filename, num_shards, max_shard_bytes=None):
+    """
+    Splits a file into contiguous byte ranges.  Every range begins at the start of a line and ends right after a newline,
+    so that no line is split between two shards.
+    :param filename: Name of the file to split
+    :param num_shards: Desired number of shards
+    :param max_shard_bytes: Optional size limit of a shard.  Large files are split into more shards to stay within it
+    :return: List of (start, end) byte offsets in file order
+    """
+    file_size = os.path.getsize(filename)
+    if max_shard_bytes:
+        num_shards = max(num_shards, -(-file_size // max_shard_bytes))
+    boundaries = [0]
+    with open(filename, 'rb') as the_file:
+        for shard in range(1, num_shards):
+            offset = max(file_size * shard // num_shards, boundaries[-1])
+            if offset >= file_size:
+                break
+            the_file.seek(offset)
+            the_file.readline()
+            boundaries.append(the_file.tell())
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+def read_shard_lines(filename, start, end):
+    """
+    :param filename: Name of a UTF-8 file
+    :param start: Byte offset of the shard, from get_file_shards
+    :param end: Byte offset right after the shard, from get_file_shards
+    :return: List of the lines of the shard, with their line endings
+    """
+    with open(filename, 'rb') as the_file:
+        the_file.seek(start)
+        chunk = the_file.read(end - start).decode('utf8')
+    return chunk.splitlines(True)
+
+
+def iter_shard_results(pool, worker, jobs, max_pending):
+    """
+    Runs the jobs on a process pool and yields their results in job order.
+    Unlike pool.imap, at most max_pending jobs are submitted ahead of the result being consumed, so the results
+    waiting in this process stay bounded no matter how large the file is.
+    :param pool: multiprocessing Pool, or None to run the jobs in this process
+    :param worker: Function run on every job
+    :param jobs: Iterable of jobs
+    :param max_pending: Number of jobs submitted ahead of the result being consumed
+    :return: Generator of the results in job order
+    """
+    if pool is None:
+        for job in jobs:
+            yield worker(job)
+        return
+    pending = collections.deque()
+    for job in jobs:
+        pending.append(pool.apply_async(worker, (job,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
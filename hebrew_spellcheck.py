@@ -1,8 +1,21 @@
 # coding: utf-8
 
 import codecs
+import hashlib
 import json
+import mmap
+import os
 import re
+import struct
+
+from Constants import WORD_EXPANDER_FILENAME, WORD_EXPANDER_SOURCE_FILENAME
+
+WORD_EXPANDER_MAGIC = b"WEXP"
+# bump whenever the compiled format or the way replacements are derived from the source changes
+WORD_EXPANDER_VERSION = 2
+WORD_EXPANDER_HEADER = struct.Struct("<4sII20s")
+OFFSET = struct.Struct("<I")
+WORD_EXPANDER_CACHE_SIZE = 200000
 
 dictionary_for_suffixes = {
     u"כינוי": {
@@ -153,8 +166,22 @@ def read_in_json_file(filename):
     return whole_file
 
 
-def split_word_into_root_and_suffix():
-    whole_file = read_in_json_file('./all_hebrew_inv.json')
+def source_digest(filename=WORD_EXPANDER_SOURCE_FILENAME):
+    """
+    :param filename: Name of the file the word expander is derived from
+    :return: SHA-1 digest of the file, as 20 bytes, or None if the file does not exist
+    """
+    if not os.path.exists(filename):
+        return None
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as the_file:
+        for block in iter(lambda: the_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def split_word_into_root_and_suffix(filename=WORD_EXPANDER_SOURCE_FILENAME):
+    whole_file = read_in_json_file(filename)
     word_expander = {}
     for full_word, all_conjugations in whole_file.items():
         replacements = [create_each_replacement(each_conj) for each_conj in all_conjugations]
@@ -164,6 +191,171 @@ def split_word_into_root_and_suffix():
     return word_expander
 
 
-word_expander = split_word_into_root_and_suffix()
+def compile_word_expander(word_expander, filename, digest=None):
+    """
+    Writes the word expander in a compact binary format that can be memory-mapped.
+    The file holds a header, the offsets of every key, the offsets of every value, and then all keys and values
+    encoded as UTF-8.  Keys are sorted by their UTF-8 bytes so that they can be binary searched.
+    The header records the format version and the digest of the source file, so a stale file can be detected.
+    :param word_expander: Dict mapping a word to its prefix-root-suffix replacement
+    :param filename: Name of the compiled file
+    :param digest: SHA-1 digest of the file the word expander was derived from, as returned by source_digest
+    """
+    items = sorted((word.encode('utf8'), replacement.encode('utf8')) for word, replacement in word_expander.items())
+    key_offsets, value_offsets = [0], [0]
+    for key, value in items:
+        key_offsets.append(key_offsets[-1] + len(key))
+        value_offsets.append(value_offsets[-1] + len(value))
+
+    tmp_filename = filename + '.tmp.{}'.format(os.getpid())
+    with open(tmp_filename, 'wb') as the_file:
+        the_file.write(WORD_EXPANDER_HEADER.pack(WORD_EXPANDER_MAGIC, WORD_EXPANDER_VERSION, len(items),
+                                                 digest or b"\0" * 20))
+        the_file.write(struct.pack("<{}I".format(len(key_offsets)), *key_offsets))
+        the_file.write(struct.pack("<{}I".format(len(value_offsets)), *value_offsets))
+        the_file.write(b"".join(key for key, _ in items))
+        the_file.write(b"".join(value for _, value in items))
+    os.rename(tmp_filename, filename)
+
+
+class MappedWordExpander(object):
+    """
+    Read-only word expander backed by a memory-mapped file written by compile_word_expander.
+    Every process that maps the file shares the same pages.  Lookups binary search the sorted keys and
+    are memoized in a small per-process cache.
+    """
+    def __init__(self, filename):
+        """
+        :param filename: Name of the compiled file
+        """
+        with open(filename, 'rb') as the_file:
+            self.data = mmap.mmap(the_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.source_digest = WORD_EXPANDER_HEADER.unpack_from(self.data, 0)
+        if magic != WORD_EXPANDER_MAGIC or version != WORD_EXPANDER_VERSION:
+            raise ValueError("{} is not a compiled word expander of version {}".format(filename,
+                                                                                      WORD_EXPANDER_VERSION))
+        self.key_offsets_start = WORD_EXPANDER_HEADER.size
+        self.value_offsets_start = self.key_offsets_start + OFFSET.size * (self.count + 1)
+        self.keys_start = self.value_offsets_start + OFFSET.size * (self.count + 1)
+        self.values_start = self.keys_start + self.offset(self.key_offsets_start, self.count)
+        self.cache = {}
+
+    def offset(self, offsets_start, index):
+        """
+        Reads one entry of an offsets table
+        :param offsets_start: Position of the offsets table in the file
+        :param index: Index of the entry
+        :return: Offset
+        """
+        return OFFSET.unpack_from(self.data, offsets_start + OFFSET.size * index)[0]
+
+    def key(self, index):
+        """
+        :param index: Index of a key in sorted order
+        :return: The key as UTF-8 bytes
+        """
+        start = self.keys_start + self.offset(self.key_offsets_start, index)
+        end = self.keys_start + self.offset(self.key_offsets_start, index + 1)
+        return self.data[start:end]
+
+    def value(self, index):
+        """
+        :param index: Index of a key in sorted order
+        :return: The replacement of that key
+        """
+        start = self.values_start + self.offset(self.value_offsets_start, index)
+        end = self.values_start + self.offset(self.value_offsets_start, index + 1)
+        return self.data[start:end].decode('utf8')
+
+    def find(self, word):
+        """
+        Binary searches the compiled keys
+        :param word: Word to look up
+        :return: The replacement of the word, or None if the word is not in the expander
+        """
+        key = word.encode('utf8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.key(low) == key:
+            return self.value(low)
+        return None
+
+    def get(self, word, default=None):
+        try:
+            replacement = self.cache[word]
+        except KeyError:
+            if len(self.cache) >= WORD_EXPANDER_CACHE_SIZE:
+                self.cache.clear()
+            replacement = self.cache[word] = self.find(word)
+        return default if replacement is None else replacement
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __len__(self):
+        return self.count
+
+
+def stale_reason(filename, digest):
+    """
+    :param filename: Name of the compiled file
+    :param digest: SHA-1 digest of the source file, or None if there is no source file to compare with
+    :return: Why the compiled file has to be compiled again, or None if it is current
+    """
+    if not os.path.exists(filename):
+        return "it does not exist"
+    with open(filename, 'rb') as the_file:
+        header = the_file.read(WORD_EXPANDER_HEADER.size)
+    if len(header) < WORD_EXPANDER_HEADER.size:
+        return "it is truncated"
+    magic, version, _, compiled_digest = WORD_EXPANDER_HEADER.unpack(header)
+    if magic != WORD_EXPANDER_MAGIC or version != WORD_EXPANDER_VERSION:
+        return "it is not of version {}".format(WORD_EXPANDER_VERSION)
+    if digest is not None and compiled_digest != digest:
+        return "its source file changed"
+    return None
+
+
+class LazyWordExpander(object):
+    """
+    Stands in for the word expander until it is first used.  Maps the compiled word expander on first lookup,
+    compiling it from all_hebrew_inv.json if the compiled file does not exist yet, is of an older version or was
+    compiled from a different all_hebrew_inv.json.
+    """
+    def __init__(self, filename, source_filename=WORD_EXPANDER_SOURCE_FILENAME):
+        self.filename = filename
+        self.source_filename = source_filename
+        self.expander = None
+
+    def load(self):
+        if self.expander is None:
+            digest = source_digest(self.source_filename)
+            reason = stale_reason(self.filename, digest)
+            if reason is not None:
+                print("Compiling {}, {}".format(self.filename, reason))
+                compile_word_expander(split_word_into_root_and_suffix(self.source_filename), self.filename, digest)
+            self.expander = MappedWordExpander(self.filename)
+        return self.expander
+
+    def get(self, word, default=None):
+        return self.load().get(word, default)
+
+    def __contains__(self, word):
+        return word in self.load()
+
+    def __len__(self):
+        return len(self.load())
+
+
+word_expander = LazyWordExpander(WORD_EXPANDER_FILENAME)
 
 
+if __name__ == "__main__":
+    compile_word_expander(split_word_into_root_and_suffix(), WORD_EXPANDER_FILENAME, source_digest())
+    print("Compiled {} words into {}".format(len(MappedWordExpander(WORD_EXPANDER_FILENAME)),
+                                            WORD_EXPANDER_FILENAME))
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import regex as re
+
+QUOTES = u"\"'״׳"
+TOKEN_REGEX = re.compile(u"[\u05d0-\u05ea\"'״׳]+")
+PARENTHESES_REGEX = re.compile(u"\\([^)]+\\)")
+HTML_TAG_REGEX = re.compile(u"<[^>]+>")
+SQUARE_BRACKETS_REGEX = re.compile(u"\\[[^\\]]+\\]")
+PHRASE_END = None
+
+
+class PhraseTrie(object):
+    """
+    Joins multiple word phrases with underscore.
+    Phrases are stored in a trie keyed on their words.  Tokens are scanned from left to right and at every token
+    the longest phrase starting there is joined, so the cost is linear in the number of tokens (times the length
+    of the longest phrase) no matter how many phrases there are.
+    """
+    def __init__(self, phrases):
+        """
+        :param phrases: List of multiple word phrases, words separated by spaces
+        """
+        self.root = {}
+        for phrase in phrases:
+            words = phrase.split()
+            if not words:
+                continue
+            node = self.root
+            for word in words:
+                node = node.setdefault(word, {})
+            node[PHRASE_END] = u"_".join(words)
+
+    def join(self, tokens):
+        """
+        Combines multiple word phrases with underscore, preferring the longest phrase
+        For example:  [New, York, City] ----> [New_York_City]
+        :param tokens: List of tokens
+        :return: List of tokens with connected multiple word phrases
+        """
+        root = self.root
+        joined = []
+        index = 0
+        num_tokens = len(tokens)
+        while index < num_tokens:
+            node = root.get(tokens[index])
+            longest_phrase = None
+            longest_end = index + 1
+            end = index + 1
+            while node is not None:
+                if PHRASE_END in node:
+                    longest_phrase = node[PHRASE_END]
+                    longest_end = end
+                if end == num_tokens:
+                    break
+                node = node.get(tokens[end])
+                end += 1
+            if longest_phrase is None:
+                joined.append(tokens[index])
+            else:
+                joined.append(longest_phrase)
+            index = longest_end
+        return joined
+
+
+class HebrewTokenizer(object):
+    """
+    Cleans a segment of Hebrew text for Doc2Vec while scanning it once and emitting tokens directly.
+    Gives the same output as the chain remove_dicta_prefix -> remove_punctuation -> pull_out_suffix ->
+    remove_stopwords -> create_multiple_word_phrases in text_cleaning.
+
+    Prefix markers and bracketed text are removed with a regex only when the marker or bracket actually
+    occurs in the text, since these removals depend on the order they are applied in.
+    Everything else (maqaf, punctuation, leading and trailing quotes, suffix expansion, stopwords and
+    multiple word phrases) is handled in a single pass over the tokens.
+    """
+    def __init__(self, stopwords, phrases, word_expander, prefix_marker=u"┉"):
+        """
+        :param stopwords: List of stopwords
+        :param phrases: List of multiple word phrases
+        :param word_expander: Mapping of a word to its prefix-root-suffix replacement
+        :param prefix_marker: Character Dicta uses to mark a detected prefix
+        """
+        self.stopwords = frozenset(stopwords)
+        self.word_expander = word_expander
+        self.prefix_marker = prefix_marker
+        self.prefix_regex = re.compile(u"[\u05d0-\u05ea]+{}".format(re.escape(prefix_marker)))
+        self.phrase_trie = PhraseTrie(phrases)
+
+    def remove_brackets(self, text):
+        """
+        Removes Dicta prefixes, parentheses, html tags and square brackets along with their content
+        :param text: String of Hebrew Text
+        :return: String without prefixes or bracketed text
+        """
+        if self.prefix_marker in text:
+            text = self.prefix_regex.sub(u'', text)
+        if u'(' in text:
+            text = PARENTHESES_REGEX.sub(u' ', text)
+        if u'<' in text:
+            text = HTML_TAG_REGEX.sub(u' ', text)
+        if u'[' in text:
+            text = SQUARE_BRACKETS_REGEX.sub(u' ', text)
+        return text
+
+    def tokenize(self, text):
+        """
+        Cleans a string of Hebrew text
+        :param text: String of Hebrew Text
+        :return: List of tokens ready for Doc2Vec
+        """
+        text = self.remove_brackets(text)
+        stopwords = self.stopwords
+        expand = self.word_expander.get
+        tokens = []
+        for word in TOKEN_REGEX.findall(text):
+            word = word.strip(QUOTES)
+            if not word:
+                continue
+            expanded = expand(word)
+            if expanded is None:
+                if word not in stopwords:
+                    tokens.append(word)
+            else:
+                tokens.extend(part for part in expanded.split() if part not in stopwords)
+        return self.phrase_trie.join(tokens)
+
+    def clean(self, text):
+        """
+        Cleans a string of Hebrew text
+        :param text: String of Hebrew Text
+        :return: String ready for Doc2Vec
+        """
+        return u' '.join(self.tokenize(text))
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import json
+import os
+import resource
+import time
+from collections import OrderedDict
+
+from Constants import INSTRUMENTATION_ENV_VARIABLE, INSTRUMENTATION_REPORT_FILENAME
+
+CALLS, ITEMS, WALL, CPU, RSS_GROWTH, PEAK_RSS = range(6)
+
+
+def get_usage():
+    """
+    :return: Tuple of (CPU seconds, peak RSS in KB) of this process so far
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+class NullStage(object):
+    """
+    Stage returned while instrumentation is off.  It records nothing.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, items):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage(object):
+    """
+    Measures one run of a stage: wall time, CPU time, items processed and how much it raised the peak RSS
+    """
+    __slots__ = ('instrumentation', 'name', 'items', 'start_wall', 'start_cpu', 'start_rss')
+
+    def __init__(self, instrumentation, name, items):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.items = items
+
+    def add(self, items):
+        """
+        :param items: Number of items processed, added to the count of this run
+        """
+        self.items += items
+
+    def __enter__(self):
+        self.start_cpu, self.start_rss = get_usage()
+        self.start_wall = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.time() - self.start_wall
+        cpu, rss = get_usage()
+        self.instrumentation.record(self.name, self.items, wall, cpu - self.start_cpu, rss - self.start_rss, rss)
+        return False
+
+
+class Instrumentation(object):
+    """
+    Per-stage counters of a pipeline run.  For every stage it sums the number of calls, the items processed,
+    the wall time, the CPU time and how much the stage raised the peak RSS of the process, and keeps the peak RSS
+    seen when the stage finished.
+    When it is off, stage() hands out one shared no-op context manager and timed() returns functions undecorated,
+    so the hooks cost next to nothing.
+    """
+    def __init__(self, enabled):
+        """
+        :param enabled: Whether to record anything
+        """
+        self.enabled = enabled
+        self.start = time.time()
+        self.stages = OrderedDict()
+        self.pid = os.getpid()
+
+    def stage(self, name, items=0):
+        """
+        Context manager measuring a stage.  Items processed can be added to the yielded stage with add()
+        :param name: Name of the stage
+        :param items: Number of items processed
+        :return: Stage
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name, items)
+
+    def timed(self, name, count_items=None):
+        """
+        Decorator measuring every call of a function as a stage
+        :param name: Name of the stage
+        :param count_items: Function of the return value giving the number of items processed, one per call if None
+        :return: Decorator
+        """
+        def decorator(function):
+            if not self.enabled:
+                return function
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name) as stage:
+                    result = function(*args, **kwargs)
+                    stage.add(count_items(result) if count_items else 1)
+                return result
+            return wrapper
+        return decorator
+
+    def record(self, name, items, wall, cpu, rss_growth, peak_rss):
+        """
+        Adds one run of a stage.  A process forked after stages were recorded starts over, so its stats can be
+        merged back into the parent without counting the parent's twice.
+        """
+        if self.pid != os.getpid():
+            self.stages = OrderedDict()
+            self.pid = os.getpid()
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = [0, 0, 0.0, 0.0, 0, 0]
+        stats[CALLS] += 1
+        stats[ITEMS] += items
+        stats[WALL] += wall
+        stats[CPU] += cpu
+        stats[RSS_GROWTH] += rss_growth
+        stats[PEAK_RSS] = max(stats[PEAK_RSS], peak_rss)
+
+    def take_stats(self):
+        """
+        Hands the stats of a worker process over to be merged in the parent, and clears them
+        :return: List of (stage name, stats), or None when instrumentation is off
+        """
+        if not self.enabled:
+            return None
+        stats = [(name, stats) for name, stats in self.stages.items()] if self.pid == os.getpid() else []
+        self.stages = OrderedDict()
+        self.pid = os.getpid()
+        return stats
+
+    def merge(self, stats):
+        """
+        :param stats: Stats from take_stats of a worker process
+        """
+        for name, worker_stats in stats or []:
+            merged = self.stages.get(name)
+            if merged is None:
+                merged = self.stages[name] = [0, 0, 0.0, 0.0, 0, 0]
+            for index in (CALLS, ITEMS, WALL, CPU, RSS_GROWTH):
+                merged[index] += worker_stats[index]
+            merged[PEAK_RSS] = max(merged[PEAK_RSS], worker_stats[PEAK_RSS])
+
+    def report(self, run_name):
+        """
+        :param run_name: Name of the run
+        :return: JSON serializable report of every stage
+        """
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+        stages = OrderedDict()
+        for name, stats in self.stages.items():
+            stages[name] = OrderedDict([
+                ("calls", stats[CALLS]),
+                ("items", stats[ITEMS]),
+                ("wall_seconds", round(stats[WALL], 6)),
+                ("cpu_seconds", round(stats[CPU], 6)),
+                ("items_per_second", round(stats[ITEMS] / stats[WALL], 1) if stats[WALL] else None),
+                ("rss_growth_mb", round(stats[RSS_GROWTH] / 1024.0, 1)),
+                ("peak_rss_mb", round(stats[PEAK_RSS] / 1024.0, 1)),
+            ])
+        return OrderedDict([
+            ("run", run_name),
+            ("started", time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start))),
+            ("wall_seconds", round(time.time() - self.start, 3)),
+            ("peak_rss_mb", round(own, 1)),
+            ("workers_peak_rss_mb", round(children, 1)),
+            ("stages", stages),
+        ])
+
+    def write_report(self, run_name, filename=None):
+        """
+        Writes the report of a run as JSON, if instrumentation is on
+        :param run_name: Name of the run
+        :param filename: Name of the report file, by default INSTRUMENTATION_REPORT_FILENAME for the run
+        :return: Name of the report file, or None when instrumentation is off
+        """
+        if not self.enabled:
+            return None
+        filename = filename or INSTRUMENTATION_REPORT_FILENAME.format(run_name)
+        with open(filename, 'w') as the_file:
+            json.dump(self.report(run_name), the_file, indent=2)
+        return filename
+
+
+instrumentation = Instrumentation(os.environ.get(INSTRUMENTATION_ENV_VARIABLE, "") not in ("", "0"))
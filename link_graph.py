@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import os
+
+import numpy as np
+
+REFS_SUFFIX = '.refs'
+INDPTR_SUFFIX = '.indptr.npy'
+INDICES_SUFFIX = '.indices.npy'
+EXPORTED_SUFFIX = '.exported.npy'
+SEGMENT_LEVEL_SUFFIX = '.segment_level.npy'
+
+
+def link_graph_exists(prefix):
+    """
+    :param prefix: Path prefix of the link graph files
+    :return: Boolean Value determining if every file of the link graph exists
+    """
+    return all(os.path.exists(prefix + suffix)
+               for suffix in [REFS_SUFFIX, INDPTR_SUFFIX, INDICES_SUFFIX, EXPORTED_SUFFIX, SEGMENT_LEVEL_SUFFIX])
+
+
+class LinkGraphBuilder(object):
+    """
+    Collects the linked Refs of many Refs and writes them as a link graph.
+    The graph is stored in CSR form:
+        <prefix>.refs               one tref per line, the line number is the id of the tref
+        <prefix>.indptr.npy         int64, the links of id i are indices[indptr[i]:indptr[i + 1]]
+        <prefix>.indices.npy        int32 ids of the linked trefs, in the order the linkset returned them
+        <prefix>.exported.npy       bool per id, True if the links of that tref were exported
+        <prefix>.segment_level.npy  bool per id, True if the tref is a segment level Ref
+    """
+    def __init__(self):
+        self.ref_to_id = {}
+        self.refs = []
+        self.links = {}
+
+    def get_id(self, tref):
+        """
+        :param tref: tref
+        :return: Id of the tref, assigning a new one if needed
+        """
+        if tref not in self.ref_to_id:
+            self.ref_to_id[tref] = len(self.refs)
+            self.refs.append(tref)
+        return self.ref_to_id[tref]
+
+    def add(self, tref, linked_refs):
+        """
+        Records every Ref linked to a Ref
+        :param tref: Selected Ref
+        :param linked_refs: List of all Refs linked to the selected Ref, duplicates included
+        """
+        self.links[self.get_id(tref)] = [self.get_id(linked_ref) for linked_ref in linked_refs]
+
+    def save(self, prefix, is_segment_level):
+        """
+        Writes the link graph
+        :param prefix: Path prefix of the link graph files
+        :param is_segment_level: Function that determines if a tref is a segment level Ref
+        """
+        indptr = np.zeros(len(self.refs) + 1, dtype=np.int64)
+        for ref_id in range(len(self.refs)):
+            indptr[ref_id + 1] = indptr[ref_id] + len(self.links.get(ref_id, ()))
+        indices = np.zeros(indptr[-1], dtype=np.int32)
+        for ref_id, linked_ids in self.links.items():
+            indices[indptr[ref_id]:indptr[ref_id + 1]] = linked_ids
+        exported = np.zeros(len(self.refs), dtype=bool)
+        exported[list(self.links.keys())] = True
+
+        np.save(prefix + INDPTR_SUFFIX, indptr)
+        np.save(prefix + INDICES_SUFFIX, indices)
+        np.save(prefix + EXPORTED_SUFFIX, exported)
+        np.save(prefix + SEGMENT_LEVEL_SUFFIX, np.array([bool(is_segment_level(tref)) for tref in self.refs], dtype=bool))
+        with codecs.open(prefix + REFS_SUFFIX, 'wb', encoding='utf8') as the_file:
+            for tref in self.refs:
+                the_file.write(tref + u"\n")
+
+
+class LinkGraph(object):
+    """
+    Read only link graph written by LinkGraphBuilder.  The arrays are memory-mapped, so answering which Refs are
+    linked to a Ref is a dict lookup and an array slice, with no database involved.
+    """
+    def __init__(self, prefix):
+        """
+        :param prefix: Path prefix of the link graph files
+        """
+        with codecs.open(prefix + REFS_SUFFIX, encoding='utf8') as the_file:
+            self.refs = the_file.read().split(u"\n")[:-1]
+        self.ref_to_id = dict((tref, ref_id) for ref_id, tref in enumerate(self.refs))
+        self.indptr = np.load(prefix + INDPTR_SUFFIX, mmap_mode='r')
+        self.indices = np.load(prefix + INDICES_SUFFIX, mmap_mode='r')
+        self.exported = np.load(prefix + EXPORTED_SUFFIX, mmap_mode='r')
+        self.segment_level = np.load(prefix + SEGMENT_LEVEL_SUFFIX, mmap_mode='r')
+
+    def __contains__(self, tref):
+        ref_id = self.ref_to_id.get(tref)
+        return ref_id is not None and bool(self.exported[ref_id])
+
+    def is_segment_level(self, tref):
+        """
+        :param tref: tref
+        :return: Boolean Value indicating if the Ref is segment level, or None if the tref is not in the graph
+        """
+        ref_id = self.ref_to_id.get(tref)
+        if ref_id is None:
+            return None
+        return bool(self.segment_level[ref_id])
+
+    def linked_ids(self, tref, segment_level=False):
+        """
+        :param tref: Selected Ref
+        :param segment_level: If True, will only include segment level Refs
+        :return: Array of the ids of all Refs linked to the selected Ref, or None if its links were not exported
+        """
+        ref_id = self.ref_to_id.get(tref)
+        if ref_id is None or not self.exported[ref_id]:
+            return None
+        linked_ids = self.indices[self.indptr[ref_id]:self.indptr[ref_id + 1]]
+        if segment_level:
+            linked_ids = linked_ids[self.segment_level[linked_ids]]
+        return linked_ids
+
+    def linked_refs(self, tref, segment_level=False):
+        """
+        Finds every Ref linked to a particular Ref.  Gives the same answer as Ref(tref).linkset() did at export time.
+        :param tref: Selected Ref
+        :param segment_level: If True, will only include segment level Refs
+        :return: List of all Refs linked to selected Ref, or None if its links were not exported
+        """
+        linked_ids = self.linked_ids(tref, segment_level)
+        if linked_ids is None:
+            return None
+        refs = self.refs
+        return [refs[linked_id] for linked_id in linked_ids.tolist()]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy import sparse
+
+
+def build_link_matrix(trefs, get_linked_refs):
+    """
+    Builds the sparse adjacency matrix of the links between a set of Refs
+    :param trefs: List of Refs, the nodes of the graph
+    :param get_linked_refs: Function that returns the list of Refs linked to a Ref
+    :return: Sparse matrix where entry (i, j) is the number of links from trefs[j] to trefs[i].
+        Links to Refs outside of trefs are dropped
+    """
+    tref_to_index = dict((tref, index) for index, tref in enumerate(trefs))
+    rows = []
+    columns = []
+    for column, tref in enumerate(trefs):
+        for linked_ref in get_linked_refs(tref):
+            row = tref_to_index.get(linked_ref)
+            if row is not None and row != column:
+                rows.append(row)
+                columns.append(column)
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.float64), (rows, columns)), shape=(len(trefs), len(trefs)))
+
+
+def personalized_page_rank(link_matrix, teleport, candidates, damping, tolerance, max_iterations):
+    """
+    Personalized PageRank of many topics at once, by power iteration on the link matrix.
+    Every topic has its own candidate subgraph: rank only flows along links between candidates of that topic,
+    and a candidate without links to other candidates gives its rank back to the teleport distribution.
+    :param link_matrix: Sparse n x n matrix from build_link_matrix
+    :param teleport: n x t matrix, the unnormalized teleport weights of every node for every topic
+    :param candidates: n x t boolean matrix marking the candidate nodes of every topic
+    :param damping: Probability of following a link instead of teleporting
+    :param tolerance: Iteration stops once no topic's rank changes by more than this (L1 norm)
+    :param max_iterations: Upper bound on the number of iterations
+    :return: n x t matrix of PageRank scores, every column sums to 1 and is 0 outside of the topic's candidates
+    """
+    candidates = np.asarray(candidates, dtype=bool)
+    mask = candidates.astype(np.float64)
+    teleport = np.where(candidates, np.clip(teleport, 0, None), 0)
+    totals = teleport.sum(axis=0)
+    teleport = np.where(totals > 0, teleport, mask)
+    teleport = teleport / np.maximum(teleport.sum(axis=0), 1e-12)
+
+    out_degree = np.asarray(link_matrix.T.dot(mask)) * mask
+    dangling = out_degree == 0
+    inverse_out_degree = np.where(dangling, 0, 1.0 / np.maximum(out_degree, 1e-12))
+
+    rank = teleport.copy()
+    for _ in range(max_iterations):
+        dangling_rank = (rank * dangling).sum(axis=0)
+        new_rank = damping * mask * np.asarray(link_matrix.dot(rank * inverse_out_degree))
+        new_rank += (1 - damping + damping * dangling_rank) * teleport
+        change = np.abs(new_rank - rank).sum(axis=0).max() if new_rank.size else 0
+        rank = new_rank
+        if change < tolerance:
+            break
+    return rank
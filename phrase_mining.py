@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import math
+import multiprocessing
+import time
+from collections import Counter
+from optparse import OptionParser
+
+from Constants import ALL_CLEAN_DOCS_FILENAME, CLEANING_PROCESSES, CLEANING_SHARDS_PER_PROCESS, CLEANING_SHARD_BYTES, \
+    MINED_PHRASES_FILENAME, PHRASE_MIN_COUNT, PHRASE_THRESHOLD, PHRASE_MAX_VOCAB, PHRASE_SHARD_MAX_VOCAB
+from file_shards import get_file_shards, read_shard_lines, iter_shard_results
+
+
+def corpus_tokens(data):
+    """
+    Splits a line of the cleaned corpus back into single words.  Phrases the corpus was built with are split again,
+    so that mined phrases do not depend on the phrase list in use.
+    :param data: A line of the cleaned corpus, in the ref||||text format
+    :return: List of words
+    """
+    return data.split(u"||||", 1)[-1].replace(u"_", u" ").split()
+
+
+def prune_counts(counts, max_size, min_reduce=1):
+    """
+    Bounds the memory of a Counter the way gensim's Phrases does: while it has more than max_size entries, drops every
+    entry whose count is below min_reduce, raising min_reduce each time
+    :param counts: Counter of n-grams
+    :param max_size: Maximum number of entries
+    :param min_reduce: Count below which entries are dropped first
+    :return: The min_reduce that was reached.  Counts below it may be underestimated
+    """
+    while len(counts) > max_size:
+        for key in [key for key, count in counts.items() if count < min_reduce]:
+            del counts[key]
+        min_reduce += 1
+    return min_reduce
+
+
+def count_ngrams(lines, max_vocab):
+    """
+    Counts the unigrams, bigrams and trigrams of cleaned corpus lines
+    :param lines: Iterable of cleaned corpus lines
+    :param max_vocab: Maximum number of distinct n-grams kept
+    :return: Tuple of (Counter of n-grams keyed by space separated words, total number of words)
+    """
+    counts = Counter()
+    num_words = 0
+    min_reduce = 1
+    for line_index, data in enumerate(lines):
+        words = corpus_tokens(data)
+        num_words += len(words)
+        counts.update(words)
+        counts.update(u" ".join(words[index:index + 2]) for index in range(len(words) - 1))
+        counts.update(u" ".join(words[index:index + 3]) for index in range(len(words) - 2))
+        if line_index % 10000 == 0 and len(counts) > max_vocab:
+            min_reduce = prune_counts(counts, max_vocab, min_reduce)
+    prune_counts(counts, max_vocab, min_reduce)
+    return counts, num_words
+
+
+def count_shard(args):
+    """
+    Worker that counts the n-grams of one byte shard of the cleaned corpus
+    :param args: Tuple of (filename, start, end, max_vocab)
+    :return: Tuple of (Counter of n-grams, number of words)
+    """
+    filename, start, end, max_vocab = args
+    return count_ngrams(read_shard_lines(filename, start, end), max_vocab)
+
+
+def count_corpus(filename, processes, max_vocab, shard_max_vocab=PHRASE_SHARD_MAX_VOCAB):
+    """
+    Counts the n-grams of the whole cleaned corpus in one pass, with one process pool task per byte shard.
+    Shards are at most CLEANING_SHARD_BYTES and only CLEANING_SHARDS_PER_PROCESS of them per process are in flight,
+    and every shard count is pruned to shard_max_vocab before it is sent back, so neither the workers nor this process
+    grow with the size of the corpus.
+    Shard counts are merged as they arrive and the merged counts are pruned to max_vocab.
+    :param filename: Cleaned corpus filename
+    :param processes: Number of worker processes
+    :param max_vocab: Maximum number of distinct n-grams kept
+    :param shard_max_vocab: Maximum number of distinct n-grams a worker keeps for one shard
+    :return: Tuple of (Counter of n-grams, total number of words)
+    """
+    shards = get_file_shards(filename, max(processes, 1) * CLEANING_SHARDS_PER_PROCESS, CLEANING_SHARD_BYTES)
+    jobs = ((filename, start, end, shard_max_vocab) for start, end in shards)
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    counts = Counter()
+    num_words = 0
+    min_reduce = 1
+    try:
+        shard_counts = iter_shard_results(pool, count_shard, jobs, max(processes, 1) * CLEANING_SHARDS_PER_PROCESS)
+        for shard_index, (shard_counter, shard_words) in enumerate(shard_counts):
+            print("shard {}/{}".format(shard_index + 1, len(shards)))
+            counts.update(shard_counter)
+            num_words += shard_words
+            min_reduce = prune_counts(counts, max_vocab, min_reduce)
+    finally:
+        if pool:
+            pool.terminate()
+    return counts, num_words
+
+
+def npmi(count_ab, count_a, count_b, num_words):
+    """
+    Normalized pointwise mutual information of two adjacent units
+    :return: NPMI between -1 and 1, 1 when the units only ever appear together
+    """
+    p_ab = count_ab / float(num_words)
+    if p_ab >= 1:
+        return 1.0
+    p_a = count_a / float(num_words)
+    p_b = count_b / float(num_words)
+    if not p_a or not p_b:
+        return -1.0
+    return math.log(p_ab / (p_a * p_b)) / -math.log(p_ab)
+
+
+def score_phrases(counts, num_words, min_count, threshold):
+    """
+    Scores every bigram and trigram with NPMI.  A trigram is scored at its weakest split: the lower of the NPMI of its
+    first two words with the third, and of its first word with the last two.
+    :param counts: Counter of n-grams from count_corpus
+    :param num_words: Total number of words
+    :param min_count: Minimum number of occurrences of a phrase
+    :param threshold: Minimum NPMI of a phrase
+    :return: List of (phrase, count, score) sorted by score
+    """
+    phrases = []
+    for ngram, count in counts.items():
+        if count < min_count:
+            continue
+        words = ngram.split(u" ")
+        if len(words) == 2:
+            score = npmi(count, counts[words[0]], counts[words[1]], num_words)
+        elif len(words) == 3:
+            first_two, last_two = u" ".join(words[:2]), u" ".join(words[1:])
+            if counts[first_two] < min_count or counts[last_two] < min_count:
+                continue
+            score = min(npmi(count, counts[first_two], counts[words[2]], num_words),
+                        npmi(count, counts[words[0]], counts[last_two], num_words))
+        else:
+            continue
+        if score >= threshold:
+            phrases.append((ngram, count, score))
+    return sorted(phrases, key=lambda x: (-x[2], -x[1], x[0]))
+
+
+def write_phrases(phrases, filename):
+    """
+    Writes a ranked phrase list that create_docs_for_doc2vec can load as its PHRASES_FILENAME,
+    and the counts and scores of the phrases next to it in a .tsv file
+    :param phrases: List of (phrase, count, score) from score_phrases
+    :param filename: Name of the phrase list
+    """
+    with codecs.open(filename, 'wb', encoding='utf8') as the_file:
+        for phrase, _, _ in phrases:
+            the_file.write(phrase + u"\n")
+    with codecs.open(filename + '.tsv', 'wb', encoding='utf8') as the_file:
+        for phrase, count, score in phrases:
+            the_file.write(u"{}\t{}\t{:.4f}\n".format(phrase, count, score))
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-i", "--input", dest="input", action="store", type="string", default=ALL_CLEAN_DOCS_FILENAME)
+    parser.add_option("-o", "--output", dest="output", action="store", type="string", default=MINED_PHRASES_FILENAME)
+    parser.add_option("-p", "--processes", dest="processes", action="store", type="int", default=CLEANING_PROCESSES)
+    parser.add_option("-c", "--min-count", dest="min_count", action="store", type="int", default=PHRASE_MIN_COUNT)
+    parser.add_option("-t", "--threshold", dest="threshold", action="store", type="float", default=PHRASE_THRESHOLD)
+    parser.add_option("-v", "--max-vocab", dest="max_vocab", action="store", type="int", default=PHRASE_MAX_VOCAB)
+    parser.add_option("-s", "--shard-max-vocab", dest="shard_max_vocab", action="store", type="int",
+                      default=PHRASE_SHARD_MAX_VOCAB)
+    (options, args) = parser.parse_args()
+
+    start = time.time()
+    counts, num_words = count_corpus(options.input, options.processes, options.max_vocab, options.shard_max_vocab)
+    phrases = score_phrases(counts, num_words, options.min_count, options.threshold)
+    write_phrases(phrases, options.output)
+    print("Mined {} phrases from {} words ({} distinct n-grams) in {:.1f}s".format(
+        len(phrases), num_words, len(counts), time.time() - start))
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import glob
+import os
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+from Constants import TEST_TOPICS, DOC2VEC_MODEL, QUANTIZED_VECTORS_SUFFIX, QUANTIZED_VECTORS_PREFIX, QUANTIZED_DTYPE
+from doc_vector_index import normalize_rows
+from ann_index import load_doc_vector_index
+
+KEYS_SUFFIX = '.{}.keys'
+DATA_SUFFIX = '.{}.{}.npy'
+SCALES_SUFFIX = '.{}.int8_scales.npy'
+DTYPES = ['float16', 'int8']
+SCORE_CHUNK_ROWS = 65536
+
+
+def get_word_vectors(model):
+    """
+    :param model: Doc2Vec or Word2Vec Model
+    :return: Tuple of (list of words, matrix of word vectors with one row per word)
+    """
+    wv = model.wv
+    words = wv.index_to_key if hasattr(wv, 'index_to_key') else wv.index2word
+    return list(words), wv.vectors
+
+
+def quantize(vectors, dtype):
+    """
+    Normalizes vectors to unit length and quantizes them
+    :param vectors: Matrix of vectors
+    :param dtype: "float16", or "int8" for int8 values with one float32 scale per row
+    :return: Tuple of (quantized matrix, array of row scales or None)
+    """
+    vectors = normalize_rows(vectors)
+    if dtype == 'float16':
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class QuantizedVectors(object):
+    """
+    Read only, quantized, unit length vectors, for serving cosine similarity queries without the training state of
+    the model.  Scores are computed directly on the quantized matrix, a chunk of rows at a time, so only one chunk
+    is ever held as float32.
+    """
+    def __init__(self, keys, data, scales=None):
+        """
+        :param keys: List of keys (words or doc tags), one per row
+        :param data: float16 or int8 matrix
+        :param scales: float32 scale of every row of an int8 matrix
+        """
+        self.keys = keys
+        self.key_to_index = dict((key, index) for index, key in enumerate(keys))
+        self.data = data
+        self.scales = scales
+
+    @staticmethod
+    def save(prefix, name, keys, vectors, dtype):
+        """
+        Quantizes vectors and saves them
+        :param prefix: Path prefix of the quantized vector files
+        :param name: Name of the vectors, "words" or "docs"
+        :param keys: List of keys, one per row
+        :param vectors: Matrix of vectors
+        :param dtype: "float16" or "int8"
+        """
+        data, scales = quantize(vectors, dtype)
+        np.save(prefix + DATA_SUFFIX.format(name, dtype), data)
+        if scales is not None:
+            np.save(prefix + SCALES_SUFFIX.format(name), scales)
+        with codecs.open(prefix + KEYS_SUFFIX.format(name), 'wb', encoding='utf8') as the_file:
+            for key in keys:
+                the_file.write(key + u"\n")
+
+    @classmethod
+    def load(cls, prefix, name, dtype):
+        """
+        Loads quantized vectors, memory-mapped
+        :param prefix: Path prefix of the quantized vector files
+        :param name: Name of the vectors, "words" or "docs"
+        :param dtype: "float16" or "int8"
+        :return: QuantizedVectors
+        """
+        with codecs.open(prefix + KEYS_SUFFIX.format(name), encoding='utf8') as the_file:
+            keys = the_file.read().split(u"\n")[:-1]
+        data = np.load(prefix + DATA_SUFFIX.format(name, dtype), mmap_mode='r')
+        scales = np.load(prefix + SCALES_SUFFIX.format(name)) if dtype == 'int8' else None
+        return cls(keys, data, scales)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.key_to_index
+
+    def nbytes(self):
+        """
+        :return: Number of bytes of the quantized matrix and its scales
+        """
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def vector(self, key):
+        """
+        :param key: Key
+        :return: Dequantized float32 vector of the key
+        """
+        index = self.key_to_index[key]
+        vector = np.asarray(self.data[index], dtype=np.float32)
+        return vector * self.scales[index] if self.scales is not None else vector
+
+    def rows(self, indices):
+        """
+        :param indices: Array of row indices
+        :return: Dequantized float32 rows
+        """
+        rows = np.asarray(self.data[indices], dtype=np.float32)
+        return rows * self.scales[indices][:, None] if self.scales is not None else rows
+
+    def scores_batch(self, keys, query_vectors):
+        """
+        Cosine similarity between many queries and particular keys, the way DocVectorIndex.scores_batch does
+        :param keys: List of keys.  Keys that are not in the vectors score 0
+        :param query_vectors: Matrix with one query vector per row
+        :return: Matrix of cosine similarities with one row per key and one column per query
+        """
+        indices = np.array([self.key_to_index.get(key, -1) for key in keys], dtype=np.int64)
+        scores = np.zeros((len(keys), len(query_vectors)), dtype=np.float32)
+        found = indices >= 0
+        scores[found] = self.rows(indices[found]).dot(normalize_rows(query_vectors).T)
+        return scores
+
+    def scores(self, query_vector):
+        """
+        :param query_vector: Vector of the query
+        :return: Array with the cosine similarity of every row to the query
+        """
+        query_vector = normalize_rows(query_vector)
+        scores = np.zeros(len(self.data), dtype=np.float32)
+        for start in range(0, len(self.data), SCORE_CHUNK_ROWS):
+            chunk = np.asarray(self.data[start:start + SCORE_CHUNK_ROWS], dtype=np.float32)
+            scores[start:start + len(chunk)] = chunk.dot(query_vector)
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def most_similar(self, query_vector, topn):
+        """
+        :param query_vector: Vector of the query
+        :param topn: Number of keys to return
+        :return: List of (key, score) of the topn most similar keys, sorted by score
+        """
+        scores = self.scores(query_vector)
+        topn = min(topn, len(scores))
+        if topn <= 0:
+            return []
+        best = np.argpartition(-scores, topn - 1)[:topn]
+        best = best[np.argsort(-scores[best], kind='mergesort')]
+        return [(self.keys[index], float(scores[index])) for index in best]
+
+    def query(self, query_vector, threshold):
+        """
+        :param query_vector: Vector of the query
+        :param threshold: Cosine Similarity Threshold
+        :return: List of (key, score) of every key above the threshold, sorted by score
+        """
+        scores = self.scores(query_vector)
+        above = np.flatnonzero(scores > threshold)
+        above = above[np.argsort(-scores[above], kind='mergesort')]
+        return [(self.keys[index], float(scores[index])) for index in above]
+
+    def query_batch(self, query_vectors, threshold):
+        """
+        :param query_vectors: Matrix with one query vector per row
+        :param threshold: Cosine Similarity Threshold
+        :return: List with one list of (key, score) per query
+        """
+        return [self.query(query_vector, threshold) for query_vector in query_vectors]
+
+
+class QuantizedModel(object):
+    """
+    Serving-only stand in for a Doc2Vec Model: quantized word vectors to look topics up and find related words,
+    and quantized doc vectors to find related sources.  Doc2Vec_test_model scores with it wherever it takes a model:
+    topic in model.wv, model[topic] and model.most_similar work as they do on a Doc2Vec Model, and the doc vectors
+    stand in for the DocVectorIndex.  Only Refs were exported, so every doc is a valid result.
+    """
+    def __init__(self, prefix=QUANTIZED_VECTORS_PREFIX, dtype=QUANTIZED_DTYPE):
+        """
+        :param prefix: Path prefix of the quantized vector files
+        :param dtype: "float16" or "int8"
+        """
+        self.dtype = dtype
+        self.words = QuantizedVectors.load(prefix, 'words', dtype)
+        self.docs = QuantizedVectors.load(prefix, 'docs', dtype)
+
+    @property
+    def wv(self):
+        return self.words
+
+    def __getitem__(self, topic):
+        return self.words.vector(topic)
+
+    def most_similar(self, positive, topn=10):
+        """
+        :param positive: List of vectors
+        :param topn: Number of words to return
+        :return: List of (word, score) of the topn words most similar to the mean of the unit length vectors
+        """
+        return self.words.most_similar(np.mean(normalize_rows(positive), axis=0), topn)
+
+    def related_words(self, topic, topn=20):
+        return self.words.most_similar(self[topic], topn)
+
+    def related_sources(self, topic, threshold):
+        return [tref for tref, _ in self.docs.query(self[topic], threshold)]
+
+
+def get_ref_doc_vectors(model, model_filename):
+    """
+    :param model: Doc2Vec Model
+    :param model_filename: Name of the Doc2Vec Model
+    :return: Tuple of (list of doc tags, matrix of unit length doc vectors), restricted to Refs
+    """
+    doc_vector_index = load_doc_vector_index(model, model_filename)
+    doc_indices = np.flatnonzero(doc_vector_index.valid)
+    return [doc_vector_index.tags[index] for index in doc_indices], doc_vector_index.vectors[doc_indices]
+
+
+def export_quantized_vectors(model, model_filename, prefix, dtypes=DTYPES):
+    """
+    Writes the word vectors and the Ref doc vectors of a model in every quantized format
+    :param model: Doc2Vec Model
+    :param model_filename: Name of the Doc2Vec Model
+    :param prefix: Path prefix of the quantized vector files
+    :param dtypes: Quantized formats to write
+    """
+    tags, doc_vectors = get_ref_doc_vectors(model, model_filename)
+    words, word_vectors = get_word_vectors(model)
+    for dtype in dtypes:
+        QuantizedVectors.save(prefix, 'words', words, word_vectors, dtype)
+        QuantizedVectors.save(prefix, 'docs', tags, doc_vectors, dtype)
+
+
+def overlap(exact, approximate):
+    """
+    :return: Fraction of the keys of an exact result that are in an approximate result of the same length
+    """
+    if not exact:
+        return 1.0
+    return len(set(key for key, _ in exact) & set(key for key, _ in approximate)) / float(len(exact))
+
+
+def report(model, model_filename, prefix, topics, topn=100):
+    """
+    Compares the quantized vectors with the float32 model: memory, query latency and top-n overlap
+    :param model: Doc2Vec Model
+    :param model_filename: Name of the Doc2Vec Model
+    :param prefix: Path prefix of the quantized vector files
+    :param topics: List of topics to query
+    :param topn: Number of related sources compared per topic
+    """
+    words, word_vectors = get_word_vectors(model)
+    exact_words = QuantizedVectors(words, normalize_rows(word_vectors))
+    exact_docs = QuantizedVectors(*get_ref_doc_vectors(model, model_filename))
+    topics = [topic for topic in topics if topic in exact_words]
+
+    model_bytes = sum(os.path.getsize(filename) for filename in glob.glob(model_filename) +
+                      glob.glob(model_filename + ".*.npy") if ".is_ref." not in filename)
+    print("{:10s} {:>12s} {:>12s} {:>14s} {:>14s}".format("format", "vectors MB", "ms/query", "sources@{}".format(topn),
+                                                         "words@20"))
+    print("{:10s} {:>12.1f}".format("model", model_bytes / 1e6))
+
+    def timed(vectors, query_vectors):
+        start = time.time()
+        results = [vectors.most_similar(query_vector, topn) for query_vector in query_vectors]
+        return results, 1000 * (time.time() - start) / max(len(query_vectors), 1)
+
+    exact_topic_vectors = [exact_words.vector(topic) for topic in topics]
+    exact_sources, exact_ms = timed(exact_docs, exact_topic_vectors)
+    exact_related_words = [exact_words.most_similar(vector, 20) for vector in exact_topic_vectors]
+    print("{:10s} {:>12.1f} {:>12.2f} {:>14.3f} {:>14.3f}".format(
+        "float32", (exact_words.nbytes() + exact_docs.nbytes()) / 1e6, exact_ms, 1.0, 1.0))
+    for dtype in DTYPES:
+        quantized = QuantizedModel(prefix, dtype)
+        topic_vectors = [quantized[topic] for topic in topics]
+        sources, ms = timed(quantized.docs, topic_vectors)
+        related_words = [quantized.words.most_similar(vector, 20) for vector in topic_vectors]
+        print("{:10s} {:>12.1f} {:>12.2f} {:>14.3f} {:>14.3f}".format(
+            dtype, (quantized.words.nbytes() + quantized.docs.nbytes()) / 1e6, ms,
+            np.mean([overlap(a, b) for a, b in zip(exact_sources, sources)]),
+            np.mean([overlap(a, b) for a, b in zip(exact_related_words, related_words)])))
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog export|report [options]")
+    parser.add_option("-m", "--model", dest="model", action="store", type="string", default=DOC2VEC_MODEL)
+    parser.add_option("-p", "--prefix", dest="prefix", action="store", type="string", default=None,
+                      help="Path prefix of the quantized vectors, defaults to the model filename followed by " +
+                      QUANTIZED_VECTORS_SUFFIX)
+    (options, args) = parser.parse_args()
+    command = args[0] if args else "export"
+    options.prefix = options.prefix or options.model + QUANTIZED_VECTORS_SUFFIX
+
+    from gensim.models import Doc2Vec
+    model = Doc2Vec.load(options.model)
+    if command == "export":
+        start = time.time()
+        export_quantized_vectors(model, options.model, options.prefix)
+        print("Exported quantized vectors in {:.1f}s".format(time.time() - start))
+    elif command != "report":
+        parser.error("unknown command {}".format(command))
+    report(model, options.model, options.prefix, TEST_TOPICS)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import multiprocessing
+import threading
+import time
+import traceback
+from collections import deque
+from optparse import OptionParser
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from Constants import TEST_TOPICS, DOC2VEC_MODEL, QUERY_SERVER_HOST, QUERY_SERVER_PORT, QUERY_SERVER_PROCESSES, \
+    USE_ANN_INDEX
+import evaluate_topics
+import Doc2Vec_test_model as test_model
+from quantized_vectors import DTYPES
+
+LATENCY_WINDOW = 10000
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+def related_sources(topic):
+    """
+    Worker for the related-sources endpoint
+    :param topic: Topic
+    :return: List of the top 100 (source, score) pairs, or None if the topic is not in the model
+    """
+    if topic not in evaluate_topics.model.wv:
+        return None
+    try:
+        return test_model.evaluate_topic(evaluate_topics.model, topic)
+    finally:
+        test_model.ref_cache.commit()
+
+
+def related_words(topic):
+    """
+    Worker for the related-words endpoint
+    :param topic: Topic
+    :return: List of the 20 most similar (word, score) pairs, or None if the topic is not in the model
+    """
+    if topic not in evaluate_topics.model.wv:
+        return None
+    return test_model.evaluate_words(evaluate_topics.model, topic)
+
+
+ENDPOINTS = {
+    "/related_sources": related_sources,
+    "/related_words": related_words,
+}
+
+
+class QueryCoalescer(object):
+    """
+    Sends queries to a process pool.  A query that is already being computed is not sent again: every request for it
+    waits on the same result.
+    """
+    def __init__(self, pool):
+        """
+        :param pool: multiprocessing Pool, or None to compute queries in the calling thread
+        """
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.coalesced = 0
+
+    def get(self, function, topic):
+        """
+        :param function: Worker function of the endpoint
+        :param topic: Topic
+        :return: Result of function(topic)
+        """
+        key = (function.__name__, topic)
+        with self.lock:
+            pending = self.in_flight.get(key)
+            if pending is None:
+                pending = self.in_flight[key] = self.submit(function, topic)
+            else:
+                self.coalesced += 1
+        try:
+            return pending.get()
+        finally:
+            with self.lock:
+                if self.in_flight.get(key) is pending:
+                    del self.in_flight[key]
+
+    def submit(self, function, topic):
+        if self.pool is not None:
+            return self.pool.apply_async(function, (topic,))
+        return ImmediateResult(function, topic)
+
+
+class ImmediateResult(object):
+    """
+    Stands in for an AsyncResult when there is no process pool.  Computes the result once, in the first thread that
+    asks for it, while other threads asking for it wait.
+    """
+    def __init__(self, function, topic):
+        self.function = function
+        self.topic = topic
+        self.lock = threading.Lock()
+        self.done = False
+        self.result = None
+
+    def get(self):
+        with self.lock:
+            if not self.done:
+                self.result = self.function(self.topic)
+                self.done = True
+        return self.result
+
+
+class LatencyStats(object):
+    """
+    Keeps the latency of the most recent requests of every endpoint and status and reports their percentiles
+    """
+    def __init__(self, window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.window = window
+        self.latencies = {}
+        self.counts = {}
+
+    def record(self, endpoint, seconds):
+        with self.lock:
+            self.latencies.setdefault(endpoint, deque(maxlen=self.window)).append(1000 * seconds)
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def report(self):
+        """
+        :return: Dict mapping each endpoint to its request count and latency percentiles in milliseconds
+        """
+        with self.lock:
+            report = {}
+            for endpoint, latencies in self.latencies.items():
+                percentiles = np.percentile(list(latencies), LATENCY_PERCENTILES)
+                report[endpoint] = dict([("requests", self.counts[endpoint])] +
+                                        [("p{}_ms".format(p), round(float(value), 2))
+                                         for p, value in zip(LATENCY_PERCENTILES, percentiles)])
+            return report
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /related_sources?topic=...  top 100 related sources of a topic
+    GET /related_words?topic=...    20 most similar words of a topic
+    GET /stats                      request counts, latency percentiles and cache counters
+    Latency is recorded for every request, keyed by endpoint and status, so errors show up in /stats too.
+    """
+    def do_GET(self):
+        start = time.time()
+        url = urlparse(self.path)
+        self.response_status = None
+        try:
+            self.answer(url)
+        finally:
+            endpoint = url.path if url.path == "/stats" or url.path in ENDPOINTS else "unknown"
+            self.server.latency_stats.record("{} {}".format(endpoint, self.response_status or 500),
+                                             time.time() - start)
+
+    def answer(self, url):
+        """
+        Sends the response to a GET request
+        :param url: Parsed url of the request
+        """
+        if url.path == "/stats":
+            self.send_json(200, {
+                "latency": self.server.latency_stats.report(),
+                "coalesced": self.server.coalescer.coalesced,
+                "ref_cache": test_model.ref_cache.report(),
+                "result_cache": test_model.result_cache.report() if test_model.result_cache is not None else None,
+            })
+            return
+        function = ENDPOINTS.get(url.path)
+        topics = parse_qs(url.query).get("topic")
+        if function is None:
+            self.send_json(404, {"error": "unknown endpoint {}".format(url.path)})
+            return
+        if not topics:
+            self.send_json(400, {"error": "missing topic"})
+            return
+        topic = topics[0]
+        if not isinstance(topic, type(u"")):
+            topic = topic.decode('utf8')
+        try:
+            result = self.server.coalescer.get(function, topic)
+        except Exception as e:
+            traceback.print_exc()
+            self.send_json(500, {"error": u"{}: {}".format(type(e).__name__, e)})
+            return
+        if result is None:
+            self.send_json(404, {"error": u"{} is not in the model".format(topic)})
+        else:
+            self.send_json(200, {"topic": topic, "results": result})
+
+    def send_json(self, status, obj):
+        self.response_status = status
+        body = json.dumps(obj, ensure_ascii=False)
+        body = body.encode('utf8') if isinstance(body, type(u"")) else body
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QueryServer(ThreadingMixIn, HTTPServer):
+    """
+    Resident topic-query server.  Each request is handled in its own thread, which waits on the process pool
+    that does the CPU bound scoring.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, coalescer):
+        HTTPServer.__init__(self, address, QueryRequestHandler)
+        self.coalescer = coalescer
+        self.latency_stats = LatencyStats()
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-m", "--model", dest="model", action="store", type="string", default=DOC2VEC_MODEL)
+    parser.add_option("--host", dest="host", action="store", type="string", default=QUERY_SERVER_HOST)
+    parser.add_option("--port", dest="port", action="store", type="int", default=QUERY_SERVER_PORT)
+    parser.add_option("-p", "--processes", dest="processes", action="store", type="int",
+                      default=QUERY_SERVER_PROCESSES or multiprocessing.cpu_count())
+    parser.add_option("--warm-up", dest="warm_up", action="store_true", default=False,
+                      help="Compute the related sources of Constants.TEST_TOPICS before serving")
+    parser.add_option("-q", "--quantized", dest="quantized", action="store", type="choice", choices=DTYPES,
+                      default=None, help="Serve from the quantized vectors exported by quantized_vectors.py")
+    parser.add_option("--ann", dest="ann", action="store_true", default=USE_ANN_INDEX,
+                      help="Answer threshold queries approximately with the ANN index of the model")
+    (options, args) = parser.parse_args()
+
+    start = time.time()
+    test_model.use_ann_index = options.ann
+    test_model.prepare_evaluation()
+    evaluate_topics.load_shared_model(options.model, options.quantized)
+    if options.warm_up:
+        test_model.evaluate_model_topics(evaluate_topics.model, TEST_TOPICS)
+    pool = multiprocessing.Pool(options.processes) if options.processes > 1 else None
+    server = QueryServer((options.host, options.port), QueryCoalescer(pool))
+    print("Loaded in {:.1f}s, serving on http://{}:{} with {} processes".format(
+        time.time() - start, options.host, options.port, options.processes))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if pool:
+            pool.terminate()
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import codecs
+import hashlib
+import os
+
+import numpy as np
+
+from ref_cache import ref_cache
+from ref_engine import TALMUD_ADDRESS_REGEX, address_to_number
+from instrumentation import instrumentation
+
+RANGE_INDEX_VERSION = 1
+POSITION_DEPTH = 3
+POSITION_RADIX = 10000
+
+REFS_SUFFIX = '.refs'
+BOOKS_SUFFIX = '.books'
+INDPTR_SUFFIX = '.indptr.npy'
+STARTS_SUFFIX = '.starts.npy'
+ENDS_SUFFIX = '.ends.npy'
+DIGEST_SUFFIX = '.digest'
+
+
+def range_index_exists(prefix):
+    """
+    :param prefix: Path prefix of the range index files
+    :return: Boolean Value determining if every file of the range index exists
+    """
+    return all(os.path.exists(prefix + suffix)
+               for suffix in [REFS_SUFFIX, BOOKS_SUFFIX, INDPTR_SUFFIX, STARTS_SUFFIX, ENDS_SUFFIX, DIGEST_SUFFIX])
+
+
+def ranged_refs_digest(ranged_refs):
+    """
+    :param ranged_refs: List of ranged trefs
+    :return: Hex digest of the ranged trefs, in order, which tells whether a saved index was built from them
+    """
+    digest = hashlib.sha1(u"{}\n".format(RANGE_INDEX_VERSION).encode('utf8'))
+    for tref in ranged_refs:
+        digest.update(tref.encode('utf8'))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def section_number(address):
+    """
+    :param address: Section as it appears in a tref, like 12 or 2a
+    :return: Number of the section, or None if it is not a valid address
+    """
+    return address_to_number(address, u"Talmud" if TALMUD_ADDRESS_REGEX.match(address) else u"Integer")
+
+
+def position(sections, pad):
+    """
+    Packs the sections of a tref into one integer that sorts the way the sections do
+    For Example: [1, 3] ----> 100030000 padded with 0
+    :param sections: Section numbers
+    :param pad: Number the missing levels are filled with, 0 for the start of a tref and POSITION_RADIX - 1 for its end
+    :return: Position, or None if the sections do not fit
+    """
+    if not sections or len(sections) > POSITION_DEPTH or not all(0 < section < POSITION_RADIX for section in sections):
+        return None
+    packed = 0
+    for section in sections + [pad] * (POSITION_DEPTH - len(sections)):
+        packed = packed * POSITION_RADIX + section
+    return packed
+
+
+def parse_positions(tref):
+    """
+    Parses a tref in normal form into the positions of its first and last segment, without the library.
+    Ranges may repeat the sections they share, like Berakhot 2a:3-2a:7
+    :param tref: tref
+    :return: Tuple of (book title, start position, end position, is range), or None if the tref cannot be parsed
+    """
+    if u" " not in tref:
+        return None
+    title, address = tref.rsplit(u" ", 1)
+    parts = address.split(u"-")
+    if len(parts) > 2:
+        return None
+    sections = [section_number(part) for part in parts[0].split(u":")]
+    to_sections = [section_number(part) for part in parts[-1].split(u":")]
+    if None in sections or None in to_sections or len(to_sections) > len(sections):
+        return None
+    to_sections = sections[:len(sections) - len(to_sections)] + to_sections
+    start = position(sections, 0)
+    end = position(to_sections, POSITION_RADIX - 1)
+    if start is None or end is None or end < start:
+        return None
+    return title, start, end, len(parts) == 2
+
+
+class RangeIndex(object):
+    """
+    Maps segment trefs to the ranged tref they belong to without expanding any range into its segments.
+    Every ranged tref is stored as the interval of positions it covers in its book, and a segment is found with a
+    binary search of the starts of its book.  A position packs the sections of a tref into one integer,
+    POSITION_RADIX per level, so 1:3 and 2a:7 are compared the way Sefaria orders them.
+    The index is stored as:
+        <prefix>.refs         ranged trefs, one per line, grouped by book and sorted by start within a book
+        <prefix>.books        titles of the books, one per line
+        <prefix>.indptr.npy   int64, the ranges of book i are rows indptr[i]:indptr[i + 1]
+        <prefix>.starts.npy   int64 start position of every range
+        <prefix>.ends.npy     int64 end position of every range
+        <prefix>.digest       digest of the ranged trefs the index was built from
+    Ranges of a book are expected not to overlap, like the Herzog ranges and the sugyot.
+    """
+    def __init__(self, ranged_refs, books, indptr, starts, ends, digest):
+        """
+        :param ranged_refs: List of ranged trefs, grouped by book and sorted by start within a book
+        :param books: List of book titles
+        :param indptr: The ranges of book i are indptr[i]:indptr[i + 1]
+        :param starts: Start position of every range
+        :param ends: End position of every range
+        :param digest: Digest of the ranged trefs the index was built from
+        """
+        self.ranged_refs = ranged_refs
+        self.books = books
+        self.book_to_id = dict((title, book_id) for book_id, title in enumerate(books))
+        self.indptr = [int(x) for x in indptr]
+        self.starts = [int(x) for x in starts]
+        self.ends = [int(x) for x in ends]
+        self.digest = digest
+
+    def __len__(self):
+        return len(self.ranged_refs)
+
+    @classmethod
+    @instrumentation.timed("range index", count_items=len)
+    def build(cls, ranged_refs, refs=ref_cache):
+        """
+        :param ranged_refs: List of ranged trefs
+        :param refs: RefCache used for ranged trefs that are not in normal form, through their first and last segment
+        :return: RangeIndex
+        """
+        intervals = {}
+        overlaps = 0
+        for ranged_ref in ranged_refs:
+            parsed = parse_positions(ranged_ref)
+            if parsed is None:
+                segments = refs.segments(ranged_ref) or []
+                first = parse_positions(segments[0]) if segments else None
+                last = parse_positions(segments[-1]) if segments else None
+                if first is None or last is None or first[0] != last[0]:
+                    print(u"Skipping {}, it is not a valid ranged ref".format(ranged_ref).encode('utf8'))
+                    continue
+                parsed = first[0], first[1], last[2], True
+            title, start, end, _ = parsed
+            intervals.setdefault(title, []).append((start, end, ranged_ref))
+
+        books = sorted(intervals)
+        indptr, starts, ends, sorted_refs = [0], [], [], []
+        for title in books:
+            previous_end = -1
+            for start, end, ranged_ref in sorted(intervals[title]):
+                if start <= previous_end:
+                    overlaps += 1
+                previous_end = max(previous_end, end)
+                starts.append(start)
+                ends.append(end)
+                sorted_refs.append(ranged_ref)
+            indptr.append(len(starts))
+        if overlaps:
+            print("{} ranged refs overlap the range before them, "
+                  "segments are only found in the one starting last".format(overlaps))
+        return cls(sorted_refs, books, indptr, starts, ends, ranged_refs_digest(ranged_refs))
+
+    def save(self, prefix):
+        """
+        Writes the range index
+        :param prefix: Path prefix of the range index files
+        """
+        np.save(prefix + INDPTR_SUFFIX, np.array(self.indptr, dtype=np.int64))
+        np.save(prefix + STARTS_SUFFIX, np.array(self.starts, dtype=np.int64))
+        np.save(prefix + ENDS_SUFFIX, np.array(self.ends, dtype=np.int64))
+        for suffix, lines in [(REFS_SUFFIX, self.ranged_refs), (BOOKS_SUFFIX, self.books)]:
+            with codecs.open(prefix + suffix, 'wb', encoding='utf8') as the_file:
+                for line in lines:
+                    the_file.write(line + u"\n")
+        with open(prefix + DIGEST_SUFFIX, 'w') as the_file:
+            the_file.write(self.digest)
+
+    @classmethod
+    def load(cls, prefix):
+        """
+        :param prefix: Path prefix of the range index files
+        :return: RangeIndex
+        """
+        lines = []
+        for suffix in [REFS_SUFFIX, BOOKS_SUFFIX]:
+            with codecs.open(prefix + suffix, encoding='utf8') as the_file:
+                lines.append(the_file.read().split(u"\n")[:-1])
+        with open(prefix + DIGEST_SUFFIX) as the_file:
+            digest = the_file.read().strip()
+        return cls(lines[0], lines[1], np.load(prefix + INDPTR_SUFFIX), np.load(prefix + STARTS_SUFFIX),
+                   np.load(prefix + ENDS_SUFFIX), digest)
+
+    @classmethod
+    def load_or_build(cls, ranged_refs, prefix, refs=ref_cache):
+        """
+        Loads the saved range index if it was built from the same ranged trefs, otherwise builds and saves it
+        :param ranged_refs: List of ranged trefs
+        :param prefix: Path prefix of the range index files
+        :param refs: RefCache used for ranged trefs that are not in normal form
+        :return: RangeIndex
+        """
+        if range_index_exists(prefix):
+            range_index = cls.load(prefix)
+            if range_index.digest == ranged_refs_digest(ranged_refs):
+                return range_index
+        range_index = cls.build(ranged_refs, refs)
+        range_index.save(prefix)
+        return range_index
+
+    def locate_row(self, tref):
+        """
+        :param tref: Segment tref
+        :return: Tuple of (row of the ranged tref containing the segment, book title, start position of the segment,
+            end position of the segment), or None if no ranged tref contains the segment
+        """
+        parsed = parse_positions(tref)
+        if parsed is None or parsed[3]:
+            return None
+        title, start, end, _ = parsed
+        book_id = self.book_to_id.get(title)
+        if book_id is None:
+            return None
+        row = bisect.bisect_right(self.starts, start, self.indptr[book_id], self.indptr[book_id + 1]) - 1
+        if row < self.indptr[book_id] or self.ends[row] < end:
+            return None
+        return row, title, start, end
+
+    def locate(self, tref):
+        """
+        :param tref: Segment tref
+        :return: Tuple of (ranged tref, position of the segment, Boolean Value indicating if the segment ends where the
+            range ends), or None if no ranged tref contains the segment.  The end of a range given in sections, like
+            Berakhot 2a-3b, is padded past its last segment, so no segment ends where such a range ends
+        """
+        located = self.locate_row(tref)
+        if located is None:
+            return None
+        row, _, start, end = located
+        return self.ranged_refs[row], start, self.ends[row] == end
+
+    def lookup(self, tref):
+        """
+        :param tref: Segment tref
+        :return: The ranged tref containing the segment, or None if there is none
+        """
+        located = self.locate(tref)
+        return located[0] if located is not None else None
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+from ref_cache import ref_cache
+from range_index import RangeIndex
+from instrumentation import instrumentation
+
+
+@instrumentation.timed("range expansion")
+def segment_range_dicts(topic_ranged_refs, refs=ref_cache):
+    """
+    Creates two dictionaries.  These are mappings between ranged refs and segments refs.
+    This receives a list of ranged refs.  It iterates over every ranged ref and creates a mapping between the ranged refs and the segment refs.
+    :param topic_ranged_refs: list of ranged refs
+    :param refs: RefCache the ranges are expanded with
+    :return: tuple of dicts. The first is dict mapping ranged refs to all segment refs.  The second is a dict mapping each segment ref to its corresponding ranged ref.
+    """
+    ranged_to_segment = {}
+    segment_to_ranged = {}
+
+    for topic_ranged_ref in topic_ranged_refs:
+        ranged_to_segment[topic_ranged_ref] = {}
+        for seg_ref in refs.segments(topic_ranged_ref):
+            ranged_to_segment[topic_ranged_ref][seg_ref] = ""
+            segment_to_ranged[seg_ref] = topic_ranged_ref
+
+    return ranged_to_segment, segment_to_ranged
+
+
+def concatenate_sematically_linked_segments(topic_ranged_refs, ranged_to_segment, refs=ref_cache):
+    """
+    Combines multiple Sefaria Segments into one larger segment based on sematical meaning
+    :param topic_ranged_refs: List of ranged trefs that define the semantic separation
+    :param ranged_to_segment: Nested dict.  First layer points from Ranged Refs to all sub-seg-refs.  The nested dict points from the sub_seg_ref to the text of said sub_seg_ref
+    :param refs: RefCache the ranges are expanded with
+    :return: Dict containing semantically define ranged refs corresponding to their concatenated text
+    """
+    semantic_linked_segments = {}
+    for text_ranged_ref in topic_ranged_refs:
+        all_text_subrefs = refs.segments(text_ranged_ref)
+        all_verses = [ranged_to_segment[text_ranged_ref][seg_ref] for seg_ref in all_text_subrefs]
+        semantic_linked_segments[text_ranged_ref] = u' '.join(all_verses)
+    return semantic_linked_segments
+
+
+class RangedSegmentBuffer(object):
+    """
+    Holds the cleaned text of segments that belong to semantically defined ranged refs.
+    Only ranges that are still in progress are kept in memory.  A range is released as soon as the last segment of
+    its range_list() has been added, or as soon as a segment of the same book past the end of the range arrives,
+    which also releases ranges given in sections, like Berakhot 2a-3b, whose last segment is not known without
+    expanding them.  At most the last range of every book is held until flush.
+    The segments of a range therefore have to arrive before the range is released.  A segment arriving after its range
+    was written raises a ValueError instead of being dropped.
+    Segments are matched to their range with a RangeIndex, and a range is only expanded into its segments when it is
+    released, one at a time.
+    """
+    def __init__(self, topic_ranged_refs, refs=ref_cache):
+        """
+        :param topic_ranged_refs: list of ranged refs
+        :param refs: RefCache the ranges are expanded with when they are released
+        """
+        self.topic_ranged_refs = topic_ranged_refs
+        self.refs = refs
+        self.range_index = RangeIndex.build(topic_ranged_refs, refs)
+        self.in_progress = {}
+        self.open_rows = {}
+        self.flushed = set()
+
+    @instrumentation.timed("range concatenation")
+    def concatenate(self, topic_ranged_ref):
+        """
+        Joins the buffered segments of a ranged ref in range_list() order and drops them from the buffer.
+        Segments that were never seen contribute an empty string, like in concatenate_sematically_linked_segments.
+        :param topic_ranged_ref: ranged tref
+        :return: Tuple of (ranged ref, concatenated text)
+        """
+        segment_texts = self.in_progress.pop(topic_ranged_ref, {})
+        self.flushed.add(topic_ranged_ref)
+        all_verses = [segment_texts.get(seg_ref, u"") for seg_ref in self.refs.segments(topic_ranged_ref) or []]
+        return topic_ranged_ref, u' '.join(all_verses)
+
+    def add(self, ref, data):
+        """
+        Buffers the text of a segment ref
+        :param ref: segment tref
+        :param data: cleaned text of the segment
+        :return: List of (ranged ref, concatenated text) tuples of the ranges this segment completed, in book order
+        :raise ValueError: If the range of the segment was already written
+        """
+        located = self.range_index.locate_row(ref)
+        if located is None:
+            raise KeyError(ref)
+        row, title, start, end = located
+        topic_ranged_ref = self.range_index.ranged_refs[row]
+        if topic_ranged_ref in self.flushed:
+            raise ValueError(u"Segment {} arrived after {} was written, the segments of a range have to be "
+                             u"in order".format(ref, topic_ranged_ref))
+        open_rows = self.open_rows.setdefault(title, set())
+        completed_rows = sorted(open_row for open_row in open_rows if self.range_index.ends[open_row] < start)
+        self.in_progress.setdefault(topic_ranged_ref, {})[ref] = data
+        open_rows.add(row)
+        if self.range_index.ends[row] == end:
+            completed_rows.append(row)
+        open_rows.difference_update(completed_rows)
+        return [self.concatenate(self.range_index.ranged_refs[completed_row]) for completed_row in completed_rows]
+
+    def flush(self):
+        """
+        Releases every range that has not been completed yet, in the order the ranges were defined
+        :return: Generator of (ranged ref, concatenated text) tuples
+        """
+        for topic_ranged_ref in self.topic_ranged_refs:
+            if topic_ranged_ref not in self.flushed:
+                yield self.concatenate(topic_ranged_ref)
+        self.open_rows = {}
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import sqlite3
+from collections import Counter, OrderedDict, namedtuple
+
+from Constants import REF_CACHE_FILENAME, REF_CACHE_SIZE
+
+SCHEMA = [
+    "DROP TABLE IF EXISTS refs",
+    "CREATE TABLE IF NOT EXISTS ref_infos (tref TEXT PRIMARY KEY, version TEXT, info TEXT)",
+]
+COMMIT_EVERY = 10000
+
+RefInfo = namedtuple('RefInfo', ['normal', 'is_range', 'is_segment_level', 'index_title', 'segments'])
+
+
+def sefaria_ref_info(tref):
+    """
+    Parses a tref with Sefaria.  Requires django to be set up.
+    :param tref: tref
+    :return: RefInfo of the tref, or None if the tref is not a valid Ref
+    """
+    from sefaria.model import Ref
+    from sefaria.system.exceptions import InputError
+    try:
+        oref = Ref(tref)
+        return RefInfo(oref.normal(), oref.is_range(), oref.is_segment_level(), oref.index.title,
+                       [seg_ref.normal() for seg_ref in oref.range_list()])
+    except InputError:
+        return None
+
+
+def library_ref_info(tref):
+    """
+    Parses a tref with the library snapshot if one was exported, otherwise with Sefaria
+    :param tref: tref
+    :return: RefInfo of the tref, or None if the tref is not a valid Ref
+    """
+    from ref_engine import get_ref_engine
+    engine = get_ref_engine()
+    if engine is not None:
+        return engine.ref_info(tref)
+    return sefaria_ref_info(tref)
+
+
+def library_resolver_version():
+    """
+    Fingerprints the parser library_ref_info uses, so that trefs parsed by one are never answered for the other.
+    The snapshot is fingerprinted by the digest of its file, Sefaria by the titles of its library, which change
+    whenever a text is added or renamed
+    :return: Fingerprint of the parser
+    """
+    from ref_engine import get_ref_engine, setup_sefaria
+    engine = get_ref_engine()
+    if engine is not None:
+        return u"snapshot {}".format(engine.digest)
+    setup_sefaria()
+    from sefaria.model import library
+    digest = hashlib.sha1()
+    for title in sorted(library.full_title_list()):
+        digest.update(title.encode('utf8') + b"\n")
+    return u"sefaria {}".format(digest.hexdigest())
+
+
+class RefCache(object):
+    """
+    Memoizes what the pipeline needs to know about a tref: its normal form, whether it is a range, whether it is
+    segment level, the title of its index and the segment refs of its range_list().
+    Recently used trefs are kept in memory, bounded to max_size entries.  Every tref that was ever parsed is kept on
+    disk, so later runs and other stages of the pipeline do not parse it again.  Invalid trefs are cached as None.
+    Every tref on disk is stored with the version of the parser that answered it, and trefs of any other version,
+    invalid ones included, are dropped when the on-disk cache is opened.
+    """
+    def __init__(self, resolve, filename=None, max_size=REF_CACHE_SIZE, version=None):
+        """
+        :param resolve: Function that parses a tref into a RefInfo, or None if the tref is invalid
+        :param filename: Optional name of the on-disk cache
+        :param max_size: Number of trefs kept in memory
+        :param version: Function returning the fingerprint of the parser, required with an on-disk cache.
+            It is called once, when the on-disk cache is first opened
+        """
+        self.resolve = resolve
+        self.filename = filename
+        self.max_size = max_size
+        self.get_version = version
+        self.version = None
+        self.memory = OrderedDict()
+        self.connection = None
+        self.connection_pid = None
+        self.forked_connections = []
+        self.pending_writes = 0
+        self.stats = Counter()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['connection'] = None
+        state['forked_connections'] = []
+        return state
+
+    def get_connection(self):
+        """
+        :return: Connection to the on-disk cache, or None if there is no on-disk cache.
+        A process forked after the connection was opened opens its own, since sqlite connections can not be shared
+        """
+        if self.filename is None:
+            return None
+        if self.connection is not None and self.connection_pid != os.getpid():
+            self.forked_connections.append(self.connection)
+            self.connection = None
+            self.pending_writes = 0
+        if self.connection is None:
+            if self.version is None:
+                self.version = self.get_version()
+            self.connection = sqlite3.connect(self.filename, timeout=60)
+            self.connection_pid = os.getpid()
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            invalidated = self.connection.execute("DELETE FROM ref_infos WHERE version != ?",
+                                                  (self.version,)).rowcount
+            self.connection.commit()
+            if invalidated:
+                print("Ref cache: dropped {} trefs parsed by another version of the library".format(invalidated))
+        return self.connection
+
+    def remember(self, tref, info):
+        """
+        Adds a tref to the in-memory cache, evicting the least recently used tref if the cache is full
+        """
+        self.memory[tref] = info
+        if len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def get(self, tref):
+        """
+        :param tref: tref
+        :return: RefInfo of the tref, or None if the tref is not a valid Ref
+        """
+        if tref in self.memory:
+            info = self.memory.pop(tref)
+            self.memory[tref] = info
+            self.stats[u"memory_hits"] += 1
+            return info
+
+        connection = self.get_connection()
+        if connection is not None:
+            row = connection.execute("SELECT info FROM ref_infos WHERE tref = ? AND version = ?",
+                                     (tref, self.version)).fetchone()
+            if row is not None:
+                info = json.loads(row[0])
+                info = RefInfo(*info) if info is not None else None
+                self.remember(tref, info)
+                self.stats[u"disk_hits"] += 1
+                return info
+
+        info = self.resolve(tref)
+        self.remember(tref, info)
+        self.stats[u"misses"] += 1
+        if connection is not None:
+            connection.execute("INSERT OR REPLACE INTO ref_infos VALUES (?, ?, ?)",
+                               (tref, self.version, json.dumps(list(info) if info is not None else None)))
+            self.pending_writes += 1
+            if self.pending_writes >= COMMIT_EVERY:
+                self.commit()
+        return info
+
+    def commit(self):
+        """
+        Writes the trefs parsed since the last commit to disk
+        """
+        if self.connection is not None and self.connection_pid == os.getpid():
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def normal(self, tref):
+        """
+        :return: Normal form of the tref, or None if the tref is not a valid Ref
+        """
+        info = self.get(tref)
+        return info.normal if info is not None else None
+
+    def is_range(self, tref):
+        """
+        :return: Boolean Value indicating if the tref is a ranged Ref, or None if the tref is not a valid Ref
+        """
+        info = self.get(tref)
+        return info.is_range if info is not None else None
+
+    def is_segment_level(self, tref):
+        """
+        :return: Boolean Value indicating if the tref is segment level, or None if the tref is not a valid Ref
+        """
+        info = self.get(tref)
+        return info.is_segment_level if info is not None else None
+
+    def index_title(self, tref):
+        """
+        :return: Title of the index of the tref, or None if the tref is not a valid Ref
+        """
+        info = self.get(tref)
+        return info.index_title if info is not None else None
+
+    def segments(self, tref):
+        """
+        :return: Normal forms of every segment in the range_list() of the tref, or None if the tref is not a valid Ref
+        """
+        info = self.get(tref)
+        return info.segments if info is not None else None
+
+    def report(self):
+        """
+        :return: One line summary of the hit and miss counters
+        """
+        lookups = sum(self.stats.values())
+        hits = self.stats[u"memory_hits"] + self.stats[u"disk_hits"]
+        return "Ref cache: {} lookups, {} memory hits, {} disk hits, {} misses ({:.1%} hit rate)".format(
+            lookups, self.stats[u"memory_hits"], self.stats[u"disk_hits"], self.stats[u"misses"],
+            float(hits) / lookups if lookups else 0.0)
+
+
+ref_cache = RefCache(library_ref_info, REF_CACHE_FILENAME, version=library_resolver_version)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import re
+import time
+from optparse import OptionParser
+
+from Constants import USE_LIBRARY_SNAPSHOT, LIBRARY_SNAPSHOT_FILENAME
+from ref_cache import RefInfo
+from title_resolver import TitleResolver
+
+SNAPSHOT_VERSION = 1
+TALMUD_ADDRESS_REGEX = re.compile(u"^(\\d+)([ab])$")
+
+ref_engine = None
+sefaria_set_up = False
+
+
+def library_snapshot_exists(filename=LIBRARY_SNAPSHOT_FILENAME):
+    """
+    :param filename: Name of the library snapshot
+    :return: Boolean Value indicating if the snapshot was exported
+    """
+    return os.path.exists(filename)
+
+
+def address_to_number(address, address_type):
+    """
+    Converts one section of a tref to the number Sefaria stores it as
+    For Example: 2a ----> 3 and 2b ----> 4 for Talmud, 12 ----> 12 for everything else
+    :param address: Section as it appears in a tref
+    :param address_type: Sefaria address type of the section
+    :return: Number of the section, or None if it is not a valid address
+    """
+    if address_type == u"Talmud":
+        match = TALMUD_ADDRESS_REGEX.match(address)
+        if not match:
+            return None
+        return int(match.group(1)) * 2 - (1 if match.group(2) == u"a" else 0)
+    if not address.isdigit():
+        return None
+    return int(address)
+
+
+def number_to_address(number, address_type):
+    """
+    The inverse of address_to_number
+    :param number: Number of the section
+    :param address_type: Sefaria address type of the section
+    :return: Section as it appears in a tref in normal form
+    """
+    if address_type == u"Talmud":
+        return u"{}{}".format((number + 1) // 2, u"a" if number % 2 else u"b")
+    return u"{}".format(number)
+
+
+class RefEngine(object):
+    """
+    Parses trefs with an exported library snapshot instead of Sefaria, so that the pipeline does not need django.
+    The snapshot holds, for every text node of the library, its index title and categories, the address type of each
+    level and the number of segments of every section.
+    Only trefs in normal form are understood, as they appear in the Dicta Prefix file, the range files and the models,
+    and the answers are the ones sefaria_ref_info gives for them: normal form, is_range, is_segment_level, the index
+    title and the segments of range_list().
+    """
+    def __init__(self, snapshot, digest=None):
+        """
+        :param snapshot: Dict loaded from the library snapshot
+        :param digest: Hex digest of the snapshot file, which tells whether two engines answer the same
+        """
+        if snapshot.get(u"version") != SNAPSHOT_VERSION:
+            raise ValueError("Library snapshot is not of version {}".format(SNAPSHOT_VERSION))
+        self.nodes = snapshot[u"nodes"]
+        self.digest = digest
+        self.titles = TitleResolver()
+        for title in self.nodes:
+            self.titles.add_title(title, None)
+
+    @classmethod
+    def load(cls, filename=LIBRARY_SNAPSHOT_FILENAME):
+        """
+        :param filename: Name of the library snapshot
+        :return: RefEngine
+        """
+        with open(filename, 'rb') as the_file:
+            data = the_file.read()
+        return cls(json.loads(data.decode('utf8')), hashlib.sha1(data).hexdigest())
+
+    @staticmethod
+    def length(counts, sections):
+        """
+        :param counts: Nested segment counts of a node
+        :param sections: Section numbers leading to a sub-array of the node
+        :return: Number of elements of the sub-array, or None if it does not exist
+        """
+        for section in sections:
+            if isinstance(counts, int) or not 1 <= section <= len(counts):
+                return None
+            counts = counts[section - 1]
+        return counts if isinstance(counts, int) else len(counts)
+
+    def parse(self, tref):
+        """
+        :param tref: tref in normal form.  Ranges may repeat the sections they share, like Berakhot 2a:3-2a:7
+        :return: Tuple of (node title, sections, to sections), or None if the tref is not a valid Ref
+        """
+        title = self.titles.resolve_title(tref)
+        if title is None:
+            return None
+        node = self.nodes[title]
+        address = tref[len(title):].strip()
+        if not address:
+            return title, [], []
+        parts = address.split(u"-")
+        if len(parts) > 2:
+            return None
+        address_types = node[u"address_types"]
+        from_addresses = parts[0].split(u":")
+        to_addresses = parts[-1].split(u":")
+        if len(from_addresses) > node[u"depth"] or len(to_addresses) > len(from_addresses):
+            return None
+        offset = len(from_addresses) - len(to_addresses)
+        sections = [address_to_number(part, address_types[index]) for index, part in enumerate(from_addresses)]
+        to_sections = sections[:offset] + [address_to_number(part, address_types[offset + index])
+                                           for index, part in enumerate(to_addresses)]
+        if None in sections or None in to_sections or to_sections < sections:
+            return None
+        for path in (sections, to_sections):
+            length = self.length(node[u"counts"], path[:-1])
+            if length is None or not 1 <= path[-1] <= length:
+                return None
+        return title, sections, to_sections
+
+    def normal(self, title, sections, to_sections):
+        """
+        :return: Normal form of a parsed tref.  The to part of a range only repeats the sections that differ
+        """
+        if not sections:
+            return title
+        address_types = self.nodes[title][u"address_types"]
+        from_part = u":".join(number_to_address(section, address_types[index])
+                              for index, section in enumerate(sections))
+        if to_sections == sections:
+            return u"{} {}".format(title, from_part)
+        first_difference = next(index for index, (a, b) in enumerate(zip(sections, to_sections)) if a != b)
+        to_part = u":".join(number_to_address(to_sections[index], address_types[index])
+                            for index in range(first_difference, len(to_sections)))
+        return u"{} {}-{}".format(title, from_part, to_part)
+
+    def range_list(self, title, sections, to_sections):
+        """
+        :return: List of every section path of a parsed range, at the depth of the range, in order
+        """
+        counts = self.nodes[title][u"counts"]
+        paths = []
+
+        def walk(prefix):
+            depth = len(prefix)
+            if depth == len(sections):
+                paths.append(prefix)
+                return
+            low = sections[depth] if prefix == sections[:depth] else 1
+            high = to_sections[depth] if prefix == to_sections[:depth] else self.length(counts, prefix)
+            for section in range(low, high + 1):
+                walk(prefix + [section])
+        walk([])
+        return paths
+
+    def ref_info(self, tref):
+        """
+        Parses a tref with the library snapshot, standing in for sefaria_ref_info
+        :param tref: tref
+        :return: RefInfo of the tref, or None if the tref is not a valid Ref
+        """
+        parsed = self.parse(tref)
+        if parsed is None:
+            return None
+        title, sections, to_sections = parsed
+        node = self.nodes[title]
+        normal = self.normal(title, sections, to_sections)
+        is_range = sections != to_sections
+        segments = [self.normal(title, path, path) for path in self.range_list(title, sections, to_sections)] \
+            if is_range else [normal]
+        return RefInfo(normal, is_range, len(sections) == node[u"depth"], node[u"index"], segments)
+
+    def is_ref(self, tref):
+        """
+        :param tref: tref
+        :return: Boolean Value indicating if the tref is a valid Ref
+        """
+        return self.parse(tref) is not None
+
+
+def get_ref_engine():
+    """
+    Loads the library snapshot the first time it is needed
+    :return: RefEngine, or None if USE_LIBRARY_SNAPSHOT is not set or no snapshot was exported
+    """
+    global ref_engine
+    if ref_engine is None and USE_LIBRARY_SNAPSHOT and library_snapshot_exists():
+        ref_engine = RefEngine.load()
+    return ref_engine
+
+
+def setup_sefaria(force=False):
+    """
+    Sets up django for Sefaria, unless the library snapshot stands in for it
+    :param force: Set up Sefaria even if there is a library snapshot, for stages that need the database
+    :return: Boolean Value indicating if Sefaria is set up
+    """
+    global sefaria_set_up
+    if not sefaria_set_up and (force or get_ref_engine() is None):
+        import local_settings
+        import django
+        django.setup()
+        sefaria_set_up = True
+    return sefaria_set_up
+
+
+def is_ref(tref):
+    """
+    :param tref: tref
+    :return: Boolean Value indicating if the tref is a valid Ref, according to the library snapshot if there is one
+    """
+    engine = get_ref_engine()
+    if engine is not None:
+        return engine.is_ref(tref)
+    setup_sefaria()
+    from sefaria.model import Ref
+    return Ref.is_ref(tref)
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options] tref...")
+    parser.add_option("-s", "--snapshot", dest="snapshot", action="store", type="string",
+                      default=LIBRARY_SNAPSHOT_FILENAME)
+    (options, args) = parser.parse_args()
+
+    start = time.time()
+    engine = RefEngine.load(options.snapshot)
+    print("Loaded {} text nodes in {:.3f}s".format(len(engine.nodes), time.time() - start))
+    for tref in args:
+        tref = tref.decode('utf8') if isinstance(tref, bytes) else tref
+        print(u"{}: {}".format(tref, engine.ref_info(tref)).encode('utf8'))
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version TEXT, result TEXT, last_used REAL)",
+    "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)",
+]
+
+
+def files_fingerprint(prefixes, exclude_suffixes=()):
+    """
+    Fingerprints saved files by their names, sizes and modification times, which is cheap even for large models.
+    :param prefixes: List of file names or glob patterns.  Every file starting with one of them followed by a dot is
+        included, so a model is fingerprinted along with the arrays gensim saved next to it
+    :param exclude_suffixes: Suffixes of files that are left out, such as files derived from the model which are
+        written after the fingerprint was taken
+    :return: Hex digest of the files
+    """
+    digest = hashlib.sha1()
+    for prefix in prefixes:
+        for filename in sorted(set(glob.glob(prefix) + glob.glob(prefix + ".*"))):
+            if filename.endswith(tuple(exclude_suffixes)):
+                continue
+            stat = os.stat(filename)
+            digest.update(u"{}|{}|{}\n".format(filename, stat.st_size, int(stat.st_mtime)).encode('utf8'))
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Persistent cache of query results.  Every result is stored with the version of the data it was computed from,
+    and results of any other version are dropped when the cache is opened, so retraining the model invalidates them.
+    The cache holds at most max_entries results, evicting the least recently used ones.
+    Every write is committed right away, so that processes sharing the cache file never wait on each other's locks.
+    """
+    def __init__(self, filename, version, max_entries):
+        """
+        :param filename: Name of the cache file
+        :param version: Fingerprint of the data results are computed from
+        :param max_entries: Maximum number of results kept
+        """
+        self.filename = filename
+        self.version = version
+        self.max_entries = max_entries
+        self.connection = None
+        self.connection_pid = None
+        self.forked_connections = []
+        self.stats = Counter()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['connection'] = None
+        state['forked_connections'] = []
+        return state
+
+    def get_connection(self):
+        """
+        :return: Connection to the cache file.  A process forked after the connection was opened opens its own
+        """
+        if self.connection is not None and self.connection_pid != os.getpid():
+            self.forked_connections.append(self.connection)
+            self.connection = None
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.filename, timeout=60)
+            self.connection_pid = os.getpid()
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            self.stats[u"invalidated"] += self.connection.execute("DELETE FROM results WHERE version != ?",
+                                                                  (self.version,)).rowcount
+            self.connection.commit()
+        return self.connection
+
+    @staticmethod
+    def make_key(*args):
+        """
+        :return: Cache key of a query with the given parameters
+        """
+        return json.dumps(args, ensure_ascii=False)
+
+    def get(self, key):
+        """
+        :param key: Cache key from make_key
+        :return: The cached result, or None if it is not cached
+        """
+        connection = self.get_connection()
+        row = connection.execute("SELECT result FROM results WHERE key = ? AND version = ?",
+                                 (key, self.version)).fetchone()
+        if row is None:
+            self.stats[u"misses"] += 1
+            return None
+        self.stats[u"hits"] += 1
+        connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        connection.commit()
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        """
+        :param key: Cache key from make_key
+        :param result: JSON serializable result
+        """
+        connection = self.get_connection()
+        connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                           (key, self.version, json.dumps(result, ensure_ascii=False), time.time()))
+        self.stats[u"evicted"] += connection.execute(
+            "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)).rowcount
+        connection.commit()
+
+    def report(self):
+        """
+        :return: One line summary of the cache counters
+        """
+        return "Result cache: {} hits, {} misses, {} evicted, {} invalidated".format(
+            self.stats[u"hits"], self.stats[u"misses"], self.stats[u"evicted"], self.stats[u"invalidated"])
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import sqlite3
+from collections import Counter
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS segments (ref TEXT PRIMARY KEY, content_hash TEXT, config_key TEXT, cleaned TEXT)",
+    "CREATE TABLE IF NOT EXISTS manifest (component TEXT PRIMARY KEY, fingerprint TEXT)",
+]
+COMMIT_EVERY = 10000
+
+
+def file_fingerprint(filename):
+    """
+    Hashes the content of a file
+    :param filename: Name of the file
+    :return: Hex digest of the file, or None if the file does not exist
+    """
+    if not os.path.exists(filename):
+        return None
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as the_file:
+        for block in iter(lambda: the_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash(text):
+    """
+    :param text: Raw text of a segment
+    :return: Hex digest of the text
+    """
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+class SegmentCache(object):
+    """
+    Manifest of every cleaned segment of a previous build, used to rebuild the corpus incrementally.
+    Each entry holds the hash of the raw segment text, the cleaning configuration it was cleaned with and the
+    cleaned text.  A segment is re-cleaned only if it is new, its text changed, or the configuration changed.
+
+    The previous build is only ever read, so any number of worker processes can look segments up.
+    The current build is written by a single process to a new file, which replaces the previous build on commit.
+    Segments that are not seen again are dropped, which is how deleted segments leave the manifest.
+    """
+    def __init__(self, filename, fingerprint):
+        """
+        :param filename: Name of the manifest file
+        :param fingerprint: Dict mapping each component of the cleaning configuration to its fingerprint
+        """
+        self.filename = filename
+        self.fingerprint = fingerprint
+        self.config_key = hashlib.sha1(json.dumps(sorted(fingerprint.items())).encode('utf8')).hexdigest()
+        self.reader = None
+        self.writer = None
+        self.pending_writes = 0
+        self.stats = Counter()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['reader'] = None
+        state['writer'] = None
+        return state
+
+    def get_reader(self):
+        """
+        :return: Read only connection to the previous build, or None if there is no previous build
+        """
+        if self.reader is None and os.path.exists(self.filename):
+            self.reader = sqlite3.connect(self.filename)
+        return self.reader
+
+    def lookup(self, ref, segment_hash):
+        """
+        Looks a segment up in the previous build
+        :param ref: tref of the segment
+        :param segment_hash: Hash of the raw segment text
+        :return: Tuple of (status, cleaned text).  Status is "unchanged", "changed" or "new".
+        The cleaned text is None unless the status is "unchanged"
+        """
+        reader = self.get_reader()
+        if reader is None:
+            return u"new", None
+        row = reader.execute("SELECT content_hash, config_key, cleaned FROM segments WHERE ref = ?", (ref,)).fetchone()
+        if row is None:
+            return u"new", None
+        if row[0] == segment_hash and row[1] == self.config_key:
+            return u"unchanged", row[2]
+        return u"changed", None
+
+    def previous_fingerprint(self):
+        """
+        :return: Dict of the configuration fingerprint the previous build was made with
+        """
+        reader = self.get_reader()
+        if reader is None:
+            return {}
+        return dict(reader.execute("SELECT component, fingerprint FROM manifest").fetchall())
+
+    def changed_components(self):
+        """
+        :return: Sorted list of configuration components that differ from the previous build
+        """
+        previous = self.previous_fingerprint()
+        if not previous:
+            return []
+        return sorted(component for component, fingerprint in self.fingerprint.items()
+                      if previous.get(component) != fingerprint)
+
+    def record(self, ref, segment_hash, cleaned, status):
+        """
+        Writes a segment to the current build
+        :param ref: tref of the segment
+        :param segment_hash: Hash of the raw segment text
+        :param cleaned: Cleaned text of the segment
+        :param status: Status returned by lookup
+        """
+        if self.writer is None:
+            if os.path.exists(self.filename + '.new'):
+                os.remove(self.filename + '.new')
+            self.writer = sqlite3.connect(self.filename + '.new')
+            for statement in SCHEMA:
+                self.writer.execute(statement)
+        self.writer.execute("INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?)",
+                            (ref, segment_hash, self.config_key, cleaned))
+        self.stats[status] += 1
+        self.pending_writes += 1
+        if self.pending_writes >= COMMIT_EVERY:
+            self.writer.commit()
+            self.pending_writes = 0
+
+    def commit(self):
+        """
+        Finishes the current build and makes it the previous build of the next run
+        :return: Counter with the number of unchanged, changed, new and deleted segments
+        """
+        reader = self.get_reader()
+        if reader is not None:
+            previous_total = reader.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+            self.stats[u"deleted"] = previous_total - self.stats[u"unchanged"] - self.stats[u"changed"]
+            reader.close()
+            self.reader = None
+        if self.writer is not None:
+            self.writer.executemany("INSERT OR REPLACE INTO manifest VALUES (?, ?)",
+                                    [(component, fingerprint) for component, fingerprint in self.fingerprint.items()])
+            self.writer.commit()
+            self.writer.close()
+            self.writer = None
+            os.rename(self.filename + '.new', self.filename)
+        return self.stats
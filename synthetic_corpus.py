@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import codecs
+import random
+import re
+from optparse import OptionParser
+
+from Constants import PHRASES_FILENAME, STOPWORDS_FILENAME, SYNTHETIC_CORPUS_FILENAME
+from ref_cache import RefInfo
+
+HEBREW_LETTERS = u"אבגדהוזחטיכלמנסעפצקרשת"
+PREFIXES = [u"ו", u"ה", u"ב", u"ל", u"מ", u"ש", u"וה", u"וב", u"כש"]
+SUFFIX_WORDS = [u"שלו", u"שלה", u"שלהם", u"שלנו", u"שלך"]
+QUOTES = [u'"', u"'", u"״", u"׳"]
+SYNTHETIC_REF_REGEX = re.compile(u"^(.+) (\\d+):(\\d+)(?:-(\\d+))?$")
+
+
+def read_word_list(filename):
+    """
+    :param filename: UTF-8 file with one word or phrase per line
+    :return: List of the lines of the file
+    """
+    return codecs.open(filename, encoding='utf8').read().strip().split(u'\n')
+
+
+class SyntheticCorpus(object):
+    """
+    Generates lines in the Dicta Prefix format (ref~~text), without the Dicta export.
+    The text mixes a random vocabulary with the real stopwords and phrases, and with everything the cleaning stages
+    remove: ┉ prefix markers, html tags, parentheticals, square brackets, maqaf and quotes.  Refs belong to synthetic
+    books of chapters and verses, grouped into ranged refs the way Tanakh and Talmud segments are.
+    Everything is drawn from one seeded generator, so a seed always gives the same corpus.
+    """
+    def __init__(self, stopwords, phrases, vocabulary_size=20000, num_books=20, chapters_per_book=30,
+                 verses_per_chapter=25, seed=0):
+        """
+        :param stopwords: List of stopwords
+        :param phrases: List of multiple word phrases
+        :param vocabulary_size: Number of synthetic words
+        :param num_books: Number of synthetic books
+        :param chapters_per_book: Number of chapters of every book
+        :param verses_per_chapter: Number of verses of every chapter
+        :param seed: Random seed
+        """
+        self.random = random.Random(seed)
+        self.stopwords = stopwords
+        self.phrases = phrases
+        self.books = [u"Synthetic {}".format(index + 1) for index in range(num_books)]
+        self.chapters_per_book = chapters_per_book
+        self.verses_per_chapter = verses_per_chapter
+        self.vocabulary = sorted(set(self.random_word() for _ in range(vocabulary_size)))
+
+    def random_word(self):
+        """
+        :return: A random Hebrew word of 2 to 7 letters
+        """
+        return u"".join(self.random.choice(HEBREW_LETTERS) for _ in range(self.random.randint(2, 7)))
+
+    def refs(self):
+        """
+        :return: Generator of every segment tref, in book order
+        """
+        for book in self.books:
+            for chapter in range(1, self.chapters_per_book + 1):
+                for verse in range(1, self.verses_per_chapter + 1):
+                    yield u"{} {}:{}".format(book, chapter, verse)
+
+    def ranged_refs(self, min_length=2, max_length=8):
+        """
+        Groups the verses of every chapter into consecutive ranges
+        :return: List of ranged trefs covering every segment tref
+        """
+        ranged_refs = []
+        for book in self.books:
+            for chapter in range(1, self.chapters_per_book + 1):
+                verse = 1
+                while verse <= self.verses_per_chapter:
+                    last_verse = min(verse + self.random.randint(min_length, max_length) - 1, self.verses_per_chapter)
+                    ranged_refs.append(u"{} {}:{}-{}".format(book, chapter, verse, last_verse))
+                    verse = last_verse + 1
+        return ranged_refs
+
+    def word(self):
+        """
+        :return: A word of the text, with the noise the cleaning stages have to remove
+        """
+        roll = self.random.random()
+        if roll < 0.2:
+            return self.random.choice(self.stopwords)
+        if roll < 0.25:
+            return self.random.choice(self.phrases)
+        word = self.random.choice(self.vocabulary)
+        if roll < 0.4:
+            return u"{}┉{}".format(self.random.choice(PREFIXES), word)
+        if roll < 0.43:
+            return u"<b>{}</b>".format(word)
+        if roll < 0.46:
+            return u"({} {})".format(word, self.random.choice(self.vocabulary))
+        if roll < 0.48:
+            return u"[{}]".format(word)
+        if roll < 0.51:
+            return u"{}־{}".format(word, self.random.choice(self.vocabulary))
+        if roll < 0.54:
+            return u"{0}{1}{0}".format(self.random.choice(QUOTES), word)
+        return word
+
+    def line(self, tref, min_words=5, max_words=40):
+        """
+        :param tref: Ref of the line
+        :return: A line in the Dicta Prefix format
+        """
+        text = u" ".join(self.word() for _ in range(self.random.randint(min_words, max_words)))
+        return u"{}~~{}\n".format(tref, text)
+
+    def lines(self, num_lines):
+        """
+        :param num_lines: Number of lines.  The refs of the synthetic books repeat if there are more lines than refs
+        :return: Generator of lines in the Dicta Prefix format
+        """
+        num_written = 0
+        while num_written < num_lines:
+            for tref in self.refs():
+                if num_written >= num_lines:
+                    return
+                yield self.line(tref)
+                num_written += 1
+
+    def word_expander(self, fraction=0.1):
+        """
+        :param fraction: Fraction of the vocabulary that is expanded
+        :return: Dict mapping words to a prefix-root-suffix replacement, like the one hebrew_spellcheck compiles
+        """
+        expander = {}
+        for word in self.vocabulary:
+            if self.random.random() < fraction:
+                expander[word] = u"{} {}".format(word[:-1], self.random.choice(SUFFIX_WORDS))
+        return expander
+
+
+def synthetic_ref_info(tref):
+    """
+    Parses a tref of a synthetic book, standing in for sefaria_ref_info
+    :param tref: tref such as "Synthetic 3 4:5" or "Synthetic 3 4:5-9"
+    :return: RefInfo of the tref, or None if it is not a synthetic tref
+    """
+    match = SYNTHETIC_REF_REGEX.match(tref)
+    if not match:
+        return None
+    book, chapter, first_verse, last_verse = match.groups()
+    first_verse = int(first_verse)
+    last_verse = int(last_verse) if last_verse else first_verse
+    segments = [u"{} {}:{}".format(book, chapter, verse) for verse in range(first_verse, last_verse + 1)]
+    return RefInfo(tref, last_verse != first_verse, last_verse == first_verse, book, segments)
+
+
+def load_synthetic_corpus(seed=0, **kwargs):
+    """
+    :return: SyntheticCorpus with the stopwords and phrases of the repository
+    """
+    return SyntheticCorpus(read_word_list(STOPWORDS_FILENAME), read_word_list(PHRASES_FILENAME), seed=seed, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-o", "--output", dest="output", action="store", type="string",
+                      default=SYNTHETIC_CORPUS_FILENAME)
+    parser.add_option("-n", "--lines", dest="lines", action="store", type="int", default=100000)
+    parser.add_option("-s", "--seed", dest="seed", action="store", type="int", default=0)
+    (options, args) = parser.parse_args()
+
+    corpus = load_synthetic_corpus(options.seed)
+    with codecs.open(options.output, 'wb', encoding='utf8') as the_file:
+        for line in corpus.lines(options.lines):
+            the_file.write(line)
+    print("Wrote {} synthetic lines to {}".format(options.lines, options.output))
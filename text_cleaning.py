@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import regex as re
+
+from Constants import PHRASES_FILENAME, STOPWORDS_FILENAME
+
+import hebrew_spellcheck
+from hebrew_tokenizer import HebrewTokenizer, PhraseTrie
+from instrumentation import instrumentation
+word_expander = hebrew_spellcheck.word_expander
+
+stopwords = codecs.open(STOPWORDS_FILENAME, encoding='utf8').read().strip().split('\n')
+stopwords_regex = u"(?:\s|^)({})(?=\s|$)".format(u"|".join(stopwords))
+stopwords_regex = re.compile(stopwords_regex)
+
+phrases = codecs.open(PHRASES_FILENAME, encoding='utf8').read().strip().split('\n')
+phrase_trie = PhraseTrie(phrases)
+
+sefaria_tokenizer = HebrewTokenizer(stopwords, phrases, word_expander, prefix_marker=u"┉")
+wiki_tokenizer = HebrewTokenizer(stopwords, phrases, word_expander, prefix_marker=u"|")
+
+
+@instrumentation.timed("suffix expansion")
+def pull_out_suffix(string):
+    """
+    Receives a string of Hebrew Text.  Iterates over every hebrew word and splits each
+    word into its root and suffix.
+    :param string: String of Hebrew Text
+    :return: String with Hebrew compound words split into Root and Suffix
+    """
+    string = string.split()
+    string = ' '.join([word_expander.get(word, word) for word in string])
+    return string
+
+
+@instrumentation.timed("stopwords")
+def remove_stopwords(string):
+    """
+    Replaces Stopwords with a space character
+    :param string: String of Hebrew Text
+    :return: String without stopwords
+    """
+    return re.sub(stopwords_regex, u' ', string)
+
+
+@instrumentation.timed("prefix removal")
+def remove_dicta_prefix(string, marker):
+    """
+    Removes prefixes that were detected by Dicta
+    :param string: String of Hebrew Text
+    :return: String without prefixes
+    """
+    return re.sub(ur'[\u05d0-\u05ea]+{}'.format(marker), u'', string)
+    # return re.sub(ur'[\u05d0-\u05ea]+┉', u'', string)
+
+
+@instrumentation.timed("punctuation")
+def remove_punctuation(data):
+    """
+    Removes various punctation from Hebrew text.
+    :param data: String of Hebrew Text
+    :return: String without punctuation
+    """
+    data = re.sub(ur'־', u' ', data)
+    data = re.sub(ur'\([^)]+\)', u' ', data)
+    data = re.sub(ur'<[^>]+>', u' ', data)
+    data = re.sub(ur'\[[^\]]+\]', u' ', data)
+    data = re.sub(ur'[^ \u05d0-\u05ea"\'״׳]', u' ', data)
+    data = re.sub(ur'(^|\s)["\'״׳]+', u' ', data)
+    data = re.sub(ur'["\'״׳]+(\s|$)', u' ', data)
+    return data
+
+
+def strip_stopwords_and_remove_punctuation(data):
+    """
+    This method takes a string of hebrew text and does all necessary cleaning for Word2Vec.
+    :param data: String of Hebrew Text
+    :return: String ready for Word2Vec model
+    """
+    data = data.strip().split(u'~~')[1]
+    data = remove_dicta_prefix(data, u"┉")
+    data = remove_punctuation(data)
+    data = pull_out_suffix(data)
+    data = remove_stopwords(data)
+    data = u' '.join(data.split())
+    return data
+
+
+@instrumentation.timed("phrase joining")
+def create_multiple_word_phrases(data):
+    """
+    Combines selected multiple word phrases with underscore.  When phrases overlap, the longest one is joined.
+    For example:  New York ----> New_York
+    This allows Word2Vec to handle multiple word phrases
+    :param data: String of Hebrew Text
+    :return: String with connected multiple word phrases
+    """
+    return u' '.join(phrase_trie.join(data.split()))
+
+
+def this_is_a_bad_line(data):
+    """
+    Checks to see if a line from the file should be included in the Word2Vec model.
+    There are some lines within the Dicta Prefix file that we cannot or do not want to include.
+    :param data: line of hebrew text from Dicta File
+    :return: Boolean Value determining if this line valid
+    """
+    if u'~~' not in data:
+        return True
+    if data.strip().split(u'~~')[1].strip().startswith(u"<br><br><big><strong>הדרן עלך"):
+        return True
+
+    return False
+
+
+def extract_reference(data):
+    """
+    Extract Sefaria Ref from a line in the Dicta Prefix file
+    :param data: A line from the dicta file
+    :return: The Corresponding tref
+    """
+    return data.split(u'~')[0]
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+TITLE_END = u"__title__"
+
+
+class TitleResolver(object):
+    """
+    Classifies trefs by the book title they start with, without parsing a Ref.
+    Titles are stored in a trie keyed on the words of the title, so that resolving a tref costs
+    one dict lookup per word of its title.  The longest title followed by an address (or by nothing) wins,
+    so "Genesis 1:1" resolves to Genesis while "Genesis Rabbah 1:1" does not.
+    Trefs are expected to be in normal form, as they appear in the Dicta Prefix file.
+    """
+    def __init__(self):
+        self.root = {}
+        self.categories = {}
+
+    def add_title(self, title, category):
+        """
+        Adds a book title to the resolver
+        :param title: Book title.  For Example: II Kings
+        :param category: Category the book belongs to.  For Example: tanakh
+        """
+        node = self.root
+        for word in title.split(u" "):
+            node = node.setdefault(word, {})
+        node[TITLE_END] = title
+        self.categories[title] = category
+
+    def add_titles(self, titles, category):
+        """
+        Adds many book titles that belong to the same category
+        :param titles: Iterable of book titles
+        :param category: Category the books belong to
+        """
+        for title in titles:
+            self.add_title(title, category)
+
+    def resolve_title(self, tref):
+        """
+        Finds the book title a tref belongs to
+        :param tref: tref to be examined
+        :return: Book title, or None if the tref does not start with a known title
+        """
+        words = tref.split(u" ")
+        node = self.root
+        title = None
+        for index, word in enumerate(words):
+            node = node.get(word)
+            if node is None:
+                break
+            if TITLE_END in node:
+                next_index = index + 1
+                if next_index == len(words) or words[next_index][:1].isdigit():
+                    title = node[TITLE_END]
+        return title
+
+    def category(self, tref):
+        """
+        Finds the category of the book a tref belongs to
+        :param tref: tref to be examined
+        :return: Category, or None if the tref does not start with a known title
+        """
+        title = self.resolve_title(tref)
+        if title is None:
+            return None
+        return self.categories[title]
+
+    def is_from_category(self, tref, category):
+        """
+        Checks to see if a tref belongs to a book within a particular category
+        For Example:  Is Genesis 12:3 within Tanakh
+        :param tref: tref to be examined
+        :param category: Category to check
+        :return: Boolean Value determining if Tref is within category
+        """
+        return self.category(tref) == category
+
+
+def title_from_tref(tref):
+    """
+    Removes the address from a tref that is in normal form
+    For Example: Berakhot 2a:1-5 ----> Berakhot
+    :param tref: tref in normal form
+    :return: The title part of the tref
+    """
+    return tref.rsplit(u" ", 1)[0]